@@ -8,7 +8,7 @@ from typing import List, Optional, Set, Tuple
 import tqdm
 
 from .DatasetDescription import DataRequest
-from pylingual.utils.generate_bytecode import compile_version
+from pylingual.utils.generate_bytecode import CompilerPool, compile_version
 from .normalize_source import normalize_source
 from pylingual.masking.ast_masker import add_dummy_decorators
 
@@ -17,6 +17,7 @@ def transfer_and_compile_file(
     original_file: pathlib.Path,
     destination_file: pathlib.Path,
     version: Tuple[int, int],
+    compiler_pool: Optional[CompilerPool] = None,
 ) -> Optional[Exception]:
     # copy over normalized source file
     try:
@@ -30,12 +31,13 @@ def transfer_and_compile_file(
     destination_file.parent.mkdir(parents=True, exist_ok=True)
     destination_file.write_text(normalized_source)
 
-    # compile the copied file with the given version
+    # compile the copied file with the given version, on the persistent compile workers of this process unless a pool is given
     try:
         compile_version(
             destination_file.resolve(),
             destination_file.with_suffix(".pyc").resolve(),
             version,
+            pool=compiler_pool,
         )
     except Exception as err:
         return err
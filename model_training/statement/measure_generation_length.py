@@ -0,0 +1,61 @@
+import csv
+import math
+import pathlib
+
+import click
+from transformers import RobertaTokenizer
+
+
+def read_statement_rows(csv_dir: pathlib.Path):
+    for csv_path in sorted(csv_dir.rglob("*.csv")):
+        with csv_path.open(newline="") as csv_file:
+            for row in csv.DictReader(csv_file):
+                if row.get("bytecode") and row.get("source"):
+                    yield row["bytecode"], row["source"]
+
+
+def quantile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def measure_generation_length(tokenizer: RobertaTokenizer, csv_dir: pathlib.Path, q: float, min_input_tokens: int, batch_size: int = 1024) -> tuple[float, int, int, int]:
+    """
+    Measure how many target tokens the statement model needs per input token
+
+    :return: (ratio, offset, max target tokens, number of statements) such that ceil(ratio * input tokens) + offset covers the q quantile of the targets
+    """
+    lengths = []
+    rows = list(read_statement_rows(csv_dir))
+    for start in range(0, len(rows), batch_size):
+        bytecode, source = zip(*rows[start : start + batch_size])
+        inputs = tokenizer(list(bytecode))["input_ids"]
+        targets = tokenizer(text_target=list(source))["input_ids"]
+        lengths.extend((len(i), len(t)) for i, t in zip(inputs, targets))
+    if not lengths:
+        raise ValueError(f"No statement rows found in {csv_dir}")
+
+    # the ratio is measured on longer inputs, where it is stable; the offset covers short inputs
+    ratio = quantile([t / i for i, t in lengths if i >= min_input_tokens] or [t / i for i, t in lengths], q)
+    offset = math.ceil(quantile([max(0, t - math.ceil(ratio * i)) for i, t in lengths], q))
+    return ratio, offset, max(t for _, t in lengths), len(lengths)
+
+
+@click.command(help="Measure generation limits for a statement model from its statement CSVs, printed as a decompiler_config.yaml entry.")
+@click.argument("csv_dir", type=pathlib.Path)
+@click.argument("tokenizer_repo_name", type=str)
+@click.option("-q", "--quantile", "q", default=0.999, type=float, help="Fraction of training statements the limit must cover.")
+@click.option("--min-input-tokens", default=32, type=int, help="Shortest input used to measure the ratio.")
+def main(csv_dir: pathlib.Path, tokenizer_repo_name: str, q: float, min_input_tokens: int):
+    tokenizer = RobertaTokenizer.from_pretrained(tokenizer_repo_name)
+    ratio, offset, longest, n_statements = measure_generation_length(tokenizer, csv_dir, q, min_input_tokens)
+    click.echo(f"# longest target in the training data: {longest} tokens")
+    click.echo("    MAX_NEW_TOKENS:")
+    click.echo(f"      # covers the {q} quantile of {n_statements} training statements, with the ratio measured on inputs of at least {min_input_tokens} tokens")
+    click.echo(f"      RATIO: {math.ceil(ratio * 1000) / 1000}")
+    click.echo(f"      OFFSET: {offset}")
+    click.echo("      CAP: 512")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,3 @@
-from .decompiler import decompile
+from .decompiler import decompile, decompile_many
 
-__all__ = ["decompile"]
+__all__ = ["decompile", "decompile_many"]
@@ -0,0 +1,6 @@
+from .base import SEGMENTATION_LABELS, SegmentationBackend, TranslationBackend
+from .lazy import LazySegmentationBackend, LazyTranslationBackend
+from .onnx_backend import OnnxSegmentationBackend, OnnxTranslationBackend
+from .torch_backend import TorchSegmentationBackend, TorchTranslationBackend
+
+__all__ = ["SEGMENTATION_LABELS", "SegmentationBackend", "TranslationBackend", "LazySegmentationBackend", "LazyTranslationBackend", "OnnxSegmentationBackend", "OnnxTranslationBackend", "TorchSegmentationBackend", "TorchTranslationBackend"]
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import json
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable
+
+if TYPE_CHECKING:
+    import numpy as np
+    import transformers
+
+# written next to exported and pulled models to record which checkpoint they came from
+EXPORT_INFO_FILE = "pylingual_export.json"
+
+# column order of the label probabilities returned by SegmentationBackend.token_probabilities
+SEGMENTATION_LABELS = ("B", "I", "E")
+
+
+class SegmentationBackend(ABC):
+    """
+    Token classification model used by Decompiler as its segmenter
+
+    :param tokenizer: Tokenizer of the segmentation model
+    """
+
+    def __init__(self, tokenizer: transformers.PreTrainedTokenizerBase):
+        self.tokenizer = tokenizer
+
+    @abstractmethod
+    def __call__(self, requests: Iterable[str], batch_size: int = 8) -> list[list[dict]]:
+        """
+        Classify the tokens of each request
+
+        :param requests: Bytecode windows joined by <SEP>
+        :param batch_size: Number of requests per model batch
+        :return: For each request, a dict per non-special token with its "entity", "score", "index" and "word",
+                 like the token-classification pipeline without aggregation
+        """
+
+    @abstractmethod
+    def token_probabilities(self, windows: Iterable[list[int]], batch_size: int = 8) -> list[np.ndarray]:
+        """
+        Run windows that are already tokenized through the model, without building a result per token
+
+        :param windows: Input ids of each window, including the special tokens
+        :param batch_size: Number of windows per model batch
+        :return: For each window, an array of shape (window length, 3) with the label probabilities of each of its tokens in SEGMENTATION_LABELS order
+        """
+
+    def memory_bytes(self) -> int:
+        """Approximate memory held by the model weights"""
+        return 0
+
+
+class TranslationBackend(ABC):
+    """
+    Sequence to sequence model used by CacheTranslator to translate statements
+
+    :param tokenizer: Tokenizer of the statement model
+    """
+
+    def __init__(self, tokenizer: transformers.PreTrainedTokenizerBase):
+        self.tokenizer = tokenizer
+
+    @abstractmethod
+    def generate(self, requests: list[str], max_new_tokens: int) -> list[list[int]]:
+        """
+        Translate one batch of requests
+
+        :param requests: Normalized statements
+        :param max_new_tokens: Maximum number of tokens to generate per request
+        :return: Generated token ids of each request, including special tokens
+        """
+
+    def memory_bytes(self) -> int:
+        """Approximate memory held by the model weights"""
+        return 0
+
+
+def label_columns(label2id: dict[str, int]) -> list[int]:
+    """
+    :param label2id: label2id of the segmentation model config
+    :return: Indices of the model's logits that put them in SEGMENTATION_LABELS order
+    """
+    return [int(label2id[label]) for label in SEGMENTATION_LABELS]
+
+
+def token_classification_results(tokenizer: transformers.PreTrainedTokenizerBase, input_ids: list[int], probabilities: np.ndarray) -> list[dict]:
+    """
+    Per-token results like the token-classification pipeline without aggregation, special tokens are skipped
+
+    :param input_ids: Input ids of one window
+    :param probabilities: Label probabilities of each token of the window in SEGMENTATION_LABELS order
+    """
+    labels = probabilities.argmax(-1).tolist()
+    words = tokenizer.convert_ids_to_tokens(input_ids)
+    special_ids = set(tokenizer.all_special_ids)
+    return [{"entity": SEGMENTATION_LABELS[labels[index]], "score": float(probabilities[index, labels[index]]), "index": index, "word": words[index]} for index, token_id in enumerate(input_ids) if token_id not in special_ids]
+
+
+def read_export_info(model_dir: Path) -> dict:
+    """
+    :return: The model config entry the model in model_dir was exported from
+    """
+    info_file = model_dir / EXPORT_INFO_FILE
+    if not info_file.exists():
+        raise FileNotFoundError(f"No exported model in {model_dir}, run `pylingual models pull` or `pylingual models export-onnx` first")
+    return json.loads(info_file.read_text())
+
+
+def write_export_info(model_dir: Path, model_config: dict):
+    """
+    Record the model config entry a model in model_dir was exported from, after everything else is written
+
+    :param model_config: SEGMENTATION_MODEL or STATEMENT_MODEL entry of the model config
+    """
+    (model_dir / EXPORT_INFO_FILE).write_text(json.dumps(model_config))
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import logging
+import threading
+from typing import TYPE_CHECKING, Callable, Iterable
+
+from pylingual.backends.base import SegmentationBackend, TranslationBackend
+
+if TYPE_CHECKING:
+    import numpy as np
+    import transformers
+
+logger = logging.getLogger(__name__)
+
+
+class LazyBackend:
+    """
+    Loads a backend the first time it is used, so that runs which never reach a model's stage do not pay for loading it
+
+    :param load: Called once to load the backend
+    :param name: Name of the model for logging
+    """
+
+    def __init__(self, load: Callable, name: str):
+        self._load = load
+        self._backend = None
+        self.name = name
+        self.load_lock = threading.Lock()
+        # called once after the backend is loaded, ModelCache uses it to check the loaded weights against its memory cap
+        self.on_load: Callable[[], None] | None = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._backend is not None
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            loaded = False
+            with self.load_lock:
+                if self._backend is None:
+                    logger.info(f"Loading {self.name}...")
+                    self._backend = self._load()
+                    loaded = True
+            if loaded and self.on_load is not None:
+                self.on_load()
+        return self._backend
+
+    @property
+    def tokenizer(self) -> transformers.PreTrainedTokenizerBase:
+        return self.backend.tokenizer
+
+    def memory_bytes(self) -> int:
+        # a model that is not loaded yet holds no memory
+        return self._backend.memory_bytes() if self._backend is not None else 0
+
+
+class LazySegmentationBackend(LazyBackend, SegmentationBackend):
+    def __init__(self, load: Callable[[], SegmentationBackend], name: str = "segmentation model"):
+        LazyBackend.__init__(self, load, name)
+
+    def __call__(self, requests: Iterable[str], batch_size: int = 8) -> list[list[dict]]:
+        return self.backend(requests, batch_size=batch_size)
+
+    def token_probabilities(self, windows: Iterable[list[int]], batch_size: int = 8) -> list[np.ndarray]:
+        return self.backend.token_probabilities(windows, batch_size=batch_size)
+
+
+class LazyTranslationBackend(LazyBackend, TranslationBackend):
+    def __init__(self, load: Callable[[], TranslationBackend], name: str = "statement model"):
+        LazyBackend.__init__(self, load, name)
+
+    def generate(self, requests: list[str], max_new_tokens: int) -> list[list[int]]:
+        return self.backend.generate(requests, max_new_tokens)
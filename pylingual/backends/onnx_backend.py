@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import itertools
+import json
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable
+
+from pylingual.backends.base import SegmentationBackend, TranslationBackend, label_columns, token_classification_results
+from pylingual.utils.lazy import lazy_import
+
+if TYPE_CHECKING:
+    import numpy as np
+    import onnxruntime
+    import transformers
+else:
+    lazy_import("numpy", "np")
+    lazy_import("onnxruntime")
+    lazy_import("transformers")
+
+
+def create_session(path: Path, threads: int | None = None) -> onnxruntime.InferenceSession:
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads:
+        options.intra_op_num_threads = threads
+    return onnxruntime.InferenceSession(str(path), options, providers=onnxruntime.get_available_providers())
+
+
+def softmax(logits: np.ndarray) -> np.ndarray:
+    exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+class OnnxSegmentationBackend(SegmentationBackend):
+    """
+    Segmentation with an exported token classification graph on ONNX Runtime
+
+    :param model_dir: Directory with model.onnx, config.json and the tokenizer, as written by export_onnx
+    :param threads: Number of intra-op threads, None lets ONNX Runtime decide
+    """
+
+    def __init__(self, model_dir: Path, threads: int | None = None):
+        super().__init__(transformers.PreTrainedTokenizerFast.from_pretrained(model_dir))
+        self.model_dir = model_dir
+        self.session = create_session(model_dir / "model.onnx", threads)
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        config = json.loads((model_dir / "config.json").read_text())
+        self.label_columns = label_columns(config["label2id"])
+
+    def __call__(self, requests: Iterable[str], batch_size: int = 8) -> list[list[dict]]:
+        # iterate instead of indexing so that TrackedDataset reports progress
+        requests = iter(requests)
+        results = []
+        while batch := list(itertools.islice(requests, batch_size)):
+            input_ids = self.tokenizer(batch)["input_ids"]
+            results.extend(token_classification_results(self.tokenizer, window, probabilities) for window, probabilities in zip(input_ids, self.token_probabilities(input_ids, batch_size)))
+        return results
+
+    def token_probabilities(self, windows: Iterable[list[int]], batch_size: int = 8) -> list[np.ndarray]:
+        windows = iter(windows)
+        results = []
+        while batch := list(itertools.islice(windows, batch_size)):
+            input_ids = np.full((len(batch), max(map(len, batch))), self.tokenizer.pad_token_id, dtype=np.int64)
+            attention_mask = np.zeros_like(input_ids)
+            for row, window in enumerate(batch):
+                input_ids[row, : len(window)] = window
+                attention_mask[row, : len(window)] = 1
+            feed = {"input_ids": input_ids, "attention_mask": attention_mask, "token_type_ids": np.zeros_like(input_ids)}
+            (logits,) = self.session.run(["logits"], {name: feed[name] for name in self.input_names})
+            probabilities = softmax(logits[:, :, self.label_columns])
+            results.extend(probabilities[row, : len(window)] for row, window in enumerate(batch))
+        return results
+
+    def memory_bytes(self) -> int:
+        return (self.model_dir / "model.onnx").stat().st_size
+
+
+class OnnxTranslationBackend(TranslationBackend):
+    """
+    Greedy translation with exported T5 encoder and decoder graphs on ONNX Runtime.
+    The decoder reuses past key values after the first step.
+
+    :param model_dir: Directory with encoder_model.onnx, decoder_model.onnx, decoder_with_past_model.onnx, config.json and the tokenizer, as written by export_onnx
+    :param threads: Number of intra-op threads, None lets ONNX Runtime decide
+    """
+
+    graph_files = ("encoder_model.onnx", "decoder_model.onnx", "decoder_with_past_model.onnx")
+
+    def __init__(self, model_dir: Path, threads: int | None = None):
+        super().__init__(transformers.RobertaTokenizer.from_pretrained(model_dir))
+        self.model_dir = model_dir
+        self.encoder, self.decoder, self.decoder_with_past = (create_session(model_dir / graph_file, threads) for graph_file in self.graph_files)
+        config = json.loads((model_dir / "config.json").read_text())
+        self.pad_token_id = config.get("pad_token_id", self.tokenizer.pad_token_id)
+        self.eos_token_id = config.get("eos_token_id", self.tokenizer.eos_token_id)
+        self.decoder_start_token_id = config.get("decoder_start_token_id", self.pad_token_id)
+
+    def generate(self, requests: list[str], max_new_tokens: int) -> list[list[int]]:
+        encoding = self.tokenizer(requests, padding=True, return_tensors="np")
+        attention_mask = encoding["attention_mask"].astype(np.int64)
+        (encoder_hidden_states,) = self.encoder.run(["last_hidden_state"], {"input_ids": encoding["input_ids"].astype(np.int64), "attention_mask": attention_mask})
+
+        generated = np.full((len(requests), 1), self.decoder_start_token_id, dtype=np.int64)
+        finished = np.zeros(len(requests), dtype=bool)
+        past = {}
+        for _ in range(max_new_tokens):
+            session = self.decoder_with_past if past else self.decoder
+            feed = {"input_ids": generated[:, -1:], "encoder_attention_mask": attention_mask, "encoder_hidden_states": encoder_hidden_states, **past}
+            output_names = [o.name for o in session.get_outputs()]
+            outputs = dict(zip(output_names, session.run(output_names, {i.name: feed[i.name] for i in session.get_inputs()})))
+
+            next_tokens = np.where(finished, self.pad_token_id, outputs["logits"][:, -1].argmax(axis=-1))
+            generated = np.concatenate([generated, next_tokens[:, None]], axis=1)
+            finished |= next_tokens == self.eos_token_id
+            if finished.all():
+                break
+            # the decoder with past only returns the self-attention cache, the cross-attention cache from the first step is kept
+            past.update({name.replace("present", "past_key_values", 1): value for name, value in outputs.items() if name.startswith("present")})
+        return generated.tolist()
+
+    def memory_bytes(self) -> int:
+        return sum((self.model_dir / graph_file).stat().st_size for graph_file in self.graph_files)
@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import itertools
+from typing import TYPE_CHECKING, Iterable
+
+from pylingual.backends.base import SegmentationBackend, TranslationBackend, label_columns
+from pylingual.utils.lazy import lazy_import
+from pylingual.utils.lists import flatten
+
+if TYPE_CHECKING:
+    import numpy as np
+    import torch
+    import transformers
+else:
+    lazy_import("torch")
+
+
+def module_memory(model: torch.nn.Module) -> int:
+    return sum(t.numel() * t.element_size() for t in itertools.chain(model.parameters(), model.buffers()))
+
+
+class TorchSegmentationBackend(SegmentationBackend):
+    """
+    Segmentation with a transformers token-classification pipeline.
+    Windows that are already tokenized skip the pipeline and run through its model directly.
+
+    :param pipeline: The loaded pipeline
+    """
+
+    def __init__(self, pipeline: transformers.TokenClassificationPipeline):
+        super().__init__(pipeline.tokenizer)
+        self.pipeline = pipeline
+        self.model = pipeline.model
+        self.label_columns = label_columns(self.model.config.label2id)
+
+    def __call__(self, requests: Iterable[str], batch_size: int = 8) -> list[list[dict]]:
+        return self.pipeline(requests, batch_size=batch_size)
+
+    def token_probabilities(self, windows: Iterable[list[int]], batch_size: int = 8) -> list[np.ndarray]:
+        # iterate instead of indexing so that TrackedDataset reports progress
+        windows = iter(windows)
+        results = []
+        while batch := list(itertools.islice(windows, batch_size)):
+            input_ids = torch.full((len(batch), max(map(len, batch))), self.tokenizer.pad_token_id, dtype=torch.long)
+            attention_mask = torch.zeros_like(input_ids)
+            for row, window in enumerate(batch):
+                input_ids[row, : len(window)] = torch.tensor(window)
+                attention_mask[row, : len(window)] = 1
+            with torch.inference_mode():
+                logits = self.model(input_ids=input_ids.to(self.model.device), attention_mask=attention_mask.to(self.model.device)).logits
+            probabilities = logits[:, :, self.label_columns].float().softmax(-1).cpu().numpy()
+            results.extend(probabilities[row, : len(window)] for row, window in enumerate(batch))
+        return results
+
+    def memory_bytes(self) -> int:
+        return module_memory(self.model)
+
+
+class TorchTranslationBackend(TranslationBackend):
+    """
+    Translation with a transformers TranslationPipeline
+
+    :param pipeline: The loaded pipeline
+    """
+
+    def __init__(self, pipeline: transformers.TranslationPipeline):
+        super().__init__(pipeline.tokenizer)
+        self.pipeline = pipeline
+        self.model = pipeline.model
+
+    def generate(self, requests: list[str], max_new_tokens: int) -> list[list[int]]:
+        # return_tensors=True prevents standard postprocessing which skips special tokens
+        results = self.pipeline(requests, return_tensors=True, batch_size=len(requests), max_new_tokens=max_new_tokens)
+        return [result["translation_token_ids"].tolist() for result in flatten(results)]
+
+    def memory_bytes(self) -> int:
+        return module_memory(self.model)
@@ -0,0 +1,273 @@
+from __future__ import annotations
+
+import itertools
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable
+
+from pylingual.backends import SegmentationBackend, TranslationBackend
+from pylingual.models import TRANSLATION_CACHE_BYTES, CacheTranslator, ModelCache
+from pylingual.utils.version import PythonVersion
+
+if TYPE_CHECKING:
+    import numpy as np
+    import transformers
+    from pylingual.utils.translation_store import TranslationStore
+
+logger = logging.getLogger(__name__)
+
+BROKER_BATCH_SIZE = 64
+BROKER_MAX_WAIT = 0.01
+# seconds between checks that the broker is still running while a client waits for a response
+BROKER_POLL_INTERVAL = 1.0
+# seconds the broker has to finish its current batch and stop before it is killed
+BROKER_SHUTDOWN_TIMEOUT = 30.0
+
+
+class InferenceBroker:
+    """
+    Process that owns the models and runs the segmentation and translation requests of many decompilation worker processes.
+    Requests that arrive within max_wait of the first waiting request are coalesced,
+    and each result is sent back to the worker that asked for it as soon as its batch is done.
+    Coalesced statements are run in batches within the token budget and learned batch limits of the broker's translator.
+
+    :param n_clients: Number of BrokerClients that can connect, one per worker process
+    :param max_batch_size: Maximum number of windows or statements coalesced before they are run
+    :param max_wait: Seconds a request may wait for others to batch with
+    :param model_cache_options: Keyword arguments of the broker's ModelCache
+    """
+
+    def __init__(self, n_clients: int, max_batch_size: int = BROKER_BATCH_SIZE, max_wait: float = BROKER_MAX_WAIT, **model_cache_options):
+        context = multiprocessing.get_context("spawn")
+        self.requests = context.Queue()
+        self.responses = [context.Queue() for _ in range(n_clients)]
+        self.slots = context.Queue()
+        for slot in range(n_clients):
+            self.slots.put(slot)
+        # only the broker holds the sending end, so the receiving end reaches end of file once the broker exits, however it exits
+        self.alive, alive_sender = context.Pipe(duplex=False)
+        self.process = context.Process(target=_run_broker, args=(self.requests, self.responses, max_batch_size, max_wait, model_cache_options, alive_sender), daemon=True)
+        self.process.start()
+        alive_sender.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.shutdown()
+
+    @property
+    def address(self) -> tuple:
+        """
+        What a worker process needs to create a BrokerClient; pass it to the worker when the worker is started
+        """
+        return self.requests, self.responses, self.slots, self.alive
+
+    def shutdown(self, timeout: float = BROKER_SHUTDOWN_TIMEOUT):
+        """
+        Stop the broker after its current batch, killing it if it does not stop within timeout seconds
+        """
+        if self.process.is_alive():
+            self.requests.put(None)
+        self.process.join(timeout)
+        if self.process.is_alive():
+            logger.warning(f"The inference broker did not stop within {timeout} seconds, killing it")
+            self.process.kill()
+            self.process.join()
+
+
+class BrokerClient:
+    """
+    Connection of a worker process to an InferenceBroker
+
+    :param address: InferenceBroker.address
+    """
+
+    def __init__(self, address: tuple):
+        self.requests, responses, slots, self.alive = address
+        self.slot = slots.get()
+        self.responses = responses[self.slot]
+        self.ids = itertools.count()
+        # pipelined decompilation calls the models from several threads, one request is in flight at a time
+        self.lock = threading.Lock()
+
+    def call(self, kind: str, key: tuple, *args):
+        with self.lock:
+            request_id = next(self.ids)
+            self.requests.put((self.slot, request_id, kind, key, args))
+            response_id = None
+            while response_id != request_id:
+                try:
+                    response_id, error, result = self.responses.get(timeout=BROKER_POLL_INTERVAL)
+                except queue.Empty:
+                    # the broker never sends on the alive pipe, so it only becomes readable once the broker has exited
+                    if self.alive.poll():
+                        raise RuntimeError(f"The inference broker stopped before answering a {kind} request") from None
+        if error is not None:
+            raise error
+        return result
+
+
+class RemoteSegmentationBackend(SegmentationBackend):
+    """
+    Segmenter that runs its requests in an InferenceBroker
+
+    :param client: Connection to the broker
+    :param key: (config file, version) of the models in the broker
+    :param tokenizer: Tokenizer of the segmentation model, sent by the broker
+    """
+
+    def __init__(self, client: BrokerClient, key: tuple, tokenizer: transformers.PreTrainedTokenizerBase):
+        super().__init__(tokenizer)
+        self.client = client
+        self.key = key
+
+    def __call__(self, requests: Iterable[str], batch_size: int = 8) -> list[list[dict]]:
+        # iterate so that TrackedDataset reports progress
+        return self.client.call("segment", self.key, list(requests), batch_size)
+
+    def token_probabilities(self, windows: Iterable[list[int]], batch_size: int = 8) -> list[np.ndarray]:
+        return self.client.call("token_probabilities", self.key, list(windows), batch_size)
+
+
+class RemoteTranslationBackend(TranslationBackend):
+    """
+    Statement model that runs its requests in an InferenceBroker
+
+    :param client: Connection to the broker
+    :param key: (config file, version) of the models in the broker
+    :param tokenizer: Tokenizer of the statement model, sent by the broker
+    """
+
+    def __init__(self, client: BrokerClient, key: tuple, tokenizer: transformers.PreTrainedTokenizerBase):
+        super().__init__(tokenizer)
+        self.client = client
+        self.key = key
+
+    def generate(self, requests: list[str], max_new_tokens: int) -> list[list[int]]:
+        return self.client.call("generate", self.key, requests, max_new_tokens)
+
+
+class BrokerModelCache(ModelCache):
+    """
+    ModelCache of a worker process whose models run in an InferenceBroker.
+    The translation cache stays in the worker, so only statements the worker has not translated before reach the broker.
+
+    :param client: Connection to the broker
+    :param translation_store: Persistent TranslationStore of the worker's translators
+    :param translation_cache_bytes: Approximate cap in bytes on the in-memory translation cache of each translator
+    :param quantize: Quantization of the broker's models, only used for result cache keys
+    :param backend: Inference backend of the broker's models, only used for result cache keys
+    """
+
+    def __init__(self, client: BrokerClient, translation_store: TranslationStore | None = None, translation_cache_bytes: int = TRANSLATION_CACHE_BYTES, quantize: str | None = None, backend: str = "torch"):
+        super().__init__(translation_store=translation_store, translation_cache_bytes=translation_cache_bytes, quantize=quantize, backend=backend)
+        self.client = client
+
+    def get(self, config_file: Path, version: PythonVersion) -> tuple[SegmentationBackend, CacheTranslator]:
+        key = (config_file.resolve(), version.as_tuple())
+        if key not in self.models:
+            info = self.client.call("describe", key)
+            translator = CacheTranslator(
+                RemoteTranslationBackend(self.client, key, info["statement_tokenizer"]),
+                max_bytes=self.translation_cache_bytes,
+                store=self.translation_store,
+                namespace=info["namespace"],
+                generation_ratio=info["generation_ratio"],
+                generation_offset=info["generation_offset"],
+                max_new_tokens=info["max_new_tokens"],
+            )
+            self.models[key] = (RemoteSegmentationBackend(self.client, key, info["segmentation_tokenizer"]), translator)
+        return self.models[key]
+
+
+def _request_size(request: tuple) -> int:
+    _, _, kind, _, args = request
+    return len(args[0]) if kind in ("segment", "token_probabilities", "generate") else 1
+
+
+def _run_broker(requests: multiprocessing.Queue, responses: list[multiprocessing.Queue], max_batch_size: int, max_wait: float, model_cache_options: dict, alive_sender: multiprocessing.connection.Connection):
+    # alive_sender is never written to, it only stays open until the broker exits, see InferenceBroker
+    model_cache = ModelCache(**model_cache_options)
+    while True:
+        request = requests.get()
+        if request is None:
+            return
+        batch = [request]
+        size = _request_size(request)
+        deadline = time.monotonic() + max_wait
+        stop = False
+        while size < max_batch_size and (timeout := deadline - time.monotonic()) > 0:
+            try:
+                request = requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                stop = True
+                break
+            batch.append(request)
+            size += _request_size(request)
+
+        groups: dict[tuple, list[tuple]] = {}
+        for request in batch:
+            _, _, kind, key, _ = request
+            groups.setdefault((kind, key), []).append(request)
+        for (kind, key), group in groups.items():
+            _serve_group(model_cache, kind, key, group, responses)
+        if stop:
+            return
+
+
+def _serve_group(model_cache: ModelCache, kind: str, key: tuple, group: list[tuple], responses: list[multiprocessing.Queue]):
+    try:
+        results = _run_group(model_cache, kind, key, [args for _, _, _, _, args in group])
+    except Exception as e:
+        if len(group) > 1:
+            # the coalesced batch may fail where the batches of the workers alone would not, e.g. when it runs out of memory
+            for request in group:
+                _serve_group(model_cache, kind, key, [request], responses)
+            return
+        # the worker may not be able to unpickle the original exception
+        results, error = [None], RuntimeError(f"{type(e).__name__} in the inference broker: {e}")
+    else:
+        error = None
+    for (slot, request_id, _, _, _), result in zip(group, results):
+        responses[slot].put((request_id, error, result))
+
+
+def _run_group(model_cache: ModelCache, kind: str, key: tuple, group_args: list[tuple]) -> list:
+    config_file, version = key
+    segmenter, translator = model_cache.get(Path(config_file), PythonVersion(version))
+    if kind == "describe":
+        info = {
+            "segmentation_tokenizer": segmenter.tokenizer,
+            "statement_tokenizer": translator.translator.tokenizer,
+            "namespace": translator.namespace,
+            "generation_ratio": translator.generation_ratio,
+            "generation_offset": translator.generation_offset,
+            "max_new_tokens": translator.max_new_tokens,
+        }
+        return [info] * len(group_args)
+
+    flat_requests = [request for args in group_args for request in args[0]]
+    if kind == "segment":
+        flat_results = segmenter(flat_requests, batch_size=max(batch_size for _, batch_size in group_args))
+    elif kind == "token_probabilities":
+        flat_results = segmenter.token_probabilities(flat_requests, batch_size=max(batch_size for _, batch_size in group_args))
+    elif kind == "generate":
+        # the statements of all workers are batched again by the token budget and learned batch limits of the broker's translator
+        flat_results = translator.generate_batched(flat_requests, [max_new_tokens for requests, max_new_tokens in group_args for _ in requests])
+    else:
+        raise ValueError(f"Unknown broker request {kind}")
+
+    results = []
+    start = 0
+    for args in group_args:
+        end = start + len(args[0])
+        results.append(flat_results[start:end])
+        start = end
+    return results
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import collections
+import hashlib
+import json
+import re
+import threading
+from typing import TYPE_CHECKING
+
+from pylingual.utils.disk_cache import DiskCache
+
+if TYPE_CHECKING:
+    from pylingual.editable_bytecode import EditableBytecode
+    from pylingual.utils.version import PythonVersion
+
+mask_token_regex = re.compile(r"<mask_\d+>")
+
+
+def canonical_masks(model_views: list[str]) -> dict[str, str]:
+    """
+    Renumber the masks of a code object in order of first appearance, so that identical code objects from different pycs share a model view
+
+    :param model_views: Model views of the instructions of the code object
+    :return: dict of mask in the pyc to canonical mask
+    """
+    mapping = {}
+    for view in model_views:
+        for mask in mask_token_regex.findall(view):
+            if mask not in mapping:
+                mapping[mask] = f"<mask_{len(mapping)}>"
+    return mapping
+
+
+def remap_masks(lines: list[str], mapping: dict[str, str]) -> list[str] | None:
+    """
+    Replace the masks in lines according to mapping
+
+    :return: The remapped lines, or None if a line contains a mask that is not in mapping
+    """
+    remapped = []
+    for line in lines:
+        if any(mask not in mapping for mask in mask_token_regex.findall(line)):
+            return None
+        remapped.append(mask_token_regex.sub(lambda match: mapping[match.group()], line))
+    return remapped
+
+
+def code_object_fingerprint(bytecode: EditableBytecode, canonical_views: list[str], child_fingerprints: list[str], version: PythonVersion) -> str:
+    """
+    Fingerprint of a code object as the models and control flow reconstruction see it
+
+    :param bytecode: The code object
+    :param canonical_views: Model views of its instructions with canonical masks
+    :param child_fingerprints: Fingerprints of its child code objects, in order
+    :param version: Python version of the pyc
+    """
+    # control flow reconstruction inserts these unmasked, so they have to match exactly
+    docstring = bytecode.codeobj.co_consts[0] if bytecode.codeobj.co_flags & 0x2 and bytecode.codeobj.co_consts and isinstance(bytecode.codeobj.co_consts[0], str) else None
+    parent_nonlocals = set()
+    parent = bytecode.parent
+    while parent:
+        parent_nonlocals |= parent.nonlocals
+        parent = parent.parent
+    unmasked = [sorted(bytecode.globals), sorted(bytecode.nonlocals & parent_nonlocals), docstring, bytecode.codeobj.co_flags]
+    data = json.dumps([str(version), canonical_views, child_fingerprints, unmasked])
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class CodeObjectCache:
+    """
+    Remembers the accepted segmentation, translation and control flow output of code objects that passed the equivalence check,
+    keyed by code_object_fingerprint, so that identical code objects in later pycs skip the models and correction.
+    Entries are stored with canonical masks.
+
+    :param disk_cache: DiskCache to persist entries in across runs, None to keep them only in memory
+    :param maxsize: Maximum number of entries kept in memory
+    """
+
+    def __init__(self, disk_cache: DiskCache | None = None, maxsize: int = 50000):
+        self.disk_cache = disk_cache
+        self.maxsize = maxsize
+        self.entries: collections.OrderedDict[str, dict] = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, fingerprint: str) -> dict | None:
+        with self.lock:
+            if fingerprint in self.entries:
+                self.entries.move_to_end(fingerprint)
+                return self.entries[fingerprint]
+        if self.disk_cache is None:
+            return None
+        entry = self.disk_cache.get(fingerprint)
+        if entry is not None:
+            self._remember(fingerprint, entry)
+        return entry
+
+    def put(self, fingerprint: str, entry: dict):
+        """
+        :param entry: dict with the "entities" of the segmentation, the translated "lines", the "indented_source" and
+                      the "order" of the instructions as indices into the model view instructions
+        """
+        self._remember(fingerprint, entry)
+        if self.disk_cache is not None:
+            self.disk_cache.put(fingerprint, entry)
+
+    def evict(self, fingerprint: str):
+        """
+        Forget an entry that did not hold up, so that it is not reused again
+        """
+        with self.lock:
+            self.entries.pop(fingerprint, None)
+        if self.disk_cache is not None:
+            self.disk_cache.delete(fingerprint)
+
+    def _remember(self, fingerprint: str, entry: dict):
+        with self.lock:
+            self.entries[fingerprint] = entry
+            self.entries.move_to_end(fingerprint)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
@@ -1,41 +1,62 @@
 from __future__ import annotations
 
+import collections
+import concurrent.futures
+import dataclasses
 import datetime
 import functools
+import hashlib
 import importlib.resources
 import itertools
+import json
 import keyword
 import logging
+import os
 import re
 import tempfile
 import shutil
 import sys
 from dataclasses import dataclass
 from pathlib import Path
-from typing import TYPE_CHECKING
+from types import CodeType
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator
 
 from xdis.magics import magicint2version
 
+from pylingual.backends import SEGMENTATION_LABELS
+from pylingual.codeobj_cache import CodeObjectCache, canonical_masks, code_object_fingerprint, remap_masks
 from pylingual.control_flow_reconstruction.cflow import bytecode_to_indented_source
 from pylingual.control_flow_reconstruction.reconstruct_control_indentation import reconstruct_source
-from pylingual.equivalence_check import TestResult, compare_pyc
-from pylingual.models import CacheTranslator, load_models
-from pylingual.utils.generate_bytecode import CompileError, compile_version
+from pylingual.equivalence_check import ReferencePyc, TestResult
+from pylingual.models import TRANSLATION_CACHE_BYTES, CacheTranslator, ModelCache, TranslationCacheStats, load_models, model_settings
+from pylingual.utils.generate_bytecode import CompileError, compile_source, compile_version
 from pylingual.masking.model_disasm import create_global_masker, restore_masked_source_text
 from pylingual.editable_bytecode import PYCFile
-from pylingual.segmentation.segmentation_search_strategies import get_top_k_predictions, m_deep_top_k, naive_confidence_priority, filter_subwords
-from pylingual.segmentation.sliding_window import merge, sliding_window
+from pylingual.segmentation.segmentation_search_strategies import get_top_k_predictions, m_deep_top_k, naive_confidence_priority
+from pylingual.segmentation.sliding_window import merge_probabilities, token_id_windows
+from pylingual.utils.disk_cache import DiskCache
+from pylingual.utils.lazy import lazy_import
 from pylingual.utils.lists import unflatten
+from pylingual.utils.pipelined import run_pipelined, run_stages
 from pylingual.utils.version import PythonVersion
+from pylingual.utils.translation_store import TranslationStore
 from pylingual.utils.tracked_list import CFLOW_STEP, CORRECTION_STEP, SEGMENTATION_STEP, TrackedList, TrackedDataset
 
 if TYPE_CHECKING:
-    import transformers
+    import numpy as np
+    from pylingual.backends import SegmentationBackend
     from pylingual.editable_bytecode.Instruction import Inst
+    from pylingual.parallel import CodeObjectPool
+else:
+    lazy_import("numpy", "np")
 
 logger = logging.getLogger(__name__)
 
 bytecode_separator = " <SEP> "
+MAX_WINDOW_LENGTH = 512
+STEP_SIZE = 128
+SEGMENTATION_BATCH_SIZE = 8
+
 lno_regex = re.compile(r"(?<=line )\d+")
 def_regex = re.compile(r"(?<=def ).+?(?=\()")
 class_regex = re.compile(r"(?<=class ).+?(?=:|\()")
@@ -45,6 +66,10 @@ def has_comp_error(results: list[TestResult]) -> bool:
     return bool(results) and isinstance(results[0], Exception)
 
 
+def can_check_equivalence(version: PythonVersion) -> bool:
+    return shutil.which("pyenv") is not None or version == sys.version_info
+
+
 @dataclass
 class DecompilerResult:
     """
@@ -55,6 +80,7 @@ class DecompilerResult:
     :param decompiled_source: path to decompiled source
     :param out_dir: directory where decompiler output and internal steps are written
     :param version: python version of pyc
+    :param translation_cache: how the translation requests of this pyc were served, None for results restored from the result cache
     """
 
     equivalence_results: list[TestResult]
@@ -62,12 +88,24 @@ class DecompilerResult:
     decompiled_source: Path
     out_dir: Path
     version: PythonVersion
+    translation_cache: TranslationCacheStats | None = None
 
     def calculate_success_rate(self) -> float:
         if not self.equivalence_results:
             return 0
         return sum(1 for x in self.equivalence_results if x.success) / len(self.equivalence_results) * 100
 
+    def to_dict(self) -> dict:
+        return {
+            "equivalence_results": [dataclasses.asdict(r) if isinstance(r, TestResult) else {"success": False, "message": str(r)} for r in self.equivalence_results],
+            "original_pyc": str(self.original_pyc),
+            "decompiled_source": str(self.decompiled_source),
+            "out_dir": str(self.out_dir),
+            "version": str(self.version),
+            "success_rate": self.calculate_success_rate(),
+            "translation_cache": dataclasses.asdict(self.translation_cache) if self.translation_cache is not None else None,
+        }
+
 
 class Decompiler:
     """
@@ -83,9 +121,26 @@ class Decompiler:
     :param version: The python version
     :param top_k: Value of k to use for top k segmentation
     :param trust_lnotab: Decides whether or not to use line number information
+    :param defer: Only set up the decompiler; the caller runs the stages and verify()
+    :param pool: CodeObjectPool to run control flow reconstruction and equivalence checks of large modules on
+    :param codeobj_cache: CodeObjectCache to reuse code objects solved in earlier pycs from and to store newly solved code objects in
+    :param batch_correction: Evaluate all top k segmentations of a failing code object together instead of one at a time
     """
 
-    def __init__(self, pyc: PYCFile, out_dir: Path, segmenter: transformers.Pipeline, translator: CacheTranslator, version: PythonVersion, top_k=10, trust_lnotab=False):
+    def __init__(
+        self,
+        pyc: PYCFile,
+        out_dir: Path,
+        segmenter: SegmentationBackend,
+        translator: CacheTranslator,
+        version: PythonVersion,
+        top_k=10,
+        trust_lnotab=False,
+        defer=False,
+        pool: CodeObjectPool | None = None,
+        codeobj_cache: CodeObjectCache | None = None,
+        batch_correction=False,
+    ):
         self.pyc = pyc
         self.file = pyc.pyc_path
         self.out_dir = out_dir
@@ -96,8 +151,16 @@ class Decompiler:
 
         self.top_k = top_k
         self.highest_k_used = 0
+        self.batch_correction = batch_correction
 
         self.trust_lnotab = trust_lnotab
+        self.pool = pool
+        self.codeobj_cache = codeobj_cache
+        self.translation_stats = TranslationCacheStats()
+        # code object index -> cache entry, remapped to the masks of this pyc
+        self.reused_codeobjs: dict[int, dict] = {}
+        # set while the decompilation is checked
+        self.reference: ReferencePyc | None = None
 
         self.header = "# Decompiled with PyLingual (https://pylingual.io)\n"
         try:
@@ -109,25 +172,38 @@ class Decompiler:
         except:
             pass
 
-        self.decompile()
+        if not defer:
+            self.decompile()
+            self.verify()
+
+    def verify(self):
+        """Writes the decompiled source, checks it against the original pyc and corrects failing code objects"""
         self.log_results()
 
         logger.info(f"Checking decompilation for {self.file.name}...")
-        if shutil.which("pyenv") is None and self.version != sys.version_info:
+        if not can_check_equivalence(self.version):
             logger.warning(f"pyenv is not installed so equivalence check cannot be performed. Please install pyenv manually along with the required Python version ({self.version}) or run PyLingual again with the --init-pyenv flag")
-            self.result = DecompilerResult([TestResult(False, "Cannot compare equivalence without pyenv installed", bc.name, bc.name) for bc in self.pyc.iter_bytecodes()], self.file, self.candidate_source_path, self.out_dir, self.version)
+            self.result = DecompilerResult(
+                [TestResult(False, "Cannot compare equivalence without pyenv installed", bc.name, bc.name) for bc in self.pyc.iter_bytecodes()], self.file, self.candidate_source_path, self.out_dir, self.version, self.translation_stats
+            )
             return
 
+        # load and patch the original pyc once for all candidates
+        self.reference = ReferencePyc(self.file)
         self.equivalence_results = self.check_reconstruction()
         self.correct_failures()
 
         if has_comp_error(self.equivalence_results):
             self.equivalence_results += self.purge_comp_errors()
+        self.reference = None
 
         equivalence_report = self.out_dir / "equivalence_report.txt"
         equivalence_report.write_text("\n".join(str(r) for r in self.equivalence_results))
 
-        self.result = DecompilerResult(self.equivalence_results, self.file, self.candidate_source_path, self.out_dir, self.version)
+        if self.codeobj_cache is not None and not has_comp_error(self.equivalence_results):
+            self.store_solved_code_objects()
+
+        self.result = DecompilerResult(self.equivalence_results, self.file, self.candidate_source_path, self.out_dir, self.version, self.translation_stats)
 
     def decompile(self):
         self.mask_bytecode()
@@ -140,8 +216,9 @@ class Decompiler:
         self.reconstruct_source()
 
     def find_comp_error_cause(self, results: list[TestResult]):
-        # parse lno from exception
-        lno = int(lno_regex.search(str(results[0])).group(0)) - 1
+        # take lno from the syntax error, or parse it from the message of errors restored from the result cache
+        error = results[0]
+        lno = (error.lineno if isinstance(error, CompileError) and error.lineno is not None else int(lno_regex.search(str(error)).group(0))) - 1
         # adjust for lines added in postprocessing
         lno -= sum(1 for x in (self.header + self.indented_source).split("\n")[: lno + 1] if x.endswith("# postinserted") or not x.strip() or x.strip().startswith("#"))
 
@@ -154,6 +231,7 @@ class Decompiler:
 
     def correct_failures(self):
         changed = False
+        correct_segmentation = self.correct_segmentation_batched if self.batch_correction else self.correct_segmentation
 
         try:
             # fix compile errors
@@ -163,13 +241,13 @@ class Decompiler:
                 # i don't think this will ever happen but better safe than sorry
                 if bad_idx in corrected_comp_errors:
                     return
-                if not self.correct_segmentation(bad_idx, from_comp_error=True):
+                if not correct_segmentation(bad_idx, from_comp_error=True):
                     return
                 changed = True
                 corrected_comp_errors.add(bad_idx)
             failed = TrackedList(CORRECTION_STEP, [i for i, result in enumerate(self.equivalence_results) if not result.success])
             for i in failed:
-                if self.correct_segmentation(i):
+                if correct_segmentation(i):
                     changed = True
                     continue
                 # other fixes...
@@ -220,7 +298,7 @@ class Decompiler:
                 purged.append(bad_idx)
                 self.cflow_results[bad_co] = [replace_line(x) for x in "\n".join(self.cflow_results[bad_co]).split("\n")]
                 self.reconstruct_source()
-                equivalence_results = self.check_reconstruction(write_source=True)
+                equivalence_results = self.check_reconstruction(write_source=True, dirty=set(purged))
             for i in purged:
                 r = equivalence_results[i]
                 equivalence_results[i] = TestResult(False, "Compilation Error", r.name_a, r.name_b)
@@ -237,51 +315,90 @@ class Decompiler:
             self.ordered_bytecodes = [bc for bc in self.pyc.iter_bytecodes()]
             self.codeobj_instruction_lists = [[self.global_masker.get_model_view(inst) for inst in insts] for insts in self.ordered_instructions]
             self.segmentation_requests = [bytecode_separator.join(self.global_masker.get_model_view(inst) for inst in insts) for insts in self.ordered_instructions]
+            if self.codeobj_cache is not None:
+                self.reuse_solved_code_objects()
         except Exception as e:
             e.add_note("From masking bytecode")
             raise
 
+    def fingerprint_code_objects(self):
+        self.codeobj_masks = [canonical_masks(views) for views in self.codeobj_instruction_lists]
+        indices = {bc.codeobj: i for i, bc in enumerate(self.ordered_bytecodes)}
+        self.codeobj_fingerprints = [None] * len(self.ordered_bytecodes)
+        # children come after their parents in iter_bytecodes order
+        for i in reversed(range(len(self.ordered_bytecodes))):
+            bc = self.ordered_bytecodes[i]
+            canonical_views = remap_masks(self.codeobj_instruction_lists[i], self.codeobj_masks[i])
+            child_fingerprints = [self.codeobj_fingerprints[indices[child.codeobj]] for child in bc.child_bytecodes]
+            self.codeobj_fingerprints[i] = code_object_fingerprint(bc, canonical_views, child_fingerprints, self.version)
+
+    # take the segmentation, translation and control flow of code objects that were solved in earlier pycs from the cache
+    def reuse_solved_code_objects(self):
+        self.fingerprint_code_objects()
+        for i, fingerprint in enumerate(self.codeobj_fingerprints):
+            if not self.ordered_instructions[i] or (entry := self.codeobj_cache.get(fingerprint)) is None:
+                continue
+            unmapping = {canonical: mask for mask, canonical in self.codeobj_masks[i].items()}
+            lines, indented_source = remap_masks(entry["lines"], unmapping), remap_masks(entry["indented_source"], unmapping)
+            if lines is None or indented_source is None or len(entry["entities"]) != len(self.ordered_instructions[i]):
+                continue
+            self.reused_codeobjs[i] = {"entities": entry["entities"], "lines": lines, "indented_source": indented_source, "order": entry["order"]}
+        if self.reused_codeobjs:
+            logger.info(f"Reusing {len(self.reused_codeobjs)} of {len(self.ordered_bytecodes)} code objects from earlier decompilations")
+
+    def store_solved_code_objects(self):
+        for i, (bc, result) in enumerate(zip(self.ordered_bytecodes, self.equivalence_results)):
+            if i in self.reused_codeobjs or not self.ordered_instructions[i] or not isinstance(result, TestResult) or not result.success:
+                continue
+            positions = {inst: position for position, inst in enumerate(self.ordered_instructions[i])}
+            if any(inst not in positions for inst in bc.ordered_instructions):
+                continue
+            lines, indented_source = remap_masks(self.translation_results[i], self.codeobj_masks[i]), remap_masks(self.cflow_results[bc.codeobj], self.codeobj_masks[i])
+            if lines is None or indented_source is None:
+                continue
+            entry = {"entities": [r["entity"] for r in self.segmentation_results[i]], "lines": lines, "indented_source": indented_source, "order": [positions[inst] for inst in bc.ordered_instructions]}
+            self.codeobj_cache.put(self.codeobj_fingerprints[i], entry)
+
     def run_segmentation(self):
         logger.info(f"Segmenting bytecode for {self.file.name}...")
         try:
-            MAX_WINDOW_LENGTH = 512
-            STEP_SIZE = 128
-
-            codeobj_list_instructions = (segmentation_request.split(bytecode_separator) for segmentation_request in self.segmentation_requests)
-            codeobj_token_list = []
-
-            # make a list of instructions with their token lengths, can be turned into a list comp but readability suffers and complexity is increased
-            for codeobj_instructions in codeobj_list_instructions:
-                token_list = []
-                tokenized_insts = self.segmenter.tokenizer(codeobj_instructions)
-
-                # map token length to instruction
-                for i, inst in enumerate(codeobj_instructions):
-                    token_list.append([inst, len(tokenized_insts[i])])
-
-                # map to codeobject
-                codeobj_token_list.append(token_list)
-
-            window_segmentation_request_iterators = [(codeobj_index, sliding_window(codeobj, MAX_WINDOW_LENGTH, STEP_SIZE)) for codeobj_index, codeobj in enumerate(codeobj_token_list)]
-            window_segmentation_requests = (
-                ((codeobj_index, window_index), bytecode_separator.join(window[0]), window[1]) for codeobj_index, window_iterator in window_segmentation_request_iterators for window_index, window in enumerate(window_iterator)
-            )
-
-            window_coordinates, flat_window_requests, inst_index = zip(*window_segmentation_requests)
-
-            window_segmentation_results = [filter_subwords(segmentation_result) for segmentation_result in self.segmenter(TrackedDataset(SEGMENTATION_STEP, list(flat_window_requests)), batch_size=8)]
+            windows = self.make_segmentation_windows()
+            window_token_probabilities = self.segmenter.token_probabilities(TrackedDataset(SEGMENTATION_STEP, [window for _, window, _, _ in windows]), batch_size=SEGMENTATION_BATCH_SIZE) if windows else []
+            self.apply_segmentation_results(windows, window_token_probabilities)
+        except Exception as e:
+            e.add_note("From segmentation")
+            raise
 
-            self.segmentation_results = merge(list(window_coordinates), window_segmentation_results, list(inst_index), MAX_WINDOW_LENGTH, STEP_SIZE)  # merge everything
+    # split each code object into overlapping windows of input ids that fit in the segmentation model, reused code objects are left out
+    def make_segmentation_windows(self) -> list[tuple[tuple[int, int], list[int], list[int], list[int]]]:
+        segmentation_requests = [segmentation_request for i, segmentation_request in enumerate(self.segmentation_requests) if i not in self.reused_codeobjs]
+        if not segmentation_requests:
+            return []
+        return token_id_windows(self.segmenter.tokenizer, segmentation_requests, MAX_WINDOW_LENGTH, STEP_SIZE, bytecode_separator)
+
+    def apply_segmentation_results(self, windows: list[tuple[tuple[int, int], list[int], list[int], list[int]]], window_token_probabilities: list[np.ndarray]):
+        window_coordinates = [coordinates for coordinates, _, _, _ in windows]
+        inst_index = [indices for _, _, indices, _ in windows]
+        # the first token of each instruction decides its label, the rest are subwords
+        window_probabilities = [probabilities[starts] for probabilities, (_, _, _, starts) in zip(window_token_probabilities, windows)]
+        segmented = iter(merge_probabilities(window_coordinates, window_probabilities, inst_index))  # merge everything
+        self.segmentation_results = []
+        self.segmentation_probabilities = []
+        for i in range(len(self.segmentation_requests)):
+            if i in self.reused_codeobjs:
+                self.segmentation_results.append([{"entity": entity, "score": 1} for entity in self.reused_codeobjs[i]["entities"]])
+                self.segmentation_probabilities.append(None)
+                continue
+            labels, probabilities = next(segmented)
+            self.segmentation_results.append([{"entity": SEGMENTATION_LABELS[label], "score": score} for label, score in zip(labels.tolist(), probabilities.max(axis=1).tolist())])
+            self.segmentation_probabilities.append(probabilities)
 
-            # force each code object to start with a 'B'
+        # force each code object to start with a 'B'
 
-            for codeobj in self.segmentation_results:
-                codeobj[0]["entity"] = "B"
+        for codeobj in self.segmentation_results:
+            codeobj[0]["entity"] = "B"
 
-            self.update_starts_line()
-        except Exception as e:
-            e.add_note("From segmentation")
-            raise
+        self.update_starts_line()
 
     def update_segmentation_from_lnotab(self):
         self.segmentation_results = []
@@ -305,26 +422,46 @@ class Decompiler:
 
             self.segmentation_results.append([{"entity": entity, "score": 1} for entity in boundaries])
 
+        for i, reused in self.reused_codeobjs.items():
+            self.segmentation_results[i] = [{"entity": entity, "score": 1} for entity in reused["entities"]]
+        self.segmentation_probabilities = [None] * len(self.segmentation_results)
+
         self.update_starts_line()
 
     def run_translation(self):
         logger.info(f"Translating statements for {self.file.name}...")
         try:
-            translation_requests = []
-            for instructions, boundary_predictions in zip(self.ordered_instructions, self.segmentation_results):
-                translation_requests.append(self.make_translation_request(instructions, boundary_predictions))
-            flattened_translation_requests = list(itertools.chain.from_iterable(translation_requests))
-            self.translation_results = self.translator(flattened_translation_requests)
-            unflatten(self.translation_results, translation_requests)
-            self.update_source_lines()
+            translation_requests = self.make_translation_requests()
+            self.apply_translation_results(self.translator(list(itertools.chain.from_iterable(translation_requests)), stats=self.translation_stats), translation_requests)
         except Exception as e:
             e.add_note("From translation")
             raise
 
+    # make the translation requests of every code object from the segmentation results, reused code objects need no requests
+    def make_translation_requests(self) -> list[list[str]]:
+        return [[] if i in self.reused_codeobjs else self.make_translation_request(instructions, boundary_predictions) for i, (instructions, boundary_predictions) in enumerate(zip(self.ordered_instructions, self.segmentation_results))]
+
+    def apply_translation_results(self, flattened_translation_results: list[str], translation_requests: list[list[str]]):
+        self.translation_results = flattened_translation_results
+        unflatten(self.translation_results, translation_requests)
+        for i, reused in self.reused_codeobjs.items():
+            self.translation_results[i] = list(reused["lines"])
+        self.update_source_lines()
+
     def run_cflow_reconstruction(self):
         logger.info(f"Reconstructing control flow for {self.file.name}...")
         try:
-            self.cflow_results = {bc.codeobj: bytecode_to_indented_source(bc, self.source_lines) for bc in TrackedDataset(CFLOW_STEP, self.ordered_bytecodes)}
+            if self.pool is not None and self.pool.should_split(len(self.ordered_bytecodes) - len(self.reused_codeobjs)):
+                self.cflow_results = self.pool.indented_sources(self.file, self.ordered_bytecodes, self.source_lines, skip=self.reused_codeobjs)
+            else:
+                bytecodes = [bc for i, bc in enumerate(self.ordered_bytecodes) if i not in self.reused_codeobjs]
+                self.cflow_results = {bc.codeobj: bytecode_to_indented_source(bc, self.source_lines) for bc in TrackedDataset(CFLOW_STEP, bytecodes)}
+            for i, reused in self.reused_codeobjs.items():
+                bc = self.ordered_bytecodes[i]
+                bc.ordered_instructions = [self.ordered_instructions[i][position] for position in reused["order"]]
+                self.cflow_results[bc.codeobj] = list(reused["indented_source"])
+            # keep the code objects in iter_bytecodes order
+            self.cflow_results = {bc.codeobj: self.cflow_results[bc.codeobj] for bc in self.ordered_bytecodes}
         except Exception as e:
             e.add_note("From control flow reconstruction")
             raise
@@ -372,42 +509,98 @@ class Decompiler:
         elif self.version >= (3, 10):
             self.pyc.fix_while(self.source_lines)
 
-    # compiles and compares result to original pyc
-    def check_reconstruction(self, write_source=False) -> list:
-        candidate_source_path = self.candidate_source_path
-        candidate_pyc_path = self.candidate_pyc_path
-        if write_source:
-            tmp = tempfile.NamedTemporaryFile(mode="w", suffix=".py", delete_on_close=False)
-            tmp.write(self.header + self.indented_source)
-            candidate_source_path = Path(tmp.name)
-            candidate_pyc_path = Path(tmp.name).with_suffix(".pyc")
-
-        # compile source
+    # compiles and compares result to original pyc, or indented_source instead of the current source if it is given
+    # if dirty is given, only those code objects and their parents are compared again when the rest compile to the same bytecode as last time
+    def check_reconstruction(self, write_source=False, indented_source: str | None = None, dirty: set[int] | None = None) -> list:
         try:
-            compile_version(candidate_source_path, candidate_pyc_path, self.version)
+            candidate = self.compile_candidate(write_source, indented_source)
         except CompileError as e:
             return [e]
-        else:
-            return compare_pyc(self.file, candidate_pyc_path)
+        dirty_names = None
+        if dirty is not None:
+            # a changed function can change the LOAD_CONST and defaults of the code object that creates it
+            dirty_bytecodes = [self.ordered_bytecodes[i] for i in dirty]
+            dirty_names = {bc.name for bc in dirty_bytecodes} | {bc.parent.name for bc in dirty_bytecodes if bc.parent is not None}
+        if self.pool is not None:
+            return self.pool.compare_pyc(self.reference, candidate, len(self.ordered_bytecodes), dirty_names)
+        return self.reference.compare(candidate, dirty_names)
+
+    # compile the candidate source to a module code object, or to a pyc for versions other than the running one
+    def compile_candidate(self, write_source: bool, indented_source: str | None) -> CodeType | Path | bytes:
+        source = self.header + (indented_source if indented_source is not None else self.indented_source)
+        if self.version == sys.version_info:
+            # the running interpreter compiles the same bytecode, so the candidate is compared without touching the disk
+            return compile_source(source.encode(), str(self.candidate_source_path))
+        if not write_source:
+            compile_version(self.candidate_source_path, self.candidate_pyc_path, self.version)
+            return self.candidate_pyc_path
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            candidate_source_path = Path(tmp_dir) / self.candidate_source_path.name
+            candidate_source_path.write_text(source)
+            candidate_pyc_path = candidate_source_path.with_suffix(".pyc")
+            compile_version(candidate_source_path, candidate_pyc_path, self.version)
+            return candidate_pyc_path.read_bytes()
+
+    # the top-k alternative segmentations of the ith code object that start with a 'B', with their k
+    def segmentation_candidates(self, i: int) -> list[tuple[int, list[str]]]:
+        predicted_entities = [r["entity"] for r in self.segmentation_results[i]]
+        strategy = functools.partial(m_deep_top_k, priority_function=naive_confidence_priority, m=2, k=self.top_k + 1)
+        # the lnotab segmentation has no probabilities, all its boundaries are equally certain
+        probabilities = self.segmentation_probabilities[i]
+        scores = probabilities.max(axis=1) if probabilities is not None else np.ones(len(predicted_entities))
+        # skip first prediction since it is the same as original
+        return [(k, prediction) for k, prediction in enumerate(get_top_k_predictions(strategy, predicted_entities, scores)[1:], start=1) if prediction[0] == "B"]
+
+    def set_segmentation(self, i: int, entities: list[str]):
+        for r, p in zip(self.segmentation_results[i], entities):
+            r["entity"] = p
+        self.update_starts_line()
+
+    # check the equivalence results of a new segmentation of the ith code object, keeping them if the correction worked
+    def accept_correction(self, i: int, k: int, equivalence_results: list, from_comp_error: bool) -> bool:
+        if from_comp_error:
+            if not has_comp_error(equivalence_results) or self.find_comp_error_cause(equivalence_results) != i:
+                self.equivalence_results = equivalence_results
+                self.highest_k_used = max(self.highest_k_used, k)
+                return True
+        elif not has_comp_error(equivalence_results) and equivalence_results[i].success:
+            self.equivalence_results[i] = equivalence_results[i]
+            self.highest_k_used = max(self.highest_k_used, k)
+            return True
+        return False
+
+    # a reused code object that failed is evicted from the code object cache and given segmentation scores, so that it is corrected like the others
+    def release_reused_code_object(self, i: int):
+        del self.reused_codeobjs[i]
+        self.codeobj_cache.evict(self.codeobj_fingerprints[i])
+        # the lnotab segmentation has no scores either
+        if self.trust_lnotab:
+            return
+        try:
+            windows = token_id_windows(self.segmenter.tokenizer, [self.segmentation_requests[i]], MAX_WINDOW_LENGTH, STEP_SIZE, bytecode_separator)
+            window_token_probabilities = self.segmenter.token_probabilities([window for _, window, _, _ in windows], batch_size=SEGMENTATION_BATCH_SIZE)
+        except Exception as e:
+            e.add_note("From segmentation")
+            raise
+        window_probabilities = [probabilities[starts] for probabilities, (_, _, _, starts) in zip(window_token_probabilities, windows)]
+        [(_, probabilities)] = merge_probabilities([coordinates for coordinates, _, _, _ in windows], window_probabilities, [indices for _, _, indices, _ in windows])
+        # the cached segmentation stays the starting point, the model's scores decide which of its boundaries to change
+        self.segmentation_probabilities[i] = probabilities
 
     # try to correct the segmentation of the ith code object
     def correct_segmentation(self, i: int, from_comp_error=False) -> bool:
+        if i in self.reused_codeobjs:
+            self.release_reused_code_object(i)
         if not self.segmentation_results[i]:
             return False
         original_prediction = [r["entity"] for r in self.segmentation_results[i]]
-        strategy = functools.partial(m_deep_top_k, priority_function=naive_confidence_priority, m=2, k=self.top_k + 1)
-        # skip first prediction since it is the same as original
-        for k, prediction in enumerate(get_top_k_predictions(strategy, self.segmentation_results[i])[1:], start=1):
-            if prediction[0] != "B":
-                continue
+        for k, prediction in self.segmentation_candidates(i):
             # change segmentation to new prediction
-            for r, p in zip(self.segmentation_results[i], prediction):
-                r["entity"] = p
-            self.update_starts_line()
+            self.set_segmentation(i, prediction)
             # retranslate affected bytecode
             translation_request = self.make_translation_request(self.ordered_instructions[i], self.segmentation_results[i])
             try:
-                self.translation_results[i] = self.translator(translation_request)
+                self.translation_results[i] = self.translator(translation_request, stats=self.translation_stats)
                 self.update_source_lines()
             except Exception as e:
                 e.add_note("From translation")
@@ -422,15 +615,8 @@ class Decompiler:
             # check if new reconstruction is correct
             previous_indented_masked_source, previous_blame, previous_indented_source = self.indented_masked_source, self.blame, self.indented_source
             self.reconstruct_source()
-            equivalence_results = self.check_reconstruction(write_source=True)
-            if from_comp_error:
-                if not has_comp_error(equivalence_results) or self.find_comp_error_cause(equivalence_results) != i:
-                    self.equivalence_results = equivalence_results
-                    self.highest_k_used = max(self.highest_k_used, k)
-                    return True
-            elif not has_comp_error(equivalence_results) and equivalence_results[i].success:
-                self.equivalence_results[i] = equivalence_results[i]
-                self.highest_k_used = max(self.highest_k_used, k)
+            equivalence_results = self.check_reconstruction(write_source=True, dirty={i})
+            if self.accept_correction(i, k, equivalence_results, from_comp_error):
                 return True
             # correction failed, roll back changes to internal source code storage
             self.indented_masked_source, self.blame, self.indented_source = previous_indented_masked_source, previous_blame, previous_indented_source
@@ -439,6 +625,62 @@ class Decompiler:
             r["entity"] = p
         return False
 
+    # try all top-k segmentations of the ith code object at once: translate them in one batch, then structure, compile and compare them in waves of ascending k and keep the first that works
+    def correct_segmentation_batched(self, i: int, from_comp_error=False) -> bool:
+        if i in self.reused_codeobjs:
+            self.release_reused_code_object(i)
+        if not self.segmentation_results[i]:
+            return False
+        candidates = self.segmentation_candidates(i)
+        if not candidates:
+            return False
+        bc = self.ordered_bytecodes[i]
+        original_prediction = [r["entity"] for r in self.segmentation_results[i]]
+        original_state = (self.translation_results[i], self.cflow_results[bc.codeobj], self.indented_masked_source, self.blame, self.indented_source)
+
+        translation_requests = [self.make_translation_request(self.ordered_instructions[i], [{"entity": p} for p in prediction]) for _, prediction in candidates]
+        try:
+            translation_results = self.translator(list(itertools.chain.from_iterable(translation_requests)), stats=self.translation_stats)
+        except Exception as e:
+            e.add_note("From translation")
+            raise
+        unflatten(translation_results, translation_requests)
+
+        # control flow reconstruction reads the starts_line of the instructions and the source lines of the whole module, so the candidates are structured one at a time
+        def structure(prediction: list[str], lines: list[str]) -> tuple:
+            self.set_segmentation(i, prediction)
+            self.translation_results[i] = lines
+            self.update_source_lines()
+            try:
+                self.cflow_results[bc.codeobj] = bytecode_to_indented_source(bc, self.source_lines)
+            except Exception as e:
+                e.add_note("From control flow reconstruction")
+                raise
+            self.reconstruct_source()
+            return lines, self.cflow_results[bc.codeobj], self.indented_masked_source, self.blame, self.indented_source
+
+        def restore(prediction: list[str], state: tuple):
+            self.set_segmentation(i, prediction)
+            self.translation_results[i], self.cflow_results[bc.codeobj], self.indented_masked_source, self.blame, self.indented_source = state
+            self.update_source_lines()
+
+        # only compiling with the interpreter of another version runs outside the GIL, so candidates of the running version are checked one at a time
+        wave_size = 1 if self.version == sys.version_info else os.cpu_count() or 1
+        candidates = [(k, prediction, lines) for (k, prediction), lines in zip(candidates, translation_results)]
+        for start in range(0, len(candidates), wave_size):
+            wave = [(k, prediction, structure(prediction, lines)) for k, prediction, lines in candidates[start : start + wave_size]]
+            if len(wave) == 1:
+                wave_results = [self.check_reconstruction(True, wave[0][2][-1], {i})]
+            else:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=len(wave)) as executor:
+                    wave_results = list(executor.map(lambda state: self.check_reconstruction(True, state[-1], {i}), [state for _, _, state in wave]))
+            for equivalence_results, (k, prediction, state) in zip(wave_results, wave):
+                restore(prediction, state)
+                if self.accept_correction(i, k, equivalence_results, from_comp_error):
+                    return True
+        restore(original_prediction, original_state)
+        return False
+
     # update starts_line of all instructions based on segmentation results
     def update_starts_line(self):
         line = 0
@@ -451,7 +693,124 @@ class Decompiler:
                     inst.starts_line = None
 
 
-def decompile(file: Path, out_dir: Path, config_file: Path | None = None, version: PythonVersion | tuple[int, int] | str | None = None, top_k: int = 10, trust_lnotab: bool = False) -> DecompilerResult:
+def resolve_config_file(config_file: Path | None = None) -> Path:
+    """
+    Find the decompiler config to use, defaulting to the one shipped with pylingual.
+
+    :param config_file: Path to decompiler_config.yaml, or None to load the default pylingual config.
+    :return: Path to an existing config file
+    """
+    # try auto load config file from package
+    if config_file is None:
+        pkg_path = importlib.resources.files("pylingual")
+        with importlib.resources.as_file(pkg_path.joinpath("decompiler_config.yaml")) as pylingual_config:
+            config_file = Path(pylingual_config)
+
+    # check config exists
+    if not config_file.exists():
+        raise FileNotFoundError(f"Decompiler config {config_file} not found")
+    return config_file
+
+
+def detect_version(file: Path) -> PythonVersion:
+    """
+    Detect the python version of a PYC file from its magic number without loading the whole file.
+
+    :param file: path to the pyc
+    :return: The detected PythonVersion
+    """
+    with file.open("rb") as f:
+        magic = int.from_bytes(f.read(2), "little")
+    try:
+        return PythonVersion(magicint2version[magic])
+    except ValueError:
+        raise
+    except Exception as err:
+        raise TypeError("Error automatically parsing version from pyc") from err
+
+
+def result_dirs(files: Iterable[Path], out_dir: Path) -> dict[Path, Path]:
+    """
+    Choose a result directory in out_dir for each pyc, so that pycs decompiled together never write to the same place
+
+    :param files: Paths to the pycs
+    :param out_dir: Directory to create the result directories in
+    :return: dict of pyc path to out_dir/decompiled_<pyc_name>, or out_dir/decompiled_<pyc_name>_<n> numbered in input order when several pycs share a name
+    """
+    files = list(dict.fromkeys(files))
+    stems = collections.Counter(file.stem for file in files)
+    used = {f"decompiled_{stem}" for stem, count in stems.items() if count == 1}
+    dirs = {}
+    for file in files:
+        name = f"decompiled_{file.stem}"
+        if stems[file.stem] > 1:
+            n = 1
+            while f"{name}_{n}" in used:
+                n += 1
+            name = f"{name}_{n}"
+            used.add(name)
+        dirs[file] = out_dir / name
+    return dirs
+
+
+def result_cache_key(pyc: bytes, config_file: Path, version: PythonVersion, top_k: int, trust_lnotab: bool, quantize: str | None = None, backend: str = "torch") -> str:
+    """
+    Content address of a decompilation result: a hash of the pyc contents and of every setting that changes its decompilation.
+
+    :param pyc: Contents of the pyc
+    :param quantize: Quantization override of the models
+    :param backend: Inference backend running the models
+    :return: hex digest to use as the result cache key
+    """
+    settings = {**model_settings(config_file, version, quantize, backend), "top_k": top_k, "trust_lnotab": trust_lnotab}
+    digest = hashlib.sha256(pyc)
+    digest.update(json.dumps(settings, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def load_cached_result(result_cache: DiskCache, key: str, file: Path, out_dir: Path) -> DecompilerResult | None:
+    """
+    Restore a cached decompilation result, writing its decompiled source and equivalence report to out_dir
+
+    :return: The cached DecompilerResult, or None on a cache miss
+    """
+    entry = result_cache.get(key)
+    if entry is None:
+        return None
+    logger.info(f"Using cached decompilation of {file}")
+    out_dir.mkdir(parents=True, exist_ok=True)
+    decompiled_source = out_dir / file.with_suffix(".py").name
+    decompiled_source.write_text(entry["source"])
+    equivalence_results = [TestResult(**r) if "name_a" in r else CompileError(r["message"]) for r in entry["result"]["equivalence_results"]]
+    (out_dir / "equivalence_report.txt").write_text("\n".join(str(r) for r in equivalence_results))
+    return DecompilerResult(equivalence_results, file, decompiled_source, out_dir, PythonVersion(entry["result"]["version"]))
+
+
+def store_cached_result(result_cache: DiskCache, key: str, result: DecompilerResult):
+    # without an equivalence check the result is incomplete, so it is not worth keeping
+    if not can_check_equivalence(result.version):
+        return
+    result_cache.put(key, {"result": result.to_dict(), "source": result.decompiled_source.read_text()})
+
+
+def decompile(
+    file: Path,
+    out_dir: Path,
+    config_file: Path | None = None,
+    version: PythonVersion | tuple[int, int] | str | None = None,
+    top_k: int = 10,
+    trust_lnotab: bool = False,
+    model_cache: ModelCache | None = None,
+    pool: CodeObjectPool | None = None,
+    result_cache: DiskCache | None = None,
+    codeobj_cache: CodeObjectCache | None = None,
+    translation_store: TranslationStore | None = None,
+    quantize: str | None = None,
+    backend: str = "torch",
+    onnx_dir: Path | None = None,
+    model_dir: Path | None = None,
+    batch_correction: bool = False,
+) -> DecompilerResult:
     """
     Decompile a PYC file.
 
@@ -461,6 +820,16 @@ def decompile(file: Path, out_dir: Path, config_file: Path | None = None, versio
     :param version: Loads the models corresponding to this python version. if None, automatically detects version based on input PYC file.
     :param top_k: Max number of pyc segmentations to consider.
     :param trust_lnotab: Trust the lnotab in the input PYC for segmentation, recommended False.
+    :param model_cache: ModelCache to take the models from. if None, the models are loaded for this file only.
+    :param pool: CodeObjectPool to run control flow reconstruction and equivalence checks of large modules on. if None, everything runs in this process.
+    :param result_cache: DiskCache of earlier decompilation results, keyed by result_cache_key. if None, results are not cached.
+    :param codeobj_cache: CodeObjectCache of code objects solved in earlier pycs. if None, every code object is decompiled.
+    :param translation_store: Persistent TranslationStore for the translator when model_cache is None.
+    :param quantize: Quantization of the models when model_cache is None, "int8" or "none". if None, the QUANTIZE setting of the config is used.
+    :param backend: Inference backend of the models when model_cache is None, "torch" or "onnx".
+    :param onnx_dir: Directory the models were exported to with export_onnx, required by the onnx backend.
+    :param model_dir: Snapshot directory the models were pulled to with pull_models when model_cache is None. if None, the models are loaded from the hub.
+    :param batch_correction: Translate all top k segmentations of a failing code object in one batch and check them concurrently instead of one at a time.
     :return: DecompilerResult class including important information about decompilation
     """
     logger.info(f"Loading {file}...")
@@ -478,22 +847,259 @@ def decompile(file: Path, out_dir: Path, config_file: Path | None = None, versio
     else:
         pversion = PythonVersion(version)
 
-    # try auto load config file from package
-    if config_file is None:
-        pkg_path = importlib.resources.files("pylingual")
-        with importlib.resources.as_file(pkg_path.joinpath("decompiler_config.yaml")) as pylingual_config:
-            config_file = Path(pylingual_config)
+    config_file = resolve_config_file(config_file)
 
-    # check config exists
-    if not config_file.exists():
-        raise FileNotFoundError(f"Decompiler config {config_file} not found")
+    if result_cache is not None:
+        cache_key = result_cache_key(file.read_bytes(), config_file, pversion, top_k, trust_lnotab, *((model_cache.quantize, model_cache.backend) if model_cache is not None else (quantize, backend)))
+        result = load_cached_result(result_cache, cache_key, file, out_dir)
+        if result is not None:
+            log_summary(result)
+            return result
 
-    segmenter, translator = load_models(config_file, pversion)
+    if model_cache is not None:
+        segmenter, translator = model_cache.get(config_file, pversion)
+    else:
+        segmenter, translator = load_models(config_file, pversion, translation_store=translation_store, quantize=quantize, backend=backend, onnx_dir=onnx_dir, model_dir=model_dir)
 
     logger.info(f"Decompiling pyc {file.resolve()} to {out_dir.resolve()}")
-    result = Decompiler(pyc, out_dir, segmenter, translator, pversion, top_k, trust_lnotab).result
+    result = Decompiler(pyc, out_dir, segmenter, translator, pversion, top_k, trust_lnotab, pool=pool, codeobj_cache=codeobj_cache, batch_correction=batch_correction).result
+    if result_cache is not None:
+        store_cached_result(result_cache, cache_key, result)
+    log_summary(result)
+    return result
+
 
+def log_summary(result: DecompilerResult):
     logger.info("Decompilation complete")
     logger.info(f"{round(result.calculate_success_rate(), 2)}% code object success rate")
+    if result.translation_cache is not None:
+        stats = result.translation_cache
+        logger.info(f"Translation cache: {stats.hits} hits, {stats.store_hits} store hits, {stats.misses} misses ({round(stats.hit_rate(), 2)}% hit rate)")
+        if stats.runaways:
+            logger.warning(f"{stats.runaways} statement translations were cut off at the generation limit")
     logger.info(f"Result saved to {result.decompiled_source.resolve()}")
-    return result
+
+
+def run_pooled_model_stages(decompilers: list[Decompiler]) -> dict[Decompiler, Exception]:
+    """
+    Mask, segment and translate several pycs together, pooling the segmentation windows and the statements of all files into shared model batches.
+    All decompilers must share the same segmenter and translator.
+
+    :param decompilers: Decompilers created with defer=True
+    :return: The exception raised for each decompiler that failed; these should be skipped by later stages
+    """
+    failures: dict[Decompiler, Exception] = {}
+
+    def attempt(decompiler: Decompiler, note: str, stage: Callable, *args):
+        try:
+            return stage(*args)
+        except Exception as e:
+            e.add_note(note)
+            failures[decompiler] = e
+
+    def pending() -> list[Decompiler]:
+        return [decompiler for decompiler in decompilers if decompiler not in failures]
+
+    for decompiler in decompilers:
+        attempt(decompiler, "From masking bytecode", decompiler.mask_bytecode)
+    for decompiler in pending():
+        if decompiler.trust_lnotab:
+            attempt(decompiler, "From segmentation", decompiler.update_segmentation_from_lnotab)
+
+    # pool the windows of every file into shared segmentation batches
+    windows = {decompiler: attempt(decompiler, "From segmentation", decompiler.make_segmentation_windows) for decompiler in pending() if not decompiler.trust_lnotab}
+    segmented = [decompiler for decompiler in windows if decompiler not in failures]
+    if segmented:
+        logger.info(f"Segmenting bytecode for {len(segmented)} files...")
+        segmenter = segmented[0].segmenter
+        flat_window_requests = [window for decompiler in segmented for _, window, _, _ in windows[decompiler]]
+        try:
+            window_token_probabilities = segmenter.token_probabilities(TrackedDataset(SEGMENTATION_STEP, flat_window_requests), batch_size=SEGMENTATION_BATCH_SIZE) if flat_window_requests else []
+        except Exception as e:
+            # isolate the failure by segmenting each file on its own
+            logger.info(f"Pooled segmentation failed, segmenting files separately ({e})")
+            for decompiler in segmented:
+                attempt(decompiler, "From segmentation", decompiler.run_segmentation)
+        else:
+            offset = 0
+            for decompiler in segmented:
+                n = len(windows[decompiler])
+                attempt(decompiler, "From segmentation", decompiler.apply_segmentation_results, windows[decompiler], window_token_probabilities[offset : offset + n])
+                offset += n
+
+    # pool the statements of every file into shared translation batches
+    translation_requests = {decompiler: attempt(decompiler, "From translation", decompiler.make_translation_requests) for decompiler in pending()}
+    translated = [decompiler for decompiler in translation_requests if decompiler not in failures]
+    if translated:
+        logger.info(f"Translating statements for {len(translated)} files...")
+        translator = translated[0].translator
+        flattened_translation_requests = [request for decompiler in translated for request in itertools.chain.from_iterable(translation_requests[decompiler])]
+        try:
+            request_stats = [decompiler.translation_stats for decompiler in translated for requests in translation_requests[decompiler] for _ in requests]
+            flattened_translation_results = translator(flattened_translation_requests, stats=request_stats)
+        except Exception as e:
+            e.add_note("From translation")
+            for decompiler in translated:
+                failures[decompiler] = e
+        else:
+            offset = 0
+            for decompiler in translated:
+                n = sum(len(requests) for requests in translation_requests[decompiler])
+                attempt(decompiler, "From translation", decompiler.apply_translation_results, flattened_translation_results[offset : offset + n], translation_requests[decompiler])
+                offset += n
+
+    return failures
+
+
+def decompile_many(
+    files: Iterable[Path],
+    out_dir: Path | None = None,
+    config_file: Path | None = None,
+    version: PythonVersion | tuple[int, int] | str | None = None,
+    top_k: int = 10,
+    trust_lnotab: bool = False,
+    max_model_memory: int | None = None,
+    model_cache: ModelCache | None = None,
+    on_start: Callable[[Path], None] | None = None,
+    files_per_batch: int = 8,
+    pipelined: bool = False,
+    queue_size: int = 8,
+    pool: CodeObjectPool | None = None,
+    result_cache: DiskCache | None = None,
+    codeobj_cache: CodeObjectCache | None = None,
+    translation_store: TranslationStore | None = None,
+    translation_cache_bytes: int = TRANSLATION_CACHE_BYTES,
+    quantize: str | None = None,
+    backend: str = "torch",
+    onnx_dir: Path | None = None,
+    model_dir: Path | None = None,
+    batch_correction: bool = False,
+) -> Iterator[tuple[Path, DecompilerResult | Exception]]:
+    """
+    Decompile many PYC files, loading the models for each python version once for the whole run.
+    Files are grouped by python version, so results are not yielded in input order. A path given more than once is decompiled and yielded once.
+    Up to files_per_batch files of the same version share their segmentation and translation model batches.
+    With pipelined=True the model stages, the control flow reconstruction and the equivalence checks run in separate threads,
+    so the models work on the next files while earlier files are being compiled and checked.
+
+    :param files: paths to the pycs to decompile
+    :param out_dir: Directory in which a result directory is created for each pyc, see result_dirs. Defaults to the working directory.
+    :param config_file: Path to decompiler_config.yaml to load. recommended None, which loads the default pylingual config.
+    :param version: Python version of all the pycs. if None, the version of each PYC file is detected automatically.
+    :param top_k: Max number of pyc segmentations to consider.
+    :param trust_lnotab: Trust the lnotab in the input PYC for segmentation, recommended False.
+    :param max_model_memory: Approximate cap in bytes on the memory held by loaded models when model_cache is None.
+    :param model_cache: ModelCache to take the models from. if None, a new cache is used for this run.
+    :param on_start: Called with the path of each pyc before its control flow is reconstructed and checked.
+    :param files_per_batch: Number of pycs whose model requests are pooled together.
+    :param pipelined: Overlap the stages of different files.
+    :param queue_size: Maximum number of files waiting between two pipelined stages.
+    :param pool: CodeObjectPool to run control flow reconstruction and equivalence checks of large modules on. if None, everything runs in this process.
+    :param result_cache: DiskCache of earlier decompilation results, keyed by result_cache_key. if None, results are not cached.
+    :param codeobj_cache: CodeObjectCache of code objects solved in earlier pycs. if None, a new cache is used for this run.
+    :param translation_store: Persistent TranslationStore for the translators when model_cache is None.
+    :param translation_cache_bytes: Approximate cap in bytes on the in-memory translation cache of each version when model_cache is None.
+    :param quantize: Quantization of the models when model_cache is None, "int8" or "none". if None, the QUANTIZE setting of the config is used.
+    :param backend: Inference backend of the models when model_cache is None, "torch" or "onnx".
+    :param onnx_dir: Directory the models were exported to with export_onnx, required by the onnx backend.
+    :param model_dir: Snapshot directory the models were pulled to with pull_models when model_cache is None. if None, the models are loaded from the hub.
+    :param batch_correction: Translate all top k segmentations of a failing code object in one batch and check them concurrently instead of one at a time.
+    :return: iterator of (pyc path, result) pairs; files that failed to decompile are paired with the raised exception
+    """
+    config_file = resolve_config_file(config_file)
+    if model_cache is None:
+        model_cache = ModelCache(max_model_memory, translation_store=translation_store, translation_cache_bytes=translation_cache_bytes, quantize=quantize, backend=backend, onnx_dir=onnx_dir, model_dir=model_dir)
+    if codeobj_cache is None:
+        codeobj_cache = CodeObjectCache()
+    out_dir = out_dir if out_dir is not None else Path()
+    files_per_batch = max(files_per_batch, 1)
+
+    # results are keyed by path, so a path passed more than once is decompiled once
+    files = list(dict.fromkeys(files))
+    dirs = result_dirs(files, out_dir)
+
+    # group the files by version so each set of models is only loaded once
+    groups: dict[tuple[int, int], list[Path]] = {}
+    for file in files:
+        try:
+            pversion = PythonVersion(version) if version is not None else detect_version(file)
+        except Exception as err:
+            yield file, err
+            continue
+        groups.setdefault(pversion.as_tuple(), []).append(file)
+
+    batches = [(PythonVersion(pversion), group[start : start + files_per_batch]) for pversion, group in groups.items() for start in range(0, len(group), files_per_batch)]
+
+    cache_keys: dict[Path, str] = {}
+
+    # each stage maps its input to (pyc path, Decompiler or Exception) pairs, failed and cached files are passed through untouched
+    def run_model_stages(batch: tuple[PythonVersion, list[Path]]) -> Iterator[tuple[Path, Decompiler | DecompilerResult | Exception]]:
+        pversion, files = batch
+        decompilers: dict[Path, Decompiler | DecompilerResult | Exception] = {}
+        if result_cache is not None:
+            for file in files:
+                try:
+                    cache_keys[file] = result_cache_key(file.read_bytes(), config_file, pversion, top_k, trust_lnotab, model_cache.quantize, model_cache.backend)
+                    result = load_cached_result(result_cache, cache_keys[file], file, dirs[file])
+                except Exception as err:
+                    result = err
+                if result is not None:
+                    decompilers[file] = result
+        if all(file in decompilers for file in files):
+            yield from decompilers.items()
+            return
+
+        try:
+            segmenter, translator = model_cache.get(config_file, pversion)
+        except Exception as err:
+            for file in files:
+                yield file, decompilers.get(file, err)
+            return
+
+        for file in files:
+            if file in decompilers:
+                continue
+            try:
+                logger.info(f"Loading {file}...")
+                decompilers[file] = Decompiler(PYCFile(file), dirs[file], segmenter, translator, pversion, top_k, trust_lnotab, defer=True, pool=pool, codeobj_cache=codeobj_cache, batch_correction=batch_correction)
+            except Exception as err:
+                decompilers[file] = err
+        failures = run_pooled_model_stages([decompiler for decompiler in decompilers.values() if isinstance(decompiler, Decompiler)])
+        for file in files:
+            yield file, failures.get(decompilers[file], decompilers[file])
+
+    def run_cflow_stages(item: tuple[Path, Decompiler | DecompilerResult | Exception]) -> Iterator[tuple[Path, Decompiler | DecompilerResult | Exception]]:
+        file, decompiler = item
+        if isinstance(decompiler, Decompiler):
+            try:
+                logger.info(f"Decompiling pyc {file.resolve()} to {decompiler.out_dir.resolve()}")
+                decompiler.run_cflow_reconstruction()
+                decompiler.reconstruct_source()
+            except Exception as err:
+                decompiler = err
+        yield file, decompiler
+
+    def run_verification(item: tuple[Path, Decompiler | DecompilerResult | Exception]) -> Iterator[tuple[Path, DecompilerResult | Exception]]:
+        file, decompiler = item
+        if not isinstance(decompiler, Decompiler):
+            if isinstance(decompiler, DecompilerResult):
+                log_summary(decompiler)
+            yield file, decompiler
+            return
+        if on_start is not None:
+            on_start(file)
+        try:
+            decompiler.verify()
+            if result_cache is not None:
+                store_cached_result(result_cache, cache_keys.pop(file), decompiler.result)
+        except Exception as err:
+            yield file, err
+            return
+        log_summary(decompiler.result)
+        yield file, decompiler.result
+
+    stages = [run_model_stages, run_cflow_stages, run_verification]
+    if pipelined:
+        yield from run_pipelined(batches, stages, maxsize=queue_size)
+    else:
+        yield from run_stages(batches, stages)
@@ -36,6 +36,8 @@ class EditableBytecode:
         version,
         name_prefix: Optional[str] = None,
         parent=None,
+        *,
+        recursive: bool = True,
     ):
         self.codeobj = codeobj
         self.opcode = opcode
@@ -98,9 +100,9 @@ class EditableBytecode:
         self.child_bytecodes = []
         self.bytecode_lookup = {}
 
-        # Initialize recursive structure
+        # Initialize recursive structure; without it, nested code objects stay raw code objects in co_consts
         for i, const in enumerate(self.co_consts):
-            if iscode(const):
+            if recursive and iscode(const):
                 self.co_consts[i] = EditableBytecode(const, opcode, self.version, name_prefix=self.name, parent=self)
                 self.child_bytecodes.append(self.co_consts[i])  # Keeps it in order
                 self.bytecode_lookup[const.co_name] = self.co_consts[i]
@@ -6,7 +6,11 @@ from xdis.load import load_module_from_file_object, load_module
 import xdis.opcodes
 
 from io import BytesIO
+import importlib.util
 import pathlib
+import platform
+import sys
+import types
 
 
 class PYCFile(EditableBytecode):
@@ -18,6 +22,9 @@ class PYCFile(EditableBytecode):
         if isinstance(source, bytes):
             source = BytesIO(source)
             source_tuple = load_module_from_file_object(source)
+        elif isinstance(source, types.CodeType):
+            # a code object compiled by the running interpreter, which skips writing and unmarshalling a pyc
+            source_tuple = (sys.version_info[:2], None, int.from_bytes(importlib.util.MAGIC_NUMBER[:2], "little"), source, platform.python_implementation() == "PyPy", None, None)
         elif isinstance(source, pathlib.Path):
             source_tuple = load_module(str(source))
             self.pyc_path = source
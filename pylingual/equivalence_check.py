@@ -1,14 +1,21 @@
 from __future__ import annotations
 
+import dataclasses
 import difflib
+import types
 from dataclasses import dataclass
+from io import BytesIO
 from pathlib import Path
+from typing import Iterator
 
 import networkx as nx
+from xdis import iscode
+from xdis.load import load_module, load_module_from_file_object
 from pylingual.control_flow_reconstruction.structure_control_flow import condense_basic_blocks
 from pylingual.editable_bytecode import EditableBytecode, Inst, PYCFile
 from pylingual.editable_bytecode.bytecode_patches import fix_indirect_jump, fix_unreachable, remove_extended_arg, remove_nop
 from pylingual.editable_bytecode.control_flow_graph import bytecode_to_control_flow_graph
+from pylingual.editable_bytecode.utils import unwrap
 
 
 def is_control_flow_equivalent(basic_block_graph_1: nx.DiGraph, basic_block_graph_2: nx.DiGraph) -> bool:
@@ -43,19 +50,28 @@ def is_control_flow_equivalent(basic_block_graph_1: nx.DiGraph, basic_block_grap
     return True
 
 
-def compare_instruction(inst_a: Inst, inst_b: Inst):
-    attr_list = ("opname", "opcode", "optype", "real_size", "has_arg", "has_extended_arg", "offset", "is_jump_target")
+# the attributes of two instructions that have to match, besides the argval
+INSTRUCTION_ATTRIBUTES = ("opname", "opcode", "optype", "real_size", "has_arg", "has_extended_arg", "offset", "is_jump_target")
+
+
+def instruction_signature(inst: Inst) -> tuple:
+    """
+    Everything compare_instruction looks at in an instruction, so that it can be computed once for instructions compared many times
+    """
+    return inst.is_uncond_jump, tuple(getattr(inst, attr, None) for attr in INSTRUCTION_ATTRIBUTES), getattr(inst, "argval", None)
+
+
+def compare_signatures(signature_a: tuple, signature_b: tuple) -> bool:
+    is_uncond_jump_a, attributes_a, argval_a = signature_a
+    is_uncond_jump_b, attributes_b, argval_b = signature_b
 
     # resolve different types of uncond jumps
-    if inst_a.is_uncond_jump and inst_b.is_uncond_jump:
-        return getattr(inst_a, "argval", None) == getattr(inst_b, "argval", None)
+    if is_uncond_jump_a and is_uncond_jump_b:
+        return argval_a == argval_b
 
-    if not all(getattr(inst_a, attr, None) == getattr(inst_b, attr, None) for attr in attr_list):
+    if attributes_a != attributes_b:
         return False
 
-    argval_a = getattr(inst_a, "argval", None)
-    argval_b = getattr(inst_b, "argval", None)
-
     if argval_a == argval_b:
         return True
 
@@ -66,7 +82,11 @@ def compare_instruction(inst_a: Inst, inst_b: Inst):
     return False
 
 
-def compare_bytecode(pyc_a: EditableBytecode, pyc_b: EditableBytecode) -> bcComparisonResult:
+def compare_instruction(inst_a: Inst, inst_b: Inst):
+    return compare_signatures(instruction_signature(inst_a), instruction_signature(inst_b))
+
+
+def compare_bytecode(pyc_a: EditableBytecode, pyc_b: EditableBytecode, signatures_a: list[tuple] | None = None) -> bcComparisonResult:
     """
     Directly Compares two pyc files by recursing through root bytecode and all child bytecodes of pyc files
     Ignores some forensically irrelevant data such as:
@@ -75,6 +95,7 @@ def compare_bytecode(pyc_a: EditableBytecode, pyc_b: EditableBytecode) -> bcComp
 
     :param pyc_a: First pyc to compare
     :param pyc_b: Second pyc to compare
+    :param signatures_a: instruction_signature of each instruction of pyc_a, if they are already known
     """
 
     if len(pyc_a) != len(pyc_b):
@@ -85,20 +106,41 @@ def compare_bytecode(pyc_a: EditableBytecode, pyc_b: EditableBytecode) -> bcComp
 
     # make sure all the instructions match at this node
 
-    for inst_a, inst_b in zip(pyc_a, pyc_b):
-        if not compare_instruction(inst_a, inst_b):
+    if signatures_a is None:
+        signatures_a = [instruction_signature(inst_a) for inst_a in pyc_a]
+    for signature_a, inst_b in zip(signatures_a, pyc_b):
+        if not compare_signatures(signature_a, instruction_signature(inst_b)):
             # We purposefully check pyc_b as this is our candidate pyc in decompiler.py
             fail_offset = inst_b.offset
             insts_b = pyc_b.instructions
             inst_idx = insts_b.index(inst_b)
-            try:
-                lno = next(inst.starts_line for inst in reversed(insts_b[:inst_idx]) if inst.starts_line is not None)
-            except StopIteration:
-                lno = None
-            return bcComparisonResult(False, lno, fail_offset)
+            return bcComparisonResult(False, line_number_before(insts_b, inst_idx), fail_offset)
     return bcComparisonResult(True)
 
 
+def line_number_before(instructions: list[Inst], inst_idx: int) -> int | None:
+    """
+    :return: The line of the closest instruction before instructions[inst_idx] that starts a line
+    """
+    return next((inst.starts_line for inst in reversed(instructions[:inst_idx]) if inst.starts_line is not None), None)
+
+
+# stands in for nested code objects in fingerprints, since compare_signatures treats all code objects as equal
+_CODE_OBJECT = object()
+
+# the attributes of a raw code object that its patched bytecode is built from, besides its constants
+CODE_ATTRIBUTES = ("co_name", "co_code", "co_names", "co_varnames", "co_freevars", "co_cellvars", "co_flags", "co_argcount", "co_posonlyargcount", "co_kwonlyargcount", "co_exceptiontable")
+
+
+def code_fingerprint(code) -> tuple:
+    """
+    Everything about a raw code object that compare_code_objects looks at after patching, except line numbers and nested code objects.
+    Code objects with equal fingerprints get the same result against the same reference code object.
+    """
+    consts = tuple(_CODE_OBJECT if iscode(const) else const for const in code.co_consts)
+    return *(getattr(code, attribute, None) for attribute in CODE_ATTRIBUTES), consts
+
+
 @dataclass(frozen=True)
 class TestResult:
     """
@@ -141,35 +183,208 @@ class bcComparisonResult:
     failed_offset: int | None = None
 
 
-def matching_iter(pyc_a, pyc_b):
+def match_names(names_a: list[str], names_b: list[str]) -> Iterator[tuple[int | None, int | None]]:
     """
-    Matches bytecodes in pyc_a and pyc_b with the same name
+    Matches the indices of equal names in names_a and names_b, with None for the names that have no match
     """
-    bc_a = list(pyc_a.iter_bytecodes())
-    bc_b = list(pyc_b.iter_bytecodes())
-    sm = difflib.SequenceMatcher(a=[x.name for x in bc_a], b=[x.name for x in bc_b])
+    sm = difflib.SequenceMatcher(a=names_a, b=names_b)
     i_a = 0
     i_b = 0
     for block in sm.get_matching_blocks():
         while i_a < block.a:
-            yield bc_a[i_a], None
+            yield i_a, None
             i_a += 1
         while i_b < block.b:
-            yield None, bc_b[i_b]
+            yield None, i_b
             i_b += 1
         for i in range(block.size):
-            yield bc_a[i_a + i], bc_b[i_b + i]
+            yield i_a + i, i_b + i
         i_a += block.size
         i_b += block.size
-    while i_a < len(bc_a):
-        yield bc_a[i_a], None
+    while i_a < len(names_a):
+        yield i_a, None
         i_a += 1
-    while i_b < len(bc_b):
-        yield None, bc_b[i_b]
+    while i_b < len(names_b):
+        yield None, i_b
         i_b += 1
 
 
-def compare_pyc(pyc_path_a: Path, pyc_path_b: Path) -> list[TestResult]:
+def matching_iter(pyc_a, pyc_b):
+    """
+    Matches bytecodes in pyc_a and pyc_b with the same name
+    """
+    bc_a = list(pyc_a.iter_bytecodes())
+    bc_b = list(pyc_b.iter_bytecodes())
+    for i_a, i_b in match_names([x.name for x in bc_a], [x.name for x in bc_b]):
+        yield bc_a[i_a] if i_a is not None else None, bc_b[i_b] if i_b is not None else None
+
+
+def load_code(pyc: Path | bytes | types.CodeType):
+    """
+    :param pyc: Path to or contents of the pyc, or a module code object compiled by the running interpreter
+    :return: The module code object of the pyc, without building or patching its bytecode
+    """
+    if isinstance(pyc, types.CodeType):
+        return pyc
+    if isinstance(pyc, bytes):
+        return load_module_from_file_object(BytesIO(pyc))[3]
+    return load_module(str(pyc))[3]
+
+
+def iter_code_objects(code, name_prefix: str | None = None) -> Iterator[tuple[str, object]]:
+    """
+    Names and raw code objects of a module, in the order and with the names of EditableBytecode.iter_bytecodes
+    """
+    name = unwrap(code.co_name) if name_prefix is None else f"{name_prefix}.{unwrap(code.co_name)}"
+    yield name, code
+    for const in code.co_consts:
+        if iscode(const):
+            yield from iter_code_objects(const, name)
+
+
+# patches applied to both sides of a comparison, each works on one code object at a time
+COMPARISON_PATCHES = [remove_extended_arg, remove_nop, fix_indirect_jump, fix_unreachable, remove_extended_arg]
+
+
+def load_patched_pyc(pyc: Path | bytes | types.CodeType) -> PYCFile:
+    """
+    Loads a pyc and patches it for comparison.
+
+    note: will always patch out unreachable code
+
+    :param pyc: Path to or contents of the pyc, or a module code object compiled by the running interpreter
+    """
+    pyc_file = PYCFile(pyc)
+    pyc_file.apply_patches(COMPARISON_PATCHES)
+    return pyc_file
+
+
+def compare_code_objects(bytecode_a: EditableBytecode | None, bytecode_b: EditableBytecode | None, reference: ReferencePyc | None = None) -> TestResult:
+    """
+    Tests the control flow and bytecode of a pair of matched code objects
+
+    :param bytecode_a: Code object from the first pyc, None if it has no match
+    :param bytecode_b: Code object from the second pyc, None if it has no match
+    :param reference: ReferencePyc of the first pyc, to reuse what it already built for bytecode_a
+    """
+    if bytecode_a is None:
+        return TestResult(False, "Extra bytecode", "None", bytecode_b.name)
+    if bytecode_b is None:
+        return TestResult(False, "Missing bytecode", bytecode_a.name, "None")
+    block_graph_a = reference.block_graph(bytecode_a) if reference is not None else condense_basic_blocks(bytecode_to_control_flow_graph(bytecode_a))
+    block_graph_b = condense_basic_blocks(bytecode_to_control_flow_graph(bytecode_b))
+    if not is_control_flow_equivalent(block_graph_a, block_graph_b):
+        return TestResult(False, "Different control flow", bytecode_a.name, bytecode_b.name)
+
+    bytecode_result = compare_bytecode(bytecode_a, bytecode_b, reference.signatures(bytecode_a) if reference is not None else None)
+    if not bytecode_result.result:
+        return TestResult(False, "Different bytecode", bytecode_a.name, bytecode_b.name, bytecode_result.failed_line, bytecode_result.failed_offset)
+
+    return TestResult(True, "Equal", bytecode_a.name, bytecode_b.name)
+
+
+class ReferencePyc:
+    """
+    Original pyc that many candidates are compared against.
+    It is loaded and patched once, and the basic block graph and instruction signatures of each of its code objects are built on first use,
+    so that every later comparison only processes the candidate.
+    Candidates are only unmarshalled as a whole; each of their code objects that has to be compared is built and patched on its own.
+    The last result of each reference code object is kept with the code_fingerprint of the candidate code object it was compared to,
+    so that comparisons limited to dirty code objects reuse the results of the others without building them.
+
+    :param pyc: Path to or contents of the original pyc
+    """
+
+    def __init__(self, pyc: Path | bytes):
+        self.data = pyc.read_bytes() if isinstance(pyc, Path) else pyc
+        self.pyc = load_patched_pyc(self.data)
+        self.bytecodes = list(self.pyc.iter_bytecodes())
+        # keyed by id, the bytecodes live as long as self.pyc
+        self._block_graphs: dict[int, nx.DiGraph] = {}
+        self._signatures: dict[int, list[tuple]] = {}
+        self._results: dict[int, tuple[tuple, TestResult]] = {}
+
+    def block_graph(self, bytecode: EditableBytecode) -> nx.DiGraph:
+        if id(bytecode) not in self._block_graphs:
+            self._block_graphs[id(bytecode)] = condense_basic_blocks(bytecode_to_control_flow_graph(bytecode))
+        return self._block_graphs[id(bytecode)]
+
+    def signatures(self, bytecode: EditableBytecode) -> list[tuple]:
+        if id(bytecode) not in self._signatures:
+            self._signatures[id(bytecode)] = [instruction_signature(inst) for inst in bytecode]
+        return self._signatures[id(bytecode)]
+
+    def matching_code_objects(self, candidate: Path | bytes | types.CodeType) -> list[tuple[EditableBytecode | None, tuple[str, object] | None]]:
+        """
+        :param candidate: Path to or contents of the candidate pyc, or its module code object
+        :return: The reference bytecodes matched by name with the (name, raw code object) of the candidate's code objects
+        """
+        code_objects = list(iter_code_objects(load_code(candidate)))
+        matches = match_names([bytecode.name for bytecode in self.bytecodes], [name for name, _ in code_objects])
+        return [(self.bytecodes[i_a] if i_a is not None else None, code_objects[i_b] if i_b is not None else None) for i_a, i_b in matches]
+
+    def candidate_bytecode(self, name: str, code) -> EditableBytecode:
+        """
+        Build and patch one code object of a candidate without its nested code objects, as it would be in the patched candidate pyc
+        """
+        bytecode = EditableBytecode(code, self.pyc.opcode, self.pyc.version, name_prefix=name.rpartition(".")[0] or None, recursive=False)
+        bytecode.apply_patches(COMPARISON_PATCHES)
+        return bytecode
+
+    def compare_pair(self, bytecode_a: EditableBytecode | None, code_b: tuple[str, object] | None) -> TestResult:
+        """
+        compare_code_objects of a pair of matching_code_objects
+        """
+        return compare_code_objects(bytecode_a, self.candidate_bytecode(*code_b) if code_b is not None else None, self)
+
+    def reuse_results(self, pairs: list[tuple[EditableBytecode | None, tuple[str, object] | None]], dirty: set[str] | None) -> tuple[list[TestResult | None], list[tuple | None]]:
+        """
+        :param pairs: matching_code_objects of a candidate
+        :param dirty: Names of the reference code objects that have to be compared again, None if all of them do
+        :return: The result of each pair that does not have to be compared again, None for the others,
+                 and the code_fingerprint of the candidate code object of each pair to record_result with
+        """
+        results, fingerprints = [], []
+        for bytecode_a, code_b in pairs:
+            if bytecode_a is None or code_b is None:
+                # unmatched code objects fail without being built
+                results.append(TestResult(False, "Extra bytecode", "None", code_b[0]) if bytecode_a is None else TestResult(False, "Missing bytecode", bytecode_a.name, "None"))
+                fingerprints.append(None)
+                continue
+            fingerprint = code_fingerprint(code_b[1])
+            fingerprints.append(fingerprint)
+            if dirty is None or bytecode_a.name in dirty or (cached := self._results.get(id(bytecode_a))) is None or cached[0] != fingerprint:
+                results.append(None)
+                continue
+            result = cached[1]
+            if result.failed_offset is not None:
+                # lines before the code object may have moved, which only the built bytecode knows
+                instructions = self.candidate_bytecode(*code_b).instructions
+                inst_idx = next((i for i, inst in enumerate(instructions) if inst.offset == result.failed_offset), 0)
+                result = dataclasses.replace(result, failed_line_number=line_number_before(instructions, inst_idx))
+            results.append(result)
+        return results, fingerprints
+
+    def record_result(self, bytecode_a: EditableBytecode, fingerprint: tuple, result: TestResult):
+        self._results[id(bytecode_a)] = (fingerprint, result)
+
+    def compare(self, candidate: Path | bytes | types.CodeType, dirty: set[str] | None = None) -> list[TestResult]:
+        """
+        compare_pyc of the reference and a candidate
+
+        :param candidate: Path to or contents of the candidate pyc, or its module code object
+        :param dirty: Names of the reference code objects that may differ from the last candidate, None to compare all of them
+        """
+        pairs = self.matching_code_objects(candidate)
+        results, fingerprints = self.reuse_results(pairs, dirty)
+        for i, result in enumerate(results):
+            if result is None:
+                results[i] = self.compare_pair(*pairs[i])
+                self.record_result(pairs[i][0], fingerprints[i], results[i])
+        return results
+
+
+def compare_pyc(pyc_path_a: Path, pyc_path_b: Path | bytes | types.CodeType) -> list[TestResult]:
     """
     Tests the control flow of the two pyc files
     Should not be imported as it relies on TestResult class.
@@ -177,42 +392,10 @@ def compare_pyc(pyc_path_a: Path, pyc_path_b: Path) -> list[TestResult]:
     note: will always patch out unreachable code
 
     :param pyc_path_a: First pyc to compare
-    :param pyc_path_b: Second pyc to compare
-    """
-
-    pyc_a = PYCFile(pyc_path_a)
-    pyc_b = PYCFile(pyc_path_b)
-
-    pyc_a.apply_patches([remove_extended_arg, remove_nop, fix_indirect_jump, fix_unreachable, remove_extended_arg])
-    pyc_b.apply_patches([remove_extended_arg, remove_nop, fix_indirect_jump, fix_unreachable, remove_extended_arg])
-
-    results = []
-
-    for bytecode_a, bytecode_b in matching_iter(pyc_a, pyc_b):
-        if bytecode_a is None:
-            test_result = TestResult(False, "Extra bytecode", "None", bytecode_b.name)
-            results.append(test_result)
-            continue
-        if bytecode_b is None:
-            test_result = TestResult(False, "Missing bytecode", bytecode_a.name, "None")
-            results.append(test_result)
-            continue
-        cfg_a = bytecode_to_control_flow_graph(bytecode_a)
-        cfg_b = bytecode_to_control_flow_graph(bytecode_b)
-        block_graph_a = condense_basic_blocks(cfg_a)
-        block_graph_b = condense_basic_blocks(cfg_b)
-        if not is_control_flow_equivalent(block_graph_a, block_graph_b):
-            test_result = TestResult(False, "Different control flow", bytecode_a.name, bytecode_b.name)
-            results.append(test_result)
-            continue
-
-        bytecode_result = compare_bytecode(bytecode_a, bytecode_b)
-        if not bytecode_result.result:
-            test_result = TestResult(False, "Different bytecode", bytecode_a.name, bytecode_b.name, bytecode_result.failed_line, bytecode_result.failed_offset)
-            results.append(test_result)
-            continue
-
-        test_result = TestResult(True, "Equal", bytecode_a.name, bytecode_b.name)
-        results.append(test_result)
-
-    return results
+    :param pyc_path_b: Second pyc to compare, or its contents or module code object
+    """
+
+    pyc_a = load_patched_pyc(pyc_path_a)
+    pyc_b = load_patched_pyc(pyc_path_b)
+
+    return [compare_code_objects(bytecode_a, bytecode_b) for bytecode_a, bytecode_b in matching_iter(pyc_a, pyc_b)]
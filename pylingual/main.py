@@ -1,10 +1,13 @@
 from typing import TYPE_CHECKING
 import click
+import json
 import logging
 import shutil
 import platform
 import subprocess
 import os
+import tempfile
+import time
 from pathlib import Path
 
 import pylingual.utils.ascii_art as ascii_art
@@ -12,7 +15,13 @@ from pylingual.utils.generate_bytecode import CompileError
 from pylingual.utils.version import PythonVersion, supported_versions
 from pylingual.utils.tracked_list import TrackedList, SEGMENTATION_STEP, TRANSLATION_STEP, CFLOW_STEP, CORRECTION_STEP
 from pylingual.utils.lazy import lazy_import
-from pylingual.decompiler import DecompilerResult, decompile
+from pylingual.utils.disk_cache import DiskCache
+from pylingual.utils.translation_store import SqliteTranslationStore
+from pylingual.codeobj_cache import CodeObjectCache
+from pylingual.decompiler import DecompilerResult, decompile_many, detect_version, resolve_config_file, result_dirs
+from pylingual.models import ModelCache, configured_versions, export_onnx, pull_models
+from pylingual.parallel import BrokeredPool, CodeObjectPool, SharedModelPool
+from pylingual.server import DEFAULT_PORT, DecompilationService, serve, submit
 
 import rich
 from rich.align import Align
@@ -54,20 +63,100 @@ def print_result(file: str, result: DecompilerResult):
         rich.get_console().print(table, justify="center")
 
 
-@click.command(help="End to end pipeline to decompile Python bytecode into source code.", context_settings={"help_option_names": ["-h", "--help"]})
+def setup_logging(quiet: bool) -> RichHandler:
+    rich.reconfigure(markup=False, emoji=False, quiet=quiet, theme=Theme({"logging.keyword": "yellow not bold"}))
+    log_handler = RichHandler(console=rich.get_console(), rich_tracebacks=True)
+    logging.basicConfig(level="INFO", format="%(message)s", datefmt="[%X]", handlers=[log_handler], force=True)
+    return log_handler
+
+
+class DefaultCommandGroup(click.Group):
+    """
+    Click group that runs a default command when the first argument is not a subcommand,
+    so that `pylingual FILES...` keeps working alongside `pylingual serve`
+    """
+
+    def __init__(self, *args, default_command: str, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.default_command = default_command
+
+    def parse_args(self, ctx: click.Context, args: list[str]) -> list[str]:
+        if not args or (args[0] not in self.commands and args[0] not in ctx.help_option_names):
+            args.insert(0, self.default_command)
+        return super().parse_args(ctx, args)
+
+
+@click.group(cls=DefaultCommandGroup, default_command="decompile", help="PyLingual Python bytecode decompiler. Runs decompile when no command is given.", context_settings={"help_option_names": ["-h", "--help"]})
+def main():
+    pass
+
+
+@main.command("decompile", help="End to end pipeline to decompile Python bytecode into source code.", context_settings={"help_option_names": ["-h", "--help"]})
 @click.argument("files", nargs=-1)
 @click.option("-o", "--out-dir", default=None, type=Path, help="The directory to export results to.", metavar="PATH")
 @click.option("-c", "--config-file", default=None, type=Path, help="Config file for model information.", metavar="PATH")
 @click.option("-v", "--version", default=None, type=PythonVersion, help="Python version of the .pyc, default is auto detection.", metavar="VERSION")
-@click.option("-k", "--top-k", default=10, type=int, help="Maximum number of additional segmentations to consider.", metavar="INT")
+@click.option("-k", "--top-k", default=None, type=int, help="Maximum number of additional segmentations to consider, default is 10 or the server's default with --remote.", metavar="INT")
 @click.option("-q", "--quiet", is_flag=True, default=False, help="Suppress console output.")
-@click.option("--trust-lnotab", is_flag=True, default=False, help="Use the lnotab for segmentation instead of the segmentation model.")
+@click.option("--trust-lnotab/--no-trust-lnotab", default=None, help="Use the lnotab for segmentation instead of the segmentation model, default is off or the server's default with --remote.")
+@click.option("--batch-correction", is_flag=True, default=False, help="Translate all top-k segmentations of a failing code object together and check them in waves of one per CPU.")
 @click.option("--init-pyenv", is_flag=True, default=False, help="Install pyenv before decompiling.")
-def main(files: list[str], out_dir: Path | None, config_file: Path | None, version: PythonVersion | None, top_k: int, trust_lnotab: bool, init_pyenv: bool, quiet: bool):
-    rich.reconfigure(markup=False, emoji=False, quiet=quiet, theme=Theme({"logging.keyword": "yellow not bold"}))
+@click.option("--max-model-memory", default=None, type=int, help="Approximate memory cap in MB for models kept loaded across files.", metavar="MB")
+@click.option("--files-per-batch", default=8, type=int, help="Number of files whose model requests are batched together.", metavar="INT")
+@click.option("--pipelined", is_flag=True, default=False, help="Overlap model inference for later files with the equivalence checks of earlier files.")
+@click.option("-j", "--jobs", default=1, type=int, help="Number of processes for control flow reconstruction and equivalence checks of large files.", metavar="INT")
+@click.option("--model-workers", default=1, type=int, help="Decompile files on this many forked processes that share one copy of the models (CPU only).", metavar="INT")
+@click.option("--broker", is_flag=True, default=False, help="With --model-workers, run the models of all workers in one inference process that batches their requests together.")
+@click.option("--broker-batch-size", default=64, type=int, help="Maximum number of windows or statements the inference process coalesces before running them.", metavar="INT")
+@click.option("--broker-max-wait", default=10, type=float, help="Milliseconds a model request may wait for requests of other workers to batch with.", metavar="MS")
+@click.option("--result-cache", default=None, type=Path, help="Directory to reuse decompilation results of identical pycs from.", metavar="PATH")
+@click.option("--result-cache-size", default=1024, type=int, help="Approximate size cap in MB of the result and code object caches.", metavar="MB")
+@click.option("--codeobj-cache", default=None, type=Path, help="Directory to persist solved code objects in, so identical functions in later runs skip the models.", metavar="PATH")
+@click.option("--translation-cache", default=None, type=Path, help="sqlite database to share translations in across runs and processes.", metavar="PATH")
+@click.option("--translation-cache-memory", default=64, type=int, help="Approximate memory cap in MB for the in-memory translation cache of each Python version.", metavar="MB")
+@click.option("--quantize", default=None, type=click.Choice(["int8", "none"]), help="Quantize the models for CPU inference, default is the QUANTIZE setting of the config.")
+@click.option("--backend", default="torch", type=click.Choice(["torch", "onnx"]), help="Inference backend, onnx runs models exported with `pylingual models export-onnx` on ONNX Runtime.")
+@click.option("--onnx-dir", default=None, type=Path, help="Directory the ONNX models were exported to.", metavar="PATH")
+@click.option("--model-dir", default=None, type=Path, envvar="PYLINGUAL_MODEL_DIR", help="Snapshot directory from `pylingual models pull` to load the models from without the hub.", metavar="PATH")
+@click.option("--remote", default=None, help="Submit the files to a running `pylingual serve` and print the results as JSON lines.", metavar="ADDRESS")
+def decompile_files(
+    files: list[str],
+    out_dir: Path | None,
+    config_file: Path | None,
+    version: PythonVersion | None,
+    top_k: int | None,
+    trust_lnotab: bool | None,
+    batch_correction: bool,
+    init_pyenv: bool,
+    quiet: bool,
+    max_model_memory: int | None,
+    files_per_batch: int,
+    pipelined: bool,
+    jobs: int,
+    model_workers: int,
+    broker: bool,
+    broker_batch_size: int,
+    broker_max_wait: float,
+    result_cache: Path | None,
+    result_cache_size: int,
+    codeobj_cache: Path | None,
+    translation_cache: Path | None,
+    translation_cache_memory: int,
+    quantize: str | None,
+    backend: str,
+    onnx_dir: Path | None,
+    model_dir: Path | None,
+    remote: str | None,
+):
+    if remote is not None:
+        # options that were not given are left out of the requests, so the server uses its own defaults
+        submit_files(remote, files, out_dir, version, top_k, trust_lnotab)
+        return
+    top_k = top_k if top_k is not None else 10
+    trust_lnotab = bool(trust_lnotab)
+
+    log_handler = setup_logging(quiet)
     console = rich.get_console()
-    log_handler = RichHandler(console=console, rich_tracebacks=True)
-    logging.basicConfig(level="INFO", format="%(message)s", datefmt="[%X]", handlers=[log_handler], force=True)
 
     if not init_pyenv and not files:
         click.echo(click.get_current_context().get_help())
@@ -100,7 +189,12 @@ def main(files: list[str], out_dir: Path | None, config_file: Path | None, versi
     # the step is not done until the TrackedList is deleted
     TrackedList.__del__ = lambda self: progress.advance(self.task.id, float("inf"))
 
-    n = len(files)
+    pyc_paths = [Path(file) for file in files]
+    for pyc_path in pyc_paths:
+        if not pyc_path.exists():
+            raise FileNotFoundError(f"pyc file {pyc_path} does not exist")
+
+    n = len(pyc_paths)
     with Live(Group(Rule(), status, progress), transient=True, console=console, refresh_per_second=12.5):
         transformers.logging.disable_default_handler()
         transformers.logging.add_handler(log_handler)
@@ -108,28 +202,230 @@ def main(files: list[str], out_dir: Path | None, config_file: Path | None, versi
         progress.add_task(TRANSLATION_STEP, start=False)
         progress.add_task(CFLOW_STEP, start=False)
         progress.add_task(CORRECTION_STEP, start=False)
-        for i, file in enumerate(files):
+        started = 0
+
+        def on_start(pyc_path: Path):
+            nonlocal started
+            started += 1
             for task in progress.tasks:
                 progress.reset(task.id, start=False)
-            pyc_path = Path(file)
-            log_handler.keywords = [file, pyc_path.name, pyc_path.with_suffix(".py").name]
-            status.update(f"Decompiling {pyc_path} ({i + 1} / {n})")
-            if not pyc_path.exists():
-                raise FileNotFoundError(f"pyc file {pyc_path} does not exist")
-
-            try:
-                result = decompile(
-                    file=pyc_path,
-                    out_dir=out_dir / f"decompiled_{pyc_path.stem}" if out_dir is not None else Path(f"decompiled_{pyc_path.stem}"),
+            log_handler.keywords = [str(pyc_path), pyc_path.name, pyc_path.with_suffix(".py").name]
+            status.update(f"Decompiling {pyc_path} ({started} / {n})")
+
+        result_disk_cache = DiskCache(result_cache, result_cache_size * 2**20) if result_cache is not None else None
+        codeobj_disk_cache = CodeObjectCache(DiskCache(codeobj_cache, result_cache_size * 2**20)) if codeobj_cache is not None else None
+        translation_store = SqliteTranslationStore(translation_cache) if translation_cache is not None else None
+        pool = CodeObjectPool(jobs) if jobs > 1 and model_workers <= 1 else None
+        try:
+            if model_workers > 1 and broker:
+                status.update(f"Starting {model_workers} workers and an inference broker...")
+                pool = BrokeredPool(
+                    resolve_config_file(Path(config_file) if config_file else None),
+                    model_workers,
+                    broker_batch_size,
+                    broker_max_wait / 1000,
+                    result_cache=(result_cache, result_cache_size * 2**20) if result_cache is not None else None,
+                    codeobj_cache=(codeobj_cache, result_cache_size * 2**20) if codeobj_cache is not None else None,
+                    translation_cache=translation_cache,
+                    translation_cache_bytes=translation_cache_memory * 2**20,
+                    max_memory=max_model_memory * 2**20 if max_model_memory is not None else None,
+                    quantize=quantize,
+                    backend=backend,
+                    onnx_dir=onnx_dir,
+                    model_dir=model_dir,
+                )
+                results = pool.decompile_many(pyc_paths, out_dir if out_dir is not None else Path(), version, top_k, trust_lnotab, batch_correction)
+                status.update(f"Decompiling {n} files on {model_workers} workers...")
+            elif model_workers > 1:
+                resolved_config_file = resolve_config_file(Path(config_file) if config_file else None)
+                model_cache = ModelCache(
+                    translation_store=translation_store,
+                    translation_cache_bytes=translation_cache_memory * 2**20,
+                    quantize=quantize,
+                    backend=backend,
+                    onnx_dir=onnx_dir,
+                    model_dir=model_dir,
+                )
+                versions = [version] if version is not None else list({detect_version(pyc_path).as_tuple(): None for pyc_path in pyc_paths})
+                status.update(f"Loading models for {len(versions)} versions and starting {model_workers} workers...")
+                pool = SharedModelPool(model_cache, resolved_config_file, [PythonVersion(v) for v in versions], model_workers, result_disk_cache, codeobj_disk_cache)
+                results = pool.decompile_many(pyc_paths, out_dir if out_dir is not None else Path(), version, top_k, trust_lnotab, batch_correction)
+                status.update(f"Decompiling {n} files on {model_workers} workers...")
+            else:
+                results = decompile_many(
+                    pyc_paths,
+                    out_dir=out_dir,
                     config_file=Path(config_file) if config_file else None,
                     version=version,
                     top_k=top_k,
                     trust_lnotab=trust_lnotab,
+                    batch_correction=batch_correction,
+                    max_model_memory=max_model_memory * 2**20 if max_model_memory is not None else None,
+                    on_start=on_start,
+                    files_per_batch=files_per_batch,
+                    pipelined=pipelined,
+                    pool=pool,
+                    result_cache=result_disk_cache,
+                    codeobj_cache=codeobj_disk_cache,
+                    translation_store=translation_store,
+                    translation_cache_bytes=translation_cache_memory * 2**20,
+                    quantize=quantize,
+                    backend=backend,
+                    onnx_dir=onnx_dir,
+                    model_dir=model_dir,
                 )
-                print_result(pyc_path.name, result)
-            except Exception:
-                logger.exception(f"Failed to decompile {pyc_path}")
-            console.rule()
+            for pyc_path, result in results:
+                if isinstance(result, Exception):
+                    logger.error(f"Failed to decompile {pyc_path}", exc_info=result)
+                else:
+                    print_result(pyc_path.name, result)
+                console.rule()
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+
+def submit_files(address: str, files: list[str], out_dir: Path | None, version: PythonVersion | None, top_k: int | None, trust_lnotab: bool | None):
+    for pyc_path, result_dir in result_dirs([Path(file) for file in files], out_dir if out_dir is not None else Path()).items():
+        try:
+            result = submit(address, path=pyc_path, out_dir=result_dir, version=version, top_k=top_k, trust_lnotab=trust_lnotab)
+        except Exception as e:
+            result = {"original_pyc": str(pyc_path), "error": f"{type(e).__name__}: {e}"}
+        click.echo(json.dumps(result))
+
+
+@main.command("serve", help="Keep the models loaded and serve decompilation requests from `pylingual --remote`.", context_settings={"help_option_names": ["-h", "--help"]})
+@click.option("-c", "--config-file", default=None, type=Path, help="Config file for model information.", metavar="PATH")
+@click.option("-s", "--socket", "socket_path", default=None, type=Path, help="Listen on a unix socket instead of localhost HTTP.", metavar="PATH")
+@click.option("--host", default="127.0.0.1", help="Host to listen on.", metavar="HOST")
+@click.option("-p", "--port", default=DEFAULT_PORT, type=int, help="Port to listen on.", metavar="PORT")
+@click.option("-k", "--top-k", default=10, type=int, help="Default maximum number of additional segmentations to consider.", metavar="INT")
+@click.option("--trust-lnotab", is_flag=True, default=False, help="Use the lnotab for segmentation unless a request says otherwise.")
+@click.option("--preload", multiple=True, type=PythonVersion, help="Load the models for this Python version on startup, can be repeated.", metavar="VERSION")
+@click.option("--max-model-memory", default=None, type=int, help="Approximate memory cap in MB for models kept loaded.", metavar="MB")
+@click.option("--result-cache", default=None, type=Path, help="Directory to reuse decompilation results of identical pycs from.", metavar="PATH")
+@click.option("--result-cache-size", default=1024, type=int, help="Approximate size cap in MB of the result cache.", metavar="MB")
+@click.option("--translation-cache", default=None, type=Path, help="sqlite database to share translations in across runs and processes.", metavar="PATH")
+@click.option("--translation-cache-memory", default=64, type=int, help="Approximate memory cap in MB for the in-memory translation cache of each Python version.", metavar="MB")
+@click.option("--quantize", default=None, type=click.Choice(["int8", "none"]), help="Quantize the models for CPU inference, default is the QUANTIZE setting of the config.")
+@click.option("--backend", default="torch", type=click.Choice(["torch", "onnx"]), help="Inference backend, onnx runs models exported with `pylingual models export-onnx` on ONNX Runtime.")
+@click.option("--onnx-dir", default=None, type=Path, help="Directory the ONNX models were exported to.", metavar="PATH")
+@click.option("--model-dir", default=None, type=Path, envvar="PYLINGUAL_MODEL_DIR", help="Snapshot directory from `pylingual models pull` to load the models from without the hub.", metavar="PATH")
+@click.option("-q", "--quiet", is_flag=True, default=False, help="Suppress console output.")
+def serve_requests(
+    config_file: Path | None,
+    socket_path: Path | None,
+    host: str,
+    port: int,
+    top_k: int,
+    trust_lnotab: bool,
+    preload: list[PythonVersion],
+    max_model_memory: int | None,
+    result_cache: Path | None,
+    result_cache_size: int,
+    translation_cache: Path | None,
+    translation_cache_memory: int,
+    quantize: str | None,
+    backend: str,
+    onnx_dir: Path | None,
+    model_dir: Path | None,
+    quiet: bool,
+):
+    log_handler = setup_logging(quiet)
+    transformers.logging.disable_default_handler()
+    transformers.logging.add_handler(log_handler)
+    print_header()
+
+    service = DecompilationService(
+        config_file,
+        max_model_memory * 2**20 if max_model_memory is not None else None,
+        top_k,
+        trust_lnotab,
+        DiskCache(result_cache, result_cache_size * 2**20) if result_cache is not None else None,
+        SqliteTranslationStore(translation_cache) if translation_cache is not None else None,
+        translation_cache_memory * 2**20,
+        quantize,
+        backend,
+        onnx_dir,
+        model_dir,
+    )
+    for version in preload:
+        service.preload(version)
+    serve(service, socket_path, host, port)
+
+
+@main.command("benchmark", help="Compare decompilation time and equivalence success rate of unquantized and quantized models on a set of pycs.", context_settings={"help_option_names": ["-h", "--help"]})
+@click.argument("files", nargs=-1, required=True)
+@click.option("-c", "--config-file", default=None, type=Path, help="Config file for model information.", metavar="PATH")
+@click.option("-k", "--top-k", default=10, type=int, help="Maximum number of additional segmentations to consider.", metavar="INT")
+@click.option("--quantize", default="int8", type=click.Choice(["int8"]), help="Quantization to compare against the unquantized models.")
+@click.option("--model-dir", default=None, type=Path, envvar="PYLINGUAL_MODEL_DIR", help="Snapshot directory from `pylingual models pull` to load the models from without the hub.", metavar="PATH")
+@click.option("-q", "--quiet", is_flag=True, default=False, help="Suppress console output besides the final report.")
+def benchmark(files: list[str], config_file: Path | None, top_k: int, quantize: str, model_dir: Path | None, quiet: bool):
+    setup_logging(quiet)
+    pyc_paths = [Path(file) for file in files]
+    for pyc_path in pyc_paths:
+        if not pyc_path.exists():
+            raise FileNotFoundError(f"pyc file {pyc_path} does not exist")
+    config_file = resolve_config_file(config_file)
+    versions = {detect_version(pyc_path).as_tuple() for pyc_path in pyc_paths}
+
+    table = Table(title=f"Benchmark of {len(pyc_paths)} files")
+    for column in ("Models", "Load time", "Decompile time", "Success rate", "Failed files"):
+        table.add_column(column)
+    runs = {}
+    for label in ("none", quantize):
+        model_cache = ModelCache(quantize=label, model_dir=model_dir)
+        start = time.perf_counter()
+        for version in versions:
+            model_cache.preload(config_file, PythonVersion(version))
+        load_time = time.perf_counter() - start
+        with tempfile.TemporaryDirectory() as out_dir:
+            start = time.perf_counter()
+            results = [result for _, result in decompile_many(pyc_paths, out_dir=Path(out_dir), config_file=config_file, top_k=top_k, model_cache=model_cache)]
+            decompile_time = time.perf_counter() - start
+        succeeded = [result for result in results if not isinstance(result, Exception)]
+        success_rate = sum(result.calculate_success_rate() for result in succeeded) / len(succeeded) if succeeded else 0
+        runs[label] = (decompile_time, success_rate)
+        table.add_row("fp32" if label == "none" else label, f"{load_time:.1f}s", f"{decompile_time:.1f}s", f"{success_rate:.2f}%", str(len(results) - len(succeeded)))
+        model_cache.clear()
+
+    console = rich.get_console()
+    console.quiet = False
+    console.print(table, justify="center")
+    (base_time, base_rate), (quantized_time, quantized_rate) = runs["none"], runs[quantize]
+    console.print(f"{quantize} speedup: {base_time / quantized_time:.2f}x, success rate change: {quantized_rate - base_rate:+.2f} percentage points", justify="center")
+
+
+@main.group("models", help="Manage the models used for decompilation.", context_settings={"help_option_names": ["-h", "--help"]})
+def models():
+    pass
+
+
+@models.command("pull", help="Download the configured models into a local snapshot directory for `--model-dir`.", context_settings={"help_option_names": ["-h", "--help"]})
+@click.option("-o", "--out-dir", required=True, type=Path, envvar="PYLINGUAL_MODEL_DIR", help="The snapshot directory to download the models to.", metavar="PATH")
+@click.option("-c", "--config-file", default=None, type=Path, help="Config file for model information.", metavar="PATH")
+@click.option("-v", "--version", "versions", multiple=True, type=PythonVersion, help="Python version to pull the models of, can be repeated. Default is every version in the config.", metavar="VERSION")
+@click.option("-q", "--quiet", is_flag=True, default=False, help="Suppress console output.")
+def pull_model_snapshot(out_dir: Path, config_file: Path | None, versions: list[PythonVersion], quiet: bool):
+    setup_logging(quiet)
+    config_file = resolve_config_file(config_file)
+    for version in versions or configured_versions(config_file):
+        pull_models(config_file, version, out_dir)
+    logger.info(f"Models are ready in {out_dir}, use them with --model-dir {out_dir}")
+
+
+@models.command("export-onnx", help="Export the configured models to ONNX graphs for `--backend onnx`. Requires optimum.", context_settings={"help_option_names": ["-h", "--help"]})
+@click.option("-o", "--out-dir", required=True, type=Path, help="The directory to export the models to.", metavar="PATH")
+@click.option("-c", "--config-file", default=None, type=Path, help="Config file for model information.", metavar="PATH")
+@click.option("-v", "--version", "versions", multiple=True, type=PythonVersion, help="Python version to export the models of, can be repeated. Default is every supported version.", metavar="VERSION")
+@click.option("-q", "--quiet", is_flag=True, default=False, help="Suppress console output.")
+def export_onnx_models(out_dir: Path, config_file: Path | None, versions: list[PythonVersion], quiet: bool):
+    setup_logging(quiet)
+    config_file = resolve_config_file(config_file)
+    for version in versions or supported_versions:
+        export_onnx(config_file, version, out_dir)
+        logger.info(f"Exported the models for {version} to {out_dir / f'v{version}'}")
 
 
 def install_pyenv():
@@ -1,17 +1,29 @@
 from __future__ import annotations
 
+import dataclasses
+import functools
+import gc
+import hashlib
+import json
+import math
+import os
+import sys
 import yaml
 import logging
+import threading
 
 from collections import OrderedDict
+from dataclasses import dataclass
 from pathlib import Path
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Callable
 
 from pylingual.masking.model_disasm import fix_jump_targets, normalize_masks, restore_masks
-from pylingual.utils.lists import flatten
-from pylingual.utils.tracked_list import TrackedDataset, TRANSLATION_STEP
+from pylingual.utils.tracked_list import TrackedDataset, TrackedList, TRANSLATION_STEP
 from pylingual.utils.version import PythonVersion
 from pylingual.utils.lazy import lazy_import
+from pylingual.utils.translation_store import TranslationStore
+from pylingual.backends import SegmentationBackend, TranslationBackend, LazySegmentationBackend, LazyTranslationBackend, OnnxSegmentationBackend, OnnxTranslationBackend, TorchSegmentationBackend, TorchTranslationBackend
+from pylingual.backends.base import read_export_info, write_export_info
 
 if TYPE_CHECKING:
     import torch
@@ -24,90 +36,414 @@ else:
 
 logger = logging.getLogger(__name__)
 
+TRANSLATION_CACHE_BYTES = 64 * 2**20
+# translation batches are filled up to this many padded input tokens, or TRANSLATION_BATCH_SIZE requests
+TRANSLATION_TOKEN_BUDGET = 4096
+TRANSLATION_BATCH_SIZE = 32
+# batches at a learned batch size limit that fit in a row before the limit is raised again
+BATCH_LIMIT_RECOVERY = 8
+# generation limit of the statement model: min(MAX_NEW_TOKENS, ceil(RATIO * input tokens) + OFFSET)
+# RATIO and OFFSET are measured on the training data of a model with model_training/statement/measure_generation_length.py
+# and set under STATEMENT_MODEL: MAX_NEW_TOKENS in decompiler_config.yaml; models without a measured entry generate up to MAX_NEW_TOKENS
+MAX_NEW_TOKENS = 512
+# dynamic quantization of the linear layers for CPU inference
+QUANTIZATION_DTYPES = {"int8": "qint8"}
+
+# placeholder for statements the translation model fails on
+TRANSLATION_ERROR = "'''Decompiler error: line too long for translation. Please decompile this statement manually.'''"
+
+
+def is_out_of_memory(error: Exception) -> bool:
+    """
+    :return: Whether an inference error was caused by running out of memory, like torch.cuda.OutOfMemoryError
+    """
+    message = str(error).lower()
+    return isinstance(error, MemoryError) or "out of memory" in message or "failed to allocate memory" in message
+
+
+@dataclass
+class TranslationCacheStats:
+    """
+    Counts of how translation requests were served
+
+    :param hits: Requests answered from the in-memory cache, including repeats of a statement translated in the same call
+    :param store_hits: Requests answered from the persistent TranslationStore
+    :param misses: Requests that were translated by the model
+    :param bytes_saved: Size in bytes of the normalized statements that did not have to be translated by the model
+    :param runaways: Requests whose translation was cut off at the generation limit without finishing
+    """
+
+    hits: int = 0
+    store_hits: int = 0
+    misses: int = 0
+    bytes_saved: int = 0
+    runaways: int = 0
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.store_hits + self.misses
+        return (self.hits + self.store_hits) / total * 100 if total else 0
+
 
 # translator with caching
 class CacheTranslator:
     """
     Adds cache support for statement translation
 
-    :param translator : The loaded translation model
-    :param maxsize : The maximum amount of cached items
+    :param translator : The loaded translation model backend
+    :param max_bytes : Approximate cap on the memory held by cached statements and translations
+    :param store : Persistent TranslationStore to look up translations missing from memory in, and to save new translations to
+    :param namespace : Namespace of the translation model in the store
+    :param token_budget : Maximum number of padded input tokens in a translation batch
+    :param generation_ratio : Generated tokens allowed per input token, None to always allow max_new_tokens
+    :param generation_offset : Generated tokens allowed on top of the ratio
+    :param max_new_tokens : Hard cap on generated tokens
     """
 
-    def __init__(self, translator: transformers.TranslationPipeline, maxsize=50000):
+    def __init__(
+        self,
+        translator: TranslationBackend,
+        max_bytes=TRANSLATION_CACHE_BYTES,
+        store: TranslationStore | None = None,
+        namespace: str = "",
+        token_budget: int = TRANSLATION_TOKEN_BUDGET,
+        generation_ratio: float | None = None,
+        generation_offset: int = 0,
+        max_new_tokens: int = MAX_NEW_TOKENS,
+    ):
         self.translator = translator
+        self.token_budget = token_budget
+        self.generation_ratio = generation_ratio
+        self.generation_offset = generation_offset
+        self.max_new_tokens = max_new_tokens
+        # cached statements whose translation hit the generation limit
+        self.runaways: set[str] = set()
         self.cache = OrderedDict()
-        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.store = store
+        self.namespace = namespace
+        self.stats = TranslationCacheStats()
+        self.evictions = 0
+        # padded token length -> batch size for requests this long or longer, learned from batches that ran out of memory
+        self.batch_limits: dict[int, int] = {}
+        # padded token length of a batch limit -> batches at the limit that fit since it was last lowered
+        self.limit_successes: dict[int, int] = {}
+        # pipelined decompilation translates from several threads
+        self.lock = threading.RLock()
 
     def __getitem__(self, item):
         self.cache.move_to_end(item)
         return self.cache[item]
 
-    def _translate_and_decode(self, translation_requests: TrackedDataset | list[str], batch_size: int = 32, **kwargs) -> list[str]:
-        # return_tensors=True prevents standard postprocessing which skips special tokens
-        translation_result = self.translator(translation_requests, return_tensors=True, batch_size=batch_size, **kwargs)
+    def __setitem__(self, item, value):
+        if item in self.cache:
+            self.size -= sys.getsizeof(item) + sys.getsizeof(self.cache[item])
+        self.cache[item] = value
+        self.size += sys.getsizeof(item) + sys.getsizeof(value)
+
+    def cache_info(self) -> dict:
+        """
+        :return: dict of the TranslationCacheStats since the translator was loaded, the number of evictions, the number of entries and bytes currently cached,
+                 and the learned batch size limits
+        """
+        with self.lock:
+            return {**dataclasses.asdict(self.stats), "evictions": self.evictions, "entries": len(self.cache), "bytes": self.size, "max_bytes": self.max_bytes, "batch_limits": dict(self.batch_limits)}
+
+    def _translate_and_decode(self, translation_requests: list[str], max_new_tokens: int = MAX_NEW_TOKENS) -> list[str]:
         decoded_results = []
-        for result in flatten(translation_result):
+        for request, token_ids in zip(translation_requests, self.translator.generate(translation_requests, max_new_tokens)):
+            # a translation that never emitted </s> was cut off by the generation limit
+            if self.translator.tokenizer.eos_token_id not in token_ids:
+                self.runaways.add(request)
             # explicitly filter out the special tokens we want to skip: <pad>, <s>, </s>, <unk>, <mask>
-            filtered_tokens = [tok for tok in result["translation_token_ids"].tolist() if tok not in [0, 1, 2, 3, 4]]
+            filtered_tokens = [tok for tok in token_ids if tok not in [0, 1, 2, 3, 4]]
             # decode the remaining tokens
             decoded_results.append(self.translator.tokenizer.decode(filtered_tokens, skip_special_tokens=False))
 
         return decoded_results
 
-    def _translate_with_backoff(self, translation_requests: TrackedDataset) -> list[str]:
-        try:
-            return self._translate_and_decode(translation_requests, batch_size=32)
-        except Exception as e:
-            logger.info(f"Lowering translation batch size ({e})")
-        # Try with batch_size = 1 if normal translation fails:
+    def _make_batches(self, translation_requests: list[str], lengths: list[int], max_batch_size: int) -> list[list[int]]:
+        """
+        Group requests of similar token length so that short statements are not padded to the length of a long one
+
+        :return: Batches of indices into translation_requests, each within the token budget and the learned batch limits unless it holds a single request
+        """
+        batches = []
+        batch = []
+        for i in sorted(range(len(translation_requests)), key=lengths.__getitem__):
+            # requests are sorted by length, so the newest request sets the padded length of the batch
+            if batch and (len(batch) >= min(max_batch_size, self._batch_limit(lengths[i])) or (len(batch) + 1) * lengths[i] > self.token_budget):
+                batches.append(batch)
+                batch = []
+            batch.append(i)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _batch_limit(self, length: int) -> int:
+        # a batch that failed at some padded length would also fail with longer requests
+        return min((limit for failed_length, limit in self.batch_limits.items() if failed_length <= length), default=TRANSLATION_BATCH_SIZE)
+
+    def _max_new_tokens(self, length: int) -> int:
+        if self.generation_ratio is None:
+            return self.max_new_tokens
+        return min(self.max_new_tokens, math.ceil(self.generation_ratio * length) + self.generation_offset)
+
+    def _translate_batch(self, requests: list[str], lengths: list[int]) -> list[str]:
+        """
+        Translate one batch, bisecting it on failure so that only the failing requests are retried in smaller batches
+
+        :param requests: Requests sorted by token length
+        :param lengths: Token length of each request
+        """
+
+        def translate(batch: list[int]) -> list[str]:
+            return self._translate_and_decode([requests[i] for i in batch], max_new_tokens=self._max_new_tokens(lengths[batch[-1]]))
+
+        def fail(i: int, error: Exception) -> str:
+            logger.info(f"Could not translate a statement of {lengths[i]} tokens ({error})")
+            return TRANSLATION_ERROR
+
+        return self._run_bisecting(list(range(len(requests))), lengths, translate, fail)[0]
+
+    def _run_bisecting(self, batch: list[int], lengths: list[int], run: Callable[[list[int]], list], fail: Callable[[int, Exception], object]) -> tuple[list, bool]:
+        """
+        :param batch: Indices of the requests, sorted by token length
+        :param lengths: Token length of every request
+        :param run: Runs the model on the requests at the given indices
+        :param fail: Returns the result of a request that fails on its own, or raises
+        :return: The results, and whether every request succeeded
+        """
         try:
-            return self._translate_and_decode(translation_requests, batch_size=1)
+            results = run(batch)
         except Exception as e:
-            logger.info(f"Lowering translation batch size ({e})")
-        translation_results = []
-        # try one-by-one if batch_size=1 fails
-        for request in translation_requests:
-            try:
-                translation_results.append(self._translate_and_decode([request], batch_size=1)[0])
-            except Exception:
-                # last resort fallback
-                translation_results.append("'''Decompiler error: line too long for translation. Please decompile this statement manually.'''")
-        return translation_results
-
-    def __call__(self, args: list, **_):
+            if len(batch) == 1:
+                return [fail(batch[0], e)], False
+            out_of_memory = is_out_of_memory(e)
+            logger.info(f"Splitting a translation batch of {len(batch)} statements up to {lengths[batch[-1]]} tokens ({e})")
+        else:
+            self._count_fitting_batch(lengths[batch[-1]], len(batch))
+            return results, True
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        middle = len(batch) // 2
+        first, first_succeeded = self._run_bisecting(batch[:middle], lengths, run, fail)
+        second, second_succeeded = self._run_bisecting(batch[middle:], lengths, run, fail)
+        # only a batch that ran out of memory while its halves fit says something about the batch size, a request that fails on its own does not
+        length = lengths[batch[-1]]
+        if out_of_memory and first_succeeded and second_succeeded:
+            self.batch_limits[length] = min(self.batch_limits.get(length, len(batch)), len(batch) - middle)
+            self.limit_successes.pop(length, None)
+        return first + second, first_succeeded and second_succeeded
+
+    def _count_fitting_batch(self, length: int, size: int):
+        # memory may have been held by something else when a batch failed, so a limit is raised again once batches at the limit keep fitting
+        for failed_length, limit in list(self.batch_limits.items()):
+            if failed_length > length or size < limit:
+                continue
+            self.limit_successes[failed_length] = self.limit_successes.get(failed_length, 0) + 1
+            if self.limit_successes[failed_length] < BATCH_LIMIT_RECOVERY:
+                continue
+            del self.limit_successes[failed_length]
+            if limit * 2 >= TRANSLATION_BATCH_SIZE:
+                del self.batch_limits[failed_length]
+            else:
+                self.batch_limits[failed_length] = limit * 2
+
+    def _translate_with_backoff(self, translation_requests: TrackedDataset | list[str], max_batch_size: int = TRANSLATION_BATCH_SIZE) -> list[str]:
+        requests = list(translation_requests.x) if isinstance(translation_requests, TrackedList) else list(translation_requests)
+        if not requests:
+            return []
+        lengths = self._token_lengths(requests)
+        results = [None] * len(requests)
+        for batch in self._make_batches(requests, lengths, max_batch_size):
+            for i, result in zip(batch, self._translate_batch([requests[i] for i in batch], [lengths[i] for i in batch])):
+                results[i] = result
+            if isinstance(translation_requests, TrackedList):
+                translation_requests.progress(len(batch))
+        return results
+
+    def _token_lengths(self, requests: list[str]) -> list[int]:
+        return [len(input_ids) for input_ids in self.translator.tokenizer(requests)["input_ids"]]
+
+    def generate_batched(self, requests: list[str], max_new_tokens: list[int]) -> list[list[int]]:
+        """
+        Generate the token ids of requests gathered from several callers, in batches within the token budget and the learned batch limits.
+        A request that fails on its own raises, so that its caller can handle it.
+
+        :param max_new_tokens: Generation limit of each request
+        :return: The generated token ids of each request, cut to its own limit
+        """
+        if not requests:
+            return []
+        with self.lock:
+            lengths = self._token_lengths(requests)
+
+            def generate(batch: list[int]) -> list[list[int]]:
+                return self.translator.generate([requests[i] for i in batch], max(max_new_tokens[i] for i in batch))
+
+            def fail(_: int, error: Exception):
+                raise error
+
+            results = [None] * len(requests)
+            for batch in self._make_batches(requests, lengths, TRANSLATION_BATCH_SIZE):
+                for i, token_ids in zip(batch, self._run_bisecting(batch, lengths, generate, fail)[0]):
+                    # greedy decoding does not depend on the limit, so cutting the shared limit down to each request's own gives the same tokens;
+                    # the first token is the decoder start token
+                    results[i] = token_ids[: max_new_tokens[i] + 1]
+            return results
+
+    def __call__(self, args: list, stats: TranslationCacheStats | list[TranslationCacheStats] | None = None, **_):
+        """
+        :param args: Statements to translate
+        :param stats: TranslationCacheStats to count the requests in besides self.stats; either one for all args or one per arg
+        """
+        with self.lock:
+            return self._translate_cached(args, stats)
+
+    def _translate_cached(self, args: list, stats: TranslationCacheStats | list[TranslationCacheStats] | None = None) -> list[str]:
         normalized_args = [normalize_masks(fix_jump_targets(x)) for x in args]
 
-        # New are those not in the local cache
-        new = TrackedDataset(TRANSLATION_STEP, list({norm for norm, _ in normalized_args if norm not in self.cache}))
+        missing = list({norm for norm, _ in normalized_args if norm not in self.cache})
+        stored = self.store.get_many(self.namespace, missing) if self.store is not None and missing else {}
+        for norm, translation in stored.items():
+            self[norm] = translation
+
+        # New are those not in the local cache or the store
+        new = TrackedDataset(TRANSLATION_STEP, [norm for norm in missing if norm not in self.cache])
 
         # Now, "new" has been updated to those not in local
         for arg, result in zip(new.x, self._translate_with_backoff(new)):
-            self.cache[arg] = result
+            self[arg] = result
+        if self.store is not None and new.x:
+            # failed and cut off translations may succeed with a later model or limit, so they are not persisted
+            self.store.put_many(self.namespace, {arg: self.cache[arg] for arg in new.x if self.cache[arg] != TRANSLATION_ERROR and arg not in self.runaways})
 
+        self._count(normalized_args, new.x, stored, stats)
         results = [restore_masks(self[norm], order) for norm, order in normalized_args]
-        while len(self.cache) > self.maxsize:
-            self.cache.popitem(last=False)
+        # always keep the translations of this call
+        while self.size > self.max_bytes and len(self.cache) > len(normalized_args):
+            norm, translation = self.cache.popitem(last=False)
+            self.size -= sys.getsizeof(norm) + sys.getsizeof(translation)
+            self.runaways.discard(norm)
+            self.evictions += 1
         return results
 
+    def _count(self, normalized_args: list[tuple[str, list]], translated: list[str], stored: dict[str, str], stats: TranslationCacheStats | list[TranslationCacheStats] | None):
+        if not isinstance(stats, list):
+            stats = [stats] * len(normalized_args)
+        # only the first request for a translated or stored statement counts as a miss or store hit
+        unseen, from_store = set(translated), set(stored)
+        for (norm, _), arg_stats in zip(normalized_args, stats):
+            for counter in (self.stats, arg_stats) if arg_stats is not None else (self.stats,):
+                if norm in unseen:
+                    counter.misses += 1
+                elif norm in from_store:
+                    counter.store_hits += 1
+                    counter.bytes_saved += len(norm.encode())
+                else:
+                    counter.hits += 1
+                    counter.bytes_saved += len(norm.encode())
+                if norm in self.runaways:
+                    counter.runaways += 1
+            unseen.discard(norm)
+            from_store.discard(norm)
 
-def load_models(config_file: Path = Path("pylingual/decompiler_config.yaml"), version: PythonVersion = PythonVersion(3.9), token=False) -> tuple[transformers.Pipeline, CacheTranslator]:
-    logger.info(f"Loading models for {version}...")
+
+def load_model_config(config_file: Path, version: PythonVersion) -> dict:
+    """
+    Read the model configuration of a python version from decompiler_config.yaml
+
+    :return: dict with SEGMENTATION_MODEL and STATEMENT_MODEL entries
+    """
     with config_file.open() as f:
         config = yaml.safe_load(f)
-        seg_config = config[f"v{version}"]["SEGMENTATION_MODEL"]
-        stmt_config = config[f"v{version}"]["STATEMENT_MODEL"]
-
-    #################################
-    # Segmentation model components #
-    #################################
-    segmentation_model = transformers.AutoModelForTokenClassification.from_pretrained(
-        pretrained_model_name_or_path=seg_config["REPO"],
-        revision=seg_config["REVISION"],
-        token=token,
-    )
+    return config[f"v{version}"]
+
+
+def configured_versions(config_file: Path) -> list[PythonVersion]:
+    """
+    :return: The python versions that config_file has models for
+    """
+    with config_file.open() as f:
+        config = yaml.safe_load(f)
+    return [PythonVersion(key.removeprefix("v")) for key in config]
+
+
+def translation_namespace(stmt_config: dict, quantize: str | None = None, backend: str = "torch") -> str:
+    """
+    Namespace of a statement model's translations in a TranslationStore, so that translations of other model revisions are never reused
+
+    :param stmt_config: STATEMENT_MODEL entry of the model config
+    :param quantize: Quantization applied to the statement model
+    :param backend: Inference backend running the statement model
+    """
+    namespace = f"{stmt_config['REPO']}@{stmt_config['REVISION']}/{stmt_config['TOKENIZER']}"
+    if backend != "torch":
+        namespace += f"/{backend}"
+    return f"{namespace}/{quantize}" if quantize is not None else namespace
+
+
+def resolve_quantize(version_config: dict, quantize: str | None = None) -> str | None:
+    """
+    Choose the quantization for a version's models; an explicit quantize overrides QUANTIZE in the model config
+
+    :param quantize: "int8", "none", or None to use the config
+    :return: "int8" or None for unquantized models
+    """
+    if quantize is None:
+        quantize = version_config.get("QUANTIZE")
+    if quantize in (None, "none"):
+        return None
+    if quantize not in QUANTIZATION_DTYPES:
+        raise ValueError(f"Unsupported quantization {quantize}, expected one of {', '.join(['none', *QUANTIZATION_DTYPES])}")
+    return quantize
+
+
+def device_quantize(quantize: str | None, backend: str = "torch") -> str | None:
+    """
+    :return: The quantization that applies where the models run; dynamic quantization only runs on the torch backend on CPU
+    """
+    if quantize is None or backend != "torch" or torch.cuda.is_available():
+        return None
+    return quantize
+
+
+def model_cache_dir() -> Path:
+    return Path(os.environ.get("PYLINGUAL_CACHE_DIR", Path.home() / ".cache" / "pylingual"))
+
+
+def load_quantized(load: Callable[[], torch.nn.Module], model_config: dict, quantize: str | None) -> torch.nn.Module:
+    """
+    Apply dynamic quantization to the linear layers of a model, caching the quantized model on disk
+
+    :param load: Loads the unquantized model
+    :param model_config: SEGMENTATION_MODEL or STATEMENT_MODEL entry of the model config
+    :param quantize: Quantization to apply, None returns the unquantized model
+    """
+    if quantize is None:
+        return load()
+    # pickled modules are only loadable by the library versions that saved them
+    key = hashlib.sha256(json.dumps([model_config["REPO"], model_config["REVISION"], quantize, torch.__version__, transformers.__version__]).encode()).hexdigest()[:16]
+    path = model_cache_dir() / "quantized" / f"{model_config['REPO'].replace('/', '--')}-{quantize}-{key}.pt"
+    if path.exists():
+        try:
+            return torch.load(path, weights_only=False)
+        except Exception as e:
+            logger.warning(f"Could not load quantized model from {path}, quantizing again ({e})")
+
+    logger.info(f"Quantizing {model_config['REPO']} to {quantize}...")
+    model = torch.ao.quantization.quantize_dynamic(load(), {torch.nn.Linear}, dtype=getattr(torch, QUANTIZATION_DTYPES[quantize]))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    torch.save(model, tmp_path)
+    os.replace(tmp_path, path)
+    return model
+
+
+def load_segmentation_tokenizer(seg_config: dict, token=False) -> transformers.PreTrainedTokenizerFast:
     segmentation_tokenizer_file = huggingface_hub.hf_hub_download(repo_id=seg_config["TOKENIZER"], filename="tokenizer.json", token=token)
-    segmentation_tokenizer = transformers.PreTrainedTokenizerFast(
+    return transformers.PreTrainedTokenizerFast(
         tokenizer_file=segmentation_tokenizer_file,
         unk_token="[UNK]",
         pad_token="[PAD]",
@@ -115,17 +451,347 @@ def load_models(config_file: Path = Path("pylingual/decompiler_config.yaml"), ve
         sep_token="[SEP]",
         mask_token="[MASK]",
     )
+
+
+def torch_device(quantize: str | None = None) -> tuple[torch.device, str | None]:
+    """
+    :return: device to run the torch models on and the quantization that applies on it
+    """
     if torch.cuda.is_available():
-        device = torch.device("cuda:0")
+        if quantize is not None:
+            logger.warning(f"{quantize} quantization only applies to CPU inference, using unquantized models on GPU")
+        return torch.device("cuda:0"), None
+    logger.warning("Using CPU for models")
+    return torch.device("cpu"), quantize
+
+
+def load_torch_segmenter(seg_config: dict, device: torch.device, token=False, quantize: str | None = None, snapshot_dir: Path | None = None) -> TorchSegmentationBackend:
+    """
+    :param snapshot_dir: Directory the model was pulled to with pull_models, None to load it from the hub
+    """
+    if snapshot_dir is not None:
+        load = functools.partial(transformers.AutoModelForTokenClassification.from_pretrained, snapshot_dir, local_files_only=True)
+        segmentation_tokenizer = transformers.PreTrainedTokenizerFast.from_pretrained(snapshot_dir, local_files_only=True)
     else:
-        logger.warning("Using CPU for models")
-        device = torch.device("cpu")
+        load = functools.partial(transformers.AutoModelForTokenClassification.from_pretrained, seg_config["REPO"], revision=seg_config["REVISION"], token=token)
+        segmentation_tokenizer = load_segmentation_tokenizer(seg_config, token)
+    segmentation_model = load_quantized(load, seg_config, quantize)
     segmenter = transformers.pipeline("token-classification", model=segmentation_model, tokenizer=segmentation_tokenizer, aggregation_strategy="none", device=device)
-    #########################################
-    # Sequence translation model components #
-    #########################################
-    translation_model = transformers.T5ForConditionalGeneration.from_pretrained(stmt_config["REPO"], revision=stmt_config["REVISION"], token=token)
-    translation_tokenizer = transformers.RobertaTokenizer.from_pretrained(stmt_config["TOKENIZER"], token=token)
-    translator = transformers.TranslationPipeline(model=translation_model, tokenizer=translation_tokenizer, max_length=512, truncation=False, device=device)
-
-    return segmenter, CacheTranslator(translator)
+    return TorchSegmentationBackend(segmenter)
+
+
+def load_torch_translator(stmt_config: dict, device: torch.device, token=False, quantize: str | None = None, snapshot_dir: Path | None = None) -> TorchTranslationBackend:
+    """
+    :param snapshot_dir: Directory the model was pulled to with pull_models, None to load it from the hub
+    """
+    if snapshot_dir is not None:
+        load = functools.partial(transformers.T5ForConditionalGeneration.from_pretrained, snapshot_dir, local_files_only=True)
+        translation_tokenizer = transformers.RobertaTokenizer.from_pretrained(snapshot_dir, local_files_only=True)
+    else:
+        load = functools.partial(transformers.T5ForConditionalGeneration.from_pretrained, stmt_config["REPO"], revision=stmt_config["REVISION"], token=token)
+        translation_tokenizer = transformers.RobertaTokenizer.from_pretrained(stmt_config["TOKENIZER"], token=token)
+    translation_model = load_quantized(load, stmt_config, quantize)
+    translator = transformers.TranslationPipeline(model=translation_model, tokenizer=translation_tokenizer, truncation=False, device=device)
+    return TorchTranslationBackend(translator)
+
+
+def version_model_dirs(root: Path, version: PythonVersion) -> tuple[Path, Path]:
+    """
+    :param root: Directory models were pulled or exported to
+    :return: directories of the segmentation and statement models of version in root
+    """
+    return root / f"v{version}" / "segmentation", root / f"v{version}" / "statement"
+
+
+def is_exported_from(model_config: dict, model_dir: Path) -> bool:
+    """
+    :param model_config: SEGMENTATION_MODEL or STATEMENT_MODEL entry of the model config
+    :return: whether model_dir holds a complete export of the configured model
+    """
+    try:
+        exported = read_export_info(model_dir)
+    except FileNotFoundError:
+        return False
+    return all(exported.get(key) == model_config[key] for key in ("REPO", "REVISION", "TOKENIZER"))
+
+
+def check_export(model_config: dict, model_dir: Path):
+    """
+    Check that model_dir was pulled or exported from the configured model
+
+    :param model_config: SEGMENTATION_MODEL or STATEMENT_MODEL entry of the model config
+    """
+    if not is_exported_from(model_config, model_dir):
+        exported = read_export_info(model_dir)
+        raise ValueError(f"Model in {model_dir} was exported from {exported['REPO']}@{exported['REVISION']}, export it again for {model_config['REPO']}@{model_config['REVISION']}")
+
+
+def pull_models(config_file: Path, version: PythonVersion, out_dir: Path, token=False):
+    """
+    Download the configured checkpoints of a version into a snapshot directory as safetensors, so that they load without the hub.
+    Models that are already in the snapshot are skipped.
+
+    :param out_dir: Snapshot directory; the models are written to out_dir/v<version>/segmentation and out_dir/v<version>/statement
+    """
+    version_config = load_model_config(config_file, version)
+    seg_config = version_config["SEGMENTATION_MODEL"]
+    stmt_config = version_config["STATEMENT_MODEL"]
+    seg_dir, stmt_dir = version_model_dirs(out_dir, version)
+
+    if is_exported_from(seg_config, seg_dir):
+        logger.info(f"{seg_config['REPO']} is up to date in {seg_dir}")
+    else:
+        logger.info(f"Pulling {seg_config['REPO']} to {seg_dir}...")
+        model = transformers.AutoModelForTokenClassification.from_pretrained(seg_config["REPO"], revision=seg_config["REVISION"], token=token)
+        model.save_pretrained(seg_dir, safe_serialization=True)
+        load_segmentation_tokenizer(seg_config, token).save_pretrained(seg_dir)
+        write_export_info(seg_dir, seg_config)
+
+    if is_exported_from(stmt_config, stmt_dir):
+        logger.info(f"{stmt_config['REPO']} is up to date in {stmt_dir}")
+    else:
+        logger.info(f"Pulling {stmt_config['REPO']} to {stmt_dir}...")
+        model = transformers.T5ForConditionalGeneration.from_pretrained(stmt_config["REPO"], revision=stmt_config["REVISION"], token=token)
+        model.save_pretrained(stmt_dir, safe_serialization=True)
+        transformers.RobertaTokenizer.from_pretrained(stmt_config["TOKENIZER"], token=token).save_pretrained(stmt_dir)
+        write_export_info(stmt_dir, stmt_config)
+
+
+def export_onnx(config_file: Path, version: PythonVersion, out_dir: Path, token=False):
+    """
+    Convert the configured checkpoints of a version into ONNX graphs for the onnx backend, requires optimum
+
+    :param out_dir: Export directory; the graphs are written to out_dir/v<version>/segmentation and out_dir/v<version>/statement
+    """
+    from optimum.exporters.onnx import main_export
+
+    version_config = load_model_config(config_file, version)
+    seg_config = version_config["SEGMENTATION_MODEL"]
+    stmt_config = version_config["STATEMENT_MODEL"]
+    seg_dir, stmt_dir = version_model_dirs(out_dir, version)
+
+    logger.info(f"Exporting {seg_config['REPO']} to {seg_dir}...")
+    main_export(seg_config["REPO"], output=seg_dir, task="token-classification", revision=seg_config["REVISION"], token=token)
+    load_segmentation_tokenizer(seg_config, token).save_pretrained(seg_dir)
+    write_export_info(seg_dir, seg_config)
+
+    logger.info(f"Exporting {stmt_config['REPO']} to {stmt_dir}...")
+    # keep the decoder with and without past key values as separate graphs instead of merging them
+    main_export(stmt_config["REPO"], output=stmt_dir, task="text2text-generation-with-past", revision=stmt_config["REVISION"], token=token, no_post_process=True)
+    transformers.RobertaTokenizer.from_pretrained(stmt_config["TOKENIZER"], token=token).save_pretrained(stmt_dir)
+    write_export_info(stmt_dir, stmt_config)
+
+
+def model_settings(config_file: Path, version: PythonVersion, quantize: str | None = None, backend: str = "torch") -> dict:
+    """
+    Everything that determines the outputs of a version's models
+
+    :return: dict of the version's model config, the quantization that applies on this device and the backend
+    """
+    version_config = load_model_config(config_file, version)
+    return {"models": version_config, "quantize": device_quantize(resolve_quantize(version_config, quantize), backend), "backend": backend}
+
+
+def load_models(
+    config_file: Path = Path("pylingual/decompiler_config.yaml"),
+    version: PythonVersion = PythonVersion(3.9),
+    token=False,
+    translation_store: TranslationStore | None = None,
+    translation_cache_bytes: int = TRANSLATION_CACHE_BYTES,
+    quantize: str | None = None,
+    backend: str = "torch",
+    onnx_dir: Path | None = None,
+    threads: int | None = None,
+    model_dir: Path | None = None,
+) -> tuple[SegmentationBackend, CacheTranslator]:
+    """
+    Set up the segmentation and statement models of a python version. Each model is loaded the first time it is used.
+
+    :param quantize: Quantization of the torch models, "int8" or "none". None uses the QUANTIZE setting of the config.
+    :param backend: "torch" to run the HuggingFace checkpoints, or "onnx" to run graphs exported by export_onnx on ONNX Runtime
+    :param onnx_dir: Export directory of the onnx backend
+    :param threads: Number of intra-op threads of the onnx backend
+    :param model_dir: Snapshot directory the torch models were pulled to with pull_models, None to load them from the hub
+    """
+    version_config = load_model_config(config_file, version)
+    seg_config = version_config["SEGMENTATION_MODEL"]
+    stmt_config = version_config["STATEMENT_MODEL"]
+    quantize = resolve_quantize(version_config, quantize)
+
+    # each model is only loaded once a stage needs it, so lnotab, cached and equivalence-only runs skip the segmentation model
+    if backend == "torch":
+        device, quantize = torch_device(quantize)
+        seg_dir, stmt_dir = version_model_dirs(model_dir, version) if model_dir is not None else (None, None)
+        if model_dir is not None:
+            check_export(seg_config, seg_dir)
+            check_export(stmt_config, stmt_dir)
+        load_segmenter = functools.partial(load_torch_segmenter, seg_config, device, token, quantize, seg_dir)
+        load_translator = functools.partial(load_torch_translator, stmt_config, device, token, quantize, stmt_dir)
+    elif backend == "onnx":
+        if onnx_dir is None:
+            raise ValueError("The onnx backend needs the directory the models were exported to")
+        if quantize is not None:
+            logger.warning(f"{quantize} quantization only applies to the torch backend, using unquantized ONNX models")
+            quantize = None
+        seg_dir, stmt_dir = version_model_dirs(onnx_dir, version)
+        # fail before decompiling anything rather than at the first stage that needs a model
+        check_export(seg_config, seg_dir)
+        check_export(stmt_config, stmt_dir)
+        load_segmenter = functools.partial(OnnxSegmentationBackend, seg_dir, threads)
+        load_translator = functools.partial(OnnxTranslationBackend, stmt_dir, threads)
+    else:
+        raise ValueError(f"Unknown inference backend {backend}, expected torch or onnx")
+    segmenter = LazySegmentationBackend(load_segmenter, f"segmentation model for {version}")
+    translation_backend = LazyTranslationBackend(load_translator, f"statement model for {version}")
+
+    generation_config = stmt_config.get("MAX_NEW_TOKENS", {})
+    return segmenter, CacheTranslator(
+        translation_backend,
+        max_bytes=translation_cache_bytes,
+        store=translation_store,
+        namespace=translation_namespace(stmt_config, quantize, backend),
+        generation_ratio=generation_config.get("RATIO"),
+        generation_offset=generation_config.get("OFFSET", 0),
+        max_new_tokens=generation_config.get("CAP", MAX_NEW_TOKENS),
+    )
+
+
+def estimate_model_memory(segmenter: SegmentationBackend, translator: CacheTranslator) -> int:
+    """
+    Approximate the memory held by a (segmenter, translator) pair from the sizes of the weights loaded so far
+
+    :param segmenter: The loaded segmentation backend
+    :param translator: The loaded CacheTranslator
+    :return: Size of the model weights in bytes
+    """
+    return segmenter.memory_bytes() + translator.translator.memory_bytes()
+
+
+class ModelCache:
+    """
+    LRU cache of loaded (segmenter, translator) pairs, keyed by config file and python version.
+    Keeps the models and the translation cache of each version warm across many decompilations.
+
+    :param max_memory: Approximate cap in bytes on the model weights held by the cache, or None for no cap.
+                       The most recently requested pair is always kept, even if it alone exceeds the cap.
+                       Models load on first use, so the cap is checked again each time a model finishes loading.
+    :param token: HuggingFace token passed to load_models
+    :param translation_store: Persistent TranslationStore shared by the translators of every version
+    :param translation_cache_bytes: Approximate cap in bytes on the in-memory translation cache of each translator
+    :param quantize: Quantization passed to load_models, None to use the config
+    :param backend: Inference backend passed to load_models
+    :param onnx_dir: Export directory of the onnx backend
+    :param threads: Number of intra-op threads of the onnx backend
+    :param model_dir: Snapshot directory the torch models were pulled to, None to load them from the hub
+    """
+
+    def __init__(
+        self,
+        max_memory: int | None = None,
+        token=False,
+        translation_store: TranslationStore | None = None,
+        translation_cache_bytes: int = TRANSLATION_CACHE_BYTES,
+        quantize: str | None = None,
+        backend: str = "torch",
+        onnx_dir: Path | None = None,
+        threads: int | None = None,
+        model_dir: Path | None = None,
+    ):
+        self.max_memory = max_memory
+        self.token = token
+        self.translation_store = translation_store
+        self.translation_cache_bytes = translation_cache_bytes
+        self.quantize = quantize
+        self.backend = backend
+        self.onnx_dir = onnx_dir
+        self.threads = threads
+        self.model_dir = model_dir
+        self.models: OrderedDict[tuple[Path, tuple[int, int]], tuple[SegmentationBackend, CacheTranslator]] = OrderedDict()
+        # models can finish loading on any thread that uses them
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.models)
+
+    def get(self, config_file: Path, version: PythonVersion) -> tuple[SegmentationBackend, CacheTranslator]:
+        key = (config_file.resolve(), version.as_tuple())
+        with self.lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                return self.models[key]
+
+            # make room for the new pair before loading it, assuming it is about as large as the ones already loaded
+            loaded = [size for size in self.sizes().values() if size]
+            if loaded:
+                self._evict(reserve=sum(loaded) // len(loaded))
+            self.models[key] = load_models(
+                config_file,
+                version,
+                token=self.token,
+                translation_store=self.translation_store,
+                translation_cache_bytes=self.translation_cache_bytes,
+                quantize=self.quantize,
+                backend=self.backend,
+                onnx_dir=self.onnx_dir,
+                threads=self.threads,
+                model_dir=self.model_dir,
+            )
+            # the models load lazily and hold no weights yet, so the new pair is measured once each of its models has loaded
+            for model in (self.models[key][0], self.models[key][1].translator):
+                if isinstance(model, (LazySegmentationBackend, LazyTranslationBackend)):
+                    model.on_load = functools.partial(self._evict, keep=key)
+            self._evict()
+            return self.models[key]
+
+    def preload(self, config_file: Path, version: PythonVersion) -> tuple[SegmentationBackend, CacheTranslator]:
+        """
+        Get the models of a version and load all of them now instead of on first use
+        """
+        segmenter, translator = self.get(config_file, version)
+        for model in (segmenter, translator.translator):
+            if isinstance(model, (LazySegmentationBackend, LazyTranslationBackend)):
+                model.backend
+        return segmenter, translator
+
+    def sizes(self) -> dict[tuple[Path, tuple[int, int]], int]:
+        """
+        :return: Memory held by the models of each cached version that have been loaded so far
+        """
+        return {key: estimate_model_memory(*models) for key, models in self.models.items()}
+
+    def clear(self):
+        with self.lock:
+            self.models.clear()
+        self._release()
+
+    def _evict(self, reserve: int = 0, keep: tuple[Path, tuple[int, int]] | None = None):
+        """
+        Unload the least recently used pairs until the loaded weights fit in the memory cap
+
+        :param reserve: Bytes to make room for on top of the loaded weights. if 0, the most recently requested pair is always kept.
+        :param keep: Pair that is kept regardless of its age, the one whose model just finished loading
+        """
+        if self.max_memory is None:
+            return
+        with self.lock:
+            sizes = self.sizes()
+            # when reserving space for a new pair every loaded pair may go, otherwise always keep the most recent one
+            kept = {keep} if keep in self.models else set()
+            if not reserve and self.models:
+                kept.add(next(reversed(self.models)))
+            evicted = False
+            for key in [key for key in self.models if key not in kept]:
+                if sum(sizes.values()) + reserve <= self.max_memory:
+                    break
+                del self.models[key]
+                del sizes[key]
+                logger.info(f"Unloading models for {PythonVersion(key[1])}...")
+                evicted = True
+        if evicted:
+            self._release()
+
+    @staticmethod
+    def _release():
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
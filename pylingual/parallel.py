@@ -0,0 +1,362 @@
+from __future__ import annotations
+
+import concurrent.futures
+import functools
+import logging
+import multiprocessing
+import os
+import types
+from pathlib import Path
+from typing import TYPE_CHECKING, Collection, Iterator
+
+from pylingual.broker import BROKER_BATCH_SIZE, BROKER_MAX_WAIT, BrokerClient, BrokerModelCache, InferenceBroker
+from pylingual.codeobj_cache import CodeObjectCache
+from pylingual.control_flow_reconstruction.cflow import bytecode_to_indented_source
+from pylingual.editable_bytecode import PYCFile
+from pylingual.equivalence_check import ReferencePyc, TestResult
+from pylingual.masking.model_disasm import create_global_masker
+from pylingual.models import TRANSLATION_CACHE_BYTES
+from pylingual.utils.generate_bytecode import code_to_pyc
+from pylingual.utils.lazy import lazy_import
+from pylingual.utils.tracked_list import CFLOW_STEP, TrackedList
+from pylingual.utils.version import PythonVersion
+
+if TYPE_CHECKING:
+    import torch
+    from pylingual.decompiler import DecompilerResult
+    from pylingual.editable_bytecode import EditableBytecode
+    from pylingual.models import ModelCache
+    from pylingual.utils.disk_cache import DiskCache
+else:
+    lazy_import("torch")
+
+logger = logging.getLogger(__name__)
+
+
+class CodeObjectPool:
+    """
+    Runs control flow reconstruction and equivalence checking of large modules on worker processes, split into chunks of code objects.
+
+    EditableBytecode and Inst objects reference their parents, so they are not sent to the workers.
+    Instead, each worker loads the pyc itself and receives only the line starts chosen by segmentation;
+    results come back as source lines and instruction indices.
+
+    :param max_workers: Number of worker processes, defaults to the number of CPUs
+    :param min_code_objects: Modules with fewer code objects are processed in the calling process
+    """
+
+    def __init__(self, max_workers: int | None = None, min_code_objects: int = 16):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.min_code_objects = min_code_objects
+        # spawn instead of fork since the parent holds model threads
+        self.executor = concurrent.futures.ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.shutdown()
+
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)
+
+    def should_split(self, n_code_objects: int) -> bool:
+        return n_code_objects >= self.min_code_objects
+
+    def _n_chunks(self, n_code_objects: int) -> int:
+        return max(1, min(n_code_objects, self.max_workers * 4))
+
+    def indented_sources(self, pyc_path: Path, bytecodes: list[EditableBytecode], source_lines: list[str], skip: Collection[int] = ()) -> dict[object, list[str]]:
+        """
+        Parallel version of bytecode_to_indented_source over the code objects of a pyc
+
+        :param pyc_path: Path to the pyc the bytecodes were loaded from
+        :param bytecodes: All bytecodes of the pyc, in iter_bytecodes order
+        :param source_lines: Translated source lines
+        :param skip: Indices of bytecodes whose indented source is already known and that are not structured
+        :return: dict of code object to indented source lines, in the same order as bytecodes
+        """
+        pyc = pyc_path.read_bytes()
+        starts_lines = [[inst.starts_line for inst in bytecode.instructions] for bytecode in bytecodes]
+        indices = [i for i in range(len(bytecodes)) if i not in skip]
+        n_chunks = self._n_chunks(len(indices))
+        chunks = [indices[len(indices) * i // n_chunks : len(indices) * (i + 1) // n_chunks] for i in range(n_chunks)]
+        futures = [self.executor.submit(_indented_source_chunk, pyc, starts_lines, source_lines, chunk) for chunk in chunks]
+
+        sources = {}
+        for chunk, future in zip(chunks, TrackedList(CFLOW_STEP, futures)):
+            for i, (indented_source, ordered_instruction_indices) in zip(chunk, future.result()):
+                bytecode = bytecodes[i]
+                bytecode.ordered_instructions = [bytecode.instructions[j] for j in ordered_instruction_indices]
+                sources[bytecode.codeobj] = indented_source
+        return sources
+
+    def compare_pyc(self, reference: ReferencePyc, pyc_path_b: Path | bytes | types.CodeType, n_code_objects: int, dirty: set[str] | None = None) -> list[TestResult]:
+        """
+        Parallel version of compare_pyc, comparing chunks of matched code object pairs on the workers
+
+        The parent only unmarshals the candidate to reuse the results of code objects that are not dirty,
+        and compares the rest itself when there are few of them. Otherwise the remaining pairs are sent to the workers,
+        which build and patch only the code objects of their own pairs.
+
+        :param reference: The first pyc to compare, which is compared against many candidates
+        :param pyc_path_b: Second pyc to compare, or its contents or module code object
+        :param n_code_objects: Approximate number of code objects, used to decide whether to split the comparison
+        :param dirty: Names of the reference code objects that may differ from the last candidate, None to compare all of them
+        """
+        if not self.should_split(n_code_objects):
+            return reference.compare(pyc_path_b, dirty)
+        pairs = reference.matching_code_objects(pyc_path_b)
+        results, fingerprints = reference.reuse_results(pairs, dirty)
+        pending = [i for i, result in enumerate(results) if result is None]
+        if not self.should_split(len(pending)):
+            for i in pending:
+                results[i] = reference.compare_pair(*pairs[i])
+        else:
+            if isinstance(pyc_path_b, Path):
+                pyc_b = pyc_path_b.read_bytes()
+            elif isinstance(pyc_path_b, types.CodeType):
+                pyc_b = code_to_pyc(pyc_path_b)
+            else:
+                pyc_b = pyc_path_b
+            n_chunks = min(len(pending), self.max_workers)
+            chunks = [pending[len(pending) * i // n_chunks : len(pending) * (i + 1) // n_chunks] for i in range(n_chunks)]
+            futures = [self.executor.submit(_compare_chunk, reference.data, pyc_b, chunk) for chunk in chunks]
+            for chunk, future in zip(chunks, futures):
+                for i, result in zip(chunk, future.result()):
+                    results[i] = result
+        for i in pending:
+            reference.record_result(pairs[i][0], fingerprints[i], results[i])
+        return results
+
+
+class SharedModelPool:
+    """
+    Decompiles whole pycs on forked worker processes that share one copy of the models.
+
+    The parent loads the models of every version before the workers start, and moves the torch weights into shared memory.
+    The workers inherit the loaded models through fork instead of loading their own, so memory stays roughly constant as the number of workers grows.
+    Each worker keeps its own translation cache; a TranslationStore, result cache and code object cache on disk are shared between them.
+    Models are forked after loading, so the pool only supports CPU inference.
+
+    :param model_cache: ModelCache to load the models with
+    :param config_file: Resolved path to decompiler_config.yaml
+    :param versions: Python versions to load the models of before forking; files of other versions fail in the workers
+    :param max_workers: Number of worker processes, defaults to the number of CPUs
+    :param result_cache: DiskCache of earlier decompilation results shared by the workers
+    :param codeobj_cache: CodeObjectCache each worker starts from, a new in-memory cache if None
+    """
+
+    def __init__(
+        self,
+        model_cache: ModelCache,
+        config_file: Path,
+        versions: list[PythonVersion],
+        max_workers: int | None = None,
+        result_cache: DiskCache | None = None,
+        codeobj_cache: CodeObjectCache | None = None,
+    ):
+        if torch.cuda.is_available():
+            raise ValueError("Forked workers cannot share CUDA models, use a single process on GPU hosts")
+        self.max_workers = max_workers or os.cpu_count() or 1
+        for version in versions:
+            for model in model_cache.preload(config_file, version):
+                share_model_memory(model)
+        # workers read the models from this module's globals, which they inherit when they are forked
+        _shared_state.update(model_cache=model_cache, config_file=config_file, result_cache=result_cache, codeobj_cache=codeobj_cache if codeobj_cache is not None else CodeObjectCache())
+        threads = max(1, (os.cpu_count() or 1) // self.max_workers)
+        self.executor = concurrent.futures.ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("fork"), initializer=_init_shared_worker, initargs=(threads,))
+        # fork every worker now, before the parent starts any other threads
+        self.executor.submit(os.getpid).result()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.shutdown()
+
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)
+        _shared_state.clear()
+
+    def decompile_many(self, files: list[Path], out_dir: Path, version: PythonVersion | None = None, top_k: int = 10, trust_lnotab: bool = False, batch_correction: bool = False) -> Iterator[tuple[Path, DecompilerResult | Exception]]:
+        """
+        Decompile pycs on the workers
+
+        :param out_dir: Directory in which a result directory is created for each pyc, see result_dirs
+        :return: iterator of (pyc path, result) pairs in completion order; files that failed to decompile are paired with the raised exception
+        """
+        from pylingual.decompiler import result_dirs
+
+        # pycs with the same name run on different workers at once, so each needs its own result directory
+        futures = {self.executor.submit(_decompile_shared, file, result_dir, version, top_k, trust_lnotab, batch_correction): file for file, result_dir in result_dirs(files, out_dir).items()}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as err:
+                yield futures[future], err
+
+
+class BrokeredPool:
+    """
+    Decompiles whole pycs on spawned worker processes whose model requests all run in one InferenceBroker.
+    The masking, control flow reconstruction and equivalence checks scale across the workers,
+    while the broker coalesces the segmentation and translation requests of all workers into large batches.
+
+    :param config_file: Resolved path to decompiler_config.yaml
+    :param max_workers: Number of worker processes, defaults to the number of CPUs
+    :param max_batch_size: Maximum number of windows or statements the broker coalesces before running them
+    :param max_wait: Seconds a model request may wait for requests of other workers to batch with
+    :param result_cache: (root, max_bytes) of a DiskCache of earlier decompilation results shared by the workers
+    :param codeobj_cache: (root, max_bytes) of a DiskCache of solved code objects shared by the workers, None for a per-worker in-memory cache
+    :param translation_cache: Path to a SqliteTranslationStore shared by the workers
+    :param translation_cache_bytes: Approximate cap in bytes on the in-memory translation cache of each worker and version
+    :param model_cache_options: Keyword arguments of the broker's ModelCache
+    """
+
+    def __init__(
+        self,
+        config_file: Path,
+        max_workers: int | None = None,
+        max_batch_size: int = BROKER_BATCH_SIZE,
+        max_wait: float = BROKER_MAX_WAIT,
+        result_cache: tuple[Path, int | None] | None = None,
+        codeobj_cache: tuple[Path, int | None] | None = None,
+        translation_cache: Path | None = None,
+        translation_cache_bytes: int = TRANSLATION_CACHE_BYTES,
+        **model_cache_options,
+    ):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.broker = InferenceBroker(self.max_workers, max_batch_size, max_wait, **model_cache_options)
+        worker_options = {
+            "config_file": config_file,
+            "result_cache": result_cache,
+            "codeobj_cache": codeobj_cache,
+            "translation_cache": translation_cache,
+            "translation_cache_bytes": translation_cache_bytes,
+            "quantize": model_cache_options.get("quantize"),
+            "backend": model_cache_options.get("backend", "torch"),
+        }
+        self.executor = concurrent.futures.ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_brokered_worker, initargs=(self.broker.address, worker_options))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.shutdown()
+
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)
+        self.broker.shutdown()
+
+    def decompile_many(self, files: list[Path], out_dir: Path, version: PythonVersion | None = None, top_k: int = 10, trust_lnotab: bool = False, batch_correction: bool = False) -> Iterator[tuple[Path, DecompilerResult | Exception]]:
+        """
+        Decompile pycs on the workers
+
+        :param out_dir: Directory in which a result directory is created for each pyc, see result_dirs
+        :return: iterator of (pyc path, result) pairs in completion order; files that failed to decompile are paired with the raised exception
+        """
+        from pylingual.decompiler import result_dirs
+
+        # pycs with the same name run on different workers at once, so each needs its own result directory
+        futures = {self.executor.submit(_decompile_shared, file, result_dir, version, top_k, trust_lnotab, batch_correction): file for file, result_dir in result_dirs(files, out_dir).items()}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as err:
+                yield futures[future], err
+
+
+def share_model_memory(model):
+    """
+    Move the torch weights of a loaded backend into shared memory, so that forked workers never copy them
+    """
+    backend = getattr(model, "translator", model)
+    backend = getattr(backend, "backend", backend)
+    module = getattr(backend, "model", None)
+    if isinstance(module, torch.nn.Module):
+        module.share_memory()
+
+
+_shared_state: dict = {}
+
+
+def _init_shared_worker(threads: int):
+    torch.set_num_threads(threads)
+    # progress bars of the parent do not reach the workers
+    TrackedList.init = lambda self: None
+    TrackedList.progress = lambda self, i: None
+    if "__del__" in TrackedList.__dict__:
+        del TrackedList.__del__
+
+
+def _init_brokered_worker(broker_address: tuple, options: dict):
+    from pylingual.utils.disk_cache import DiskCache
+    from pylingual.utils.translation_store import SqliteTranslationStore
+
+    translation_store = SqliteTranslationStore(options["translation_cache"]) if options["translation_cache"] is not None else None
+    _shared_state.update(
+        model_cache=BrokerModelCache(BrokerClient(broker_address), translation_store, options["translation_cache_bytes"], options["quantize"], options["backend"]),
+        config_file=options["config_file"],
+        result_cache=DiskCache(*options["result_cache"]) if options["result_cache"] is not None else None,
+        codeobj_cache=CodeObjectCache(DiskCache(*options["codeobj_cache"]) if options["codeobj_cache"] is not None else None),
+    )
+
+
+def _decompile_shared(file: Path, out_dir: Path, version: PythonVersion | None, top_k: int, trust_lnotab: bool, batch_correction: bool) -> DecompilerResult:
+    from pylingual.decompiler import decompile
+
+    return decompile(
+        file,
+        out_dir,
+        _shared_state["config_file"],
+        version,
+        top_k,
+        trust_lnotab,
+        model_cache=_shared_state["model_cache"],
+        result_cache=_shared_state["result_cache"],
+        codeobj_cache=_shared_state["codeobj_cache"],
+        batch_correction=batch_correction,
+    )
+
+
+# workers keep the last few pycs loaded, the original pyc is compared against many candidates
+@functools.lru_cache(maxsize=4)
+def _load_masked_bytecodes(pyc: bytes) -> list[EditableBytecode]:
+    pyc_file = PYCFile(pyc)
+    # masking bakes the jumps of every code object; replay it so the bytecode matches the one in the parent process
+    create_global_masker(pyc_file)
+    return list(pyc_file.iter_bytecodes())
+
+
+# the reference pyc is the same for every candidate of a file
+@functools.lru_cache(maxsize=4)
+def _load_reference(pyc: bytes) -> ReferencePyc:
+    return ReferencePyc(pyc)
+
+
+def _indented_source_chunk(pyc: bytes, starts_lines: list[list[int | None]], source_lines: list[str], indices: list[int]) -> list[tuple[list[str], list[int]]]:
+    bytecodes = _load_masked_bytecodes(pyc)
+    for bytecode, bytecode_starts_lines in zip(bytecodes, starts_lines):
+        for inst, starts_line in zip(bytecode.instructions, bytecode_starts_lines):
+            inst.starts_line = starts_line
+
+    results = []
+    for i in indices:
+        bytecode = bytecodes[i]
+        indented_source = bytecode_to_indented_source(bytecode, source_lines)
+        instruction_indices = {inst: j for j, inst in enumerate(bytecode.instructions)}
+        results.append((indented_source, [instruction_indices[inst] for inst in bytecode.ordered_instructions]))
+    return results
+
+
+# keyed by the reference and the candidate, since the pairs hold bytecodes of the reference and code objects of the candidate
+@functools.lru_cache(maxsize=2)
+def _load_candidate_code_objects(pyc_a: bytes, pyc_b: bytes) -> list[tuple[EditableBytecode | None, tuple[str, object] | None]]:
+    return _load_reference(pyc_a).matching_code_objects(pyc_b)
+
+
+def _compare_chunk(pyc_a: bytes, pyc_b: bytes, pair_indices: list[int]) -> list[TestResult]:
+    reference = _load_reference(pyc_a)
+    pairs = _load_candidate_code_objects(pyc_a, pyc_b)
+    return [reference.compare_pair(*pairs[i]) for i in pair_indices]
@@ -2,7 +2,7 @@ from __future__ import annotations
 import heapq
 import itertools
 
-from typing import TYPE_CHECKING, List, Tuple, Dict, Callable, Generator, Iterable
+from typing import TYPE_CHECKING, List, Tuple, Callable, Generator, Iterable
 from pylingual.utils.lazy import lazy_import
 
 if TYPE_CHECKING:
@@ -116,11 +116,10 @@ def m_deep_top_k(scores: List[float], m: int, k: int, priority_function: Priorit
     return error_strings
 
 
-def get_top_k_predictions(strategy: SearchStrategy, predicted_boundary: List[Dict]) -> List[List[str]]:
-    entities = [prediction["entity"] for prediction in predicted_boundary]
+# scores is the confidence in each predicted entity, e.g. the maximum of each row of the B/I/E probability matrix
+def get_top_k_predictions(strategy: SearchStrategy, entities: List[str], scores: np.ndarray) -> List[List[str]]:
     initial_segmentation = entities_to_bitmap(entities)
 
-    scores = [prediction["score"] for prediction in predicted_boundary]
     transformations = strategy(scores)
 
     candidate_segmentations = [np.logical_xor(initial_segmentation, transformation) for transformation in transformations]
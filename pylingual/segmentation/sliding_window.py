@@ -1,4 +1,14 @@
+from __future__ import annotations
+
 import itertools
+from typing import TYPE_CHECKING
+
+from pylingual.utils.lazy import lazy_import
+
+if TYPE_CHECKING:
+    import numpy as np
+else:
+    lazy_import("numpy", "np")
 
 
 # make windows based on the token sizes instrutions will be an instruction along with it's token size
@@ -43,6 +53,54 @@ def sliding_window(instructions: list, max_window_size: int, step_size: int = 1)
         yield (window, index_window)
 
 
+def _word(instructions: list[str], j: int, first: int, last: int, separator: str) -> str:
+    # the tokenizer splits its input at <SEP>, so each instruction keeps the spaces of the separators around it
+    suffix, _, prefix = separator.partition("<SEP>")
+    return (prefix if j != first else "") + instructions[j] + (suffix if j != last else "")
+
+
+def token_id_windows(tokenizer, segmentation_requests: list[str], max_window_size: int, step_size: int, separator: str = " <SEP> ") -> list[tuple[tuple[int, int], list[int], list[int], list[int]]]:
+    """
+    Split code objects into overlapping windows of segmentation model input ids, tokenizing every instruction once.
+    Only the first and last instruction of a window are tokenized again, since they lose a separator space at the window edge.
+
+    :param tokenizer: Fast tokenizer of the segmentation model, which splits its input into one word per instruction at <SEP>
+    :param segmentation_requests: Model views of the instructions of each code object, joined by separator
+    :return: ((code object index, window index), input ids, instruction indices, instruction starts) of every window,
+             where the input ids are the same as tokenizing the window's instructions joined by separator
+             and the instruction starts are the positions of the first token of each instruction in the input ids
+    """
+    codeobj_instructions = [request.split(separator) for request in segmentation_requests]
+    encodings = tokenizer(segmentation_requests, add_special_tokens=False)
+    codeobj_inst_ids = []
+    for i, instructions in enumerate(codeobj_instructions):
+        inst_ids = [[] for _ in instructions]
+        for token_id, word_id in zip(encodings["input_ids"][i], encodings.word_ids(i)):
+            inst_ids[word_id].append(token_id)
+        codeobj_inst_ids.append(inst_ids)
+
+    windows = []
+    edges = []
+    for codeobj_index, (instructions, inst_ids) in enumerate(zip(codeobj_instructions, codeobj_inst_ids)):
+        # lengths include the special tokens of an instruction tokenized on its own, as in training
+        for window_index, (_, indices) in enumerate(sliding_window([(j, len(ids) + 2) for j, ids in enumerate(inst_ids)], max_window_size, step_size)):
+            window_ids = [list(inst_ids[j]) for j in indices]
+            for position in {0, len(indices) - 1} if indices else ():
+                j = indices[position]
+                word = _word(instructions, j, indices[0], indices[-1], separator)
+                if word != _word(instructions, j, 0, len(instructions) - 1, separator):
+                    edges.append((window_ids, position, word))
+            windows.append(((codeobj_index, window_index), window_ids, indices))
+
+    if edges:
+        for (window_ids, position, _), ids in zip(edges, tokenizer([word for _, _, word in edges], add_special_tokens=False)["input_ids"]):
+            window_ids[position] = ids
+    return [
+        (coordinates, [tokenizer.cls_token_id, *itertools.chain.from_iterable(window_ids), tokenizer.sep_token_id], indices, list(itertools.accumulate((len(ids) for ids in window_ids[:-1]), initial=1)) if window_ids else [])
+        for coordinates, window_ids, indices in windows
+    ]
+
+
 # merges the bytecode together based on a point system given the division value for be results use an odd number and given the steps used in the sliding window
 def merge(window_coords: list[tuple], window_segmentation_results: list[list[dict]], inst_index: list, window_size: int, step: int) -> list[list[dict]]:
     # for each codeobject align and score
@@ -73,6 +131,38 @@ def merge(window_coords: list[tuple], window_segmentation_results: list[list[dic
     return entity_list
 
 
+def merge_probabilities(window_coords: list[tuple], window_probabilities: list[np.ndarray], inst_index: list) -> list[tuple[np.ndarray, np.ndarray]]:
+    """
+    Dense version of merge: each window votes for the most likely label of each of its instructions, weighted by that label's probability.
+    The label with the most votes wins, ties go to the earlier label.
+
+    :param window_probabilities: Label probabilities of each instruction of each window, one row per instruction
+    :return: For each code object, the winning label index of each instruction and the label probabilities of each instruction in the first window that has it
+    """
+    codeobj_windows = dict()
+    for (codeobj_index, _), probabilities, window_inst_indices in zip(window_coords, window_probabilities, inst_index):
+        codeobj_windows.setdefault(codeobj_index, []).append((probabilities, window_inst_indices))
+
+    merged = []
+    for codeobj_index in sorted(codeobj_windows):
+        windows = [(probabilities, np.asarray(indices, dtype=np.intp)) for probabilities, indices in codeobj_windows[codeobj_index] if indices]
+        codeobj_length = max((indices[-1] + 1 for _, indices in windows), default=0)
+        n_labels = windows[0][0].shape[1] if windows else 1
+        votes = np.zeros((codeobj_length, n_labels))
+        first_probabilities = np.full((codeobj_length, n_labels), np.nan)
+        for probabilities, indices in windows:
+            labels = probabilities.argmax(axis=1)
+            votes[indices, labels] += probabilities[np.arange(len(indices)), labels]
+            unseen = np.isnan(first_probabilities[indices, 0])
+            first_probabilities[indices[unseen]] = probabilities[unseen]
+
+        # make sure we didn't miss any indices!
+        assert not np.isnan(first_probabilities).any()
+
+        merged.append((votes.argmax(axis=1), first_probabilities))
+    return merged
+
+
 # align windows to make scoring easier
 def align_segmentation_window_results(
     window_coords: list[tuple],
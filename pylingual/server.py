@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import base64
+import http.client
+import http.server
+import json
+import logging
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+from pathlib import Path
+
+from pylingual.codeobj_cache import CodeObjectCache
+from pylingual.decompiler import decompile, resolve_config_file
+from pylingual.models import TRANSLATION_CACHE_BYTES, ModelCache
+from pylingual.utils.disk_cache import DiskCache
+from pylingual.utils.translation_store import TranslationStore
+from pylingual.utils.version import PythonVersion
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8642
+
+
+class DecompilationService:
+    """
+    Keeps the models, their translation caches and solved code objects loaded between decompilation requests
+
+    :param config_file: Path to decompiler_config.yaml to load. None loads the default pylingual config.
+    :param max_model_memory: Approximate cap in bytes on the memory held by loaded models
+    :param top_k: Default max number of pyc segmentations to consider
+    :param trust_lnotab: Default for trusting the lnotab in the input PYC for segmentation
+    :param result_cache: DiskCache of earlier decompilation results, None to decompile every request
+    :param translation_store: Persistent TranslationStore for the translators
+    :param translation_cache_bytes: Approximate cap in bytes on the in-memory translation cache of each version
+    :param quantize: Quantization of the models, "int8" or "none". None uses the QUANTIZE setting of the config.
+    :param backend: Inference backend of the models, "torch" or "onnx"
+    :param onnx_dir: Directory the models were exported to, required by the onnx backend
+    :param model_dir: Snapshot directory the models were pulled to, None to load them from the hub
+    """
+
+    def __init__(
+        self,
+        config_file: Path | None = None,
+        max_model_memory: int | None = None,
+        top_k: int = 10,
+        trust_lnotab: bool = False,
+        result_cache: DiskCache | None = None,
+        translation_store: TranslationStore | None = None,
+        translation_cache_bytes: int = TRANSLATION_CACHE_BYTES,
+        quantize: str | None = None,
+        backend: str = "torch",
+        onnx_dir: Path | None = None,
+        model_dir: Path | None = None,
+    ):
+        self.config_file = resolve_config_file(config_file)
+        self.model_cache = ModelCache(max_model_memory, translation_store=translation_store, translation_cache_bytes=translation_cache_bytes, quantize=quantize, backend=backend, onnx_dir=onnx_dir, model_dir=model_dir)
+        self.top_k = top_k
+        self.trust_lnotab = trust_lnotab
+        self.result_cache = result_cache
+        self.codeobj_cache = CodeObjectCache()
+        # the models are not thread safe, so requests are decompiled one at a time
+        self.lock = threading.Lock()
+
+    def preload(self, version: PythonVersion):
+        with self.lock:
+            self.model_cache.preload(self.config_file, version)
+
+    def status(self) -> dict:
+        return {
+            "status": "ok",
+            "loaded_versions": [str(PythonVersion(version)) for _, version in self.model_cache.models],
+            "translation_cache": {str(PythonVersion(version)): translator.cache_info() for (_, version), (_, translator) in list(self.model_cache.models.items())},
+        }
+
+    def handle(self, request: dict) -> dict:
+        """
+        Decompile the pyc described by a request
+
+        :param request: dict with either "path" to a pyc or base64 encoded "pyc" bytes with an optional "name",
+                        and optional "out_dir", "version", "top_k" and "trust_lnotab" overrides
+        :return: DecompilerResult as a dict. Submitted pyc bytes without an "out_dir" are decompiled in a temporary directory
+                 that is removed afterwards, so the decompiled source is returned inline as "source" instead.
+        """
+        tmp_dir = None
+        if "pyc" in request:
+            if request.get("out_dir"):
+                out_dir = Path(request["out_dir"])
+            else:
+                tmp_dir = tempfile.TemporaryDirectory(prefix="pylingual_")
+                out_dir = Path(tmp_dir.name)
+            out_dir.mkdir(parents=True, exist_ok=True)
+            file = out_dir / Path(request.get("name") or "submitted.pyc").name
+            file.write_bytes(base64.b64decode(request["pyc"]))
+        elif "path" in request:
+            file = Path(request["path"])
+            out_dir = Path(request["out_dir"]) if request.get("out_dir") else file.parent / f"decompiled_{file.stem}"
+        else:
+            raise ValueError("Request must contain a pyc path or pyc bytes")
+        try:
+            if not file.exists():
+                raise FileNotFoundError(f"pyc file {file} does not exist")
+
+            version = PythonVersion(request["version"]) if request.get("version") is not None else None
+            top_k = int(request.get("top_k", self.top_k))
+            trust_lnotab = bool(request.get("trust_lnotab", self.trust_lnotab))
+            with self.lock:
+                result = decompile(file, out_dir, self.config_file, version, top_k, trust_lnotab, self.model_cache, result_cache=self.result_cache, codeobj_cache=self.codeobj_cache)
+            response = result.to_dict()
+            if tmp_dir is not None:
+                response["source"] = result.decompiled_source.read_text() if result.decompiled_source.exists() else None
+            return response
+        finally:
+            if tmp_dir is not None:
+                tmp_dir.cleanup()
+
+
+class DecompilationRequestHandler(http.server.BaseHTTPRequestHandler):
+    server: ThreadingUnixHTTPServer | http.server.ThreadingHTTPServer
+
+    def do_GET(self):
+        if self.path != "/status":
+            self.send_json(404, {"error": f"Unknown endpoint {self.path}"})
+            return
+        self.send_json(200, self.server.service.status())
+
+    def do_POST(self):
+        if self.path != "/decompile":
+            self.send_json(404, {"error": f"Unknown endpoint {self.path}"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except ValueError as e:
+            self.send_json(400, {"error": f"Invalid request: {e}"})
+            return
+        try:
+            response = self.server.service.handle(request)
+        except Exception as e:
+            logger.exception(f"Failed to decompile {request.get('path') or request.get('name')}")
+            self.send_json(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        self.send_json(200, response)
+
+    def send_json(self, code: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # unix socket clients have no address, so don't use the default logging which includes it
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(service: DecompilationService, socket_path: Path | None = None, host: str = "127.0.0.1", port: int = DEFAULT_PORT):
+    """
+    Serve decompilation requests until interrupted
+
+    :param service: The DecompilationService that handles requests
+    :param socket_path: Listen on this unix socket. if None, listen on host:port instead.
+    :param host: Host to listen on, should stay local since requests can read any path the server can
+    :param port: Port to listen on
+    """
+    if socket_path is not None:
+        socket_path.unlink(missing_ok=True)
+        server = ThreadingUnixHTTPServer(str(socket_path), DecompilationRequestHandler)
+        address = str(socket_path)
+    else:
+        server = http.server.ThreadingHTTPServer((host, port), DecompilationRequestHandler)
+        address = f"http://{host}:{port}"
+    server.service = service
+    logger.info(f"Listening on {address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path is not None:
+            socket_path.unlink(missing_ok=True)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: float | None = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def connect(address: str, timeout: float | None = None) -> http.client.HTTPConnection:
+    """
+    Open a connection to a running decompilation server
+
+    :param address: http://host:port for a server listening on TCP, otherwise the path to a unix socket
+    :param timeout: Socket timeout in seconds, None waits indefinitely
+    """
+    if address.startswith("http://"):
+        host, _, port = address.removeprefix("http://").rstrip("/").partition(":")
+        return http.client.HTTPConnection(host, int(port) if port else DEFAULT_PORT, timeout=timeout)
+    return UnixHTTPConnection(address, timeout=timeout)
+
+
+def submit(address: str, path: Path | None = None, pyc: bytes | None = None, name: str | None = None, out_dir: Path | None = None, **options) -> dict:
+    """
+    Submit a pyc to a running decompilation server
+
+    :param address: Address of the server, see connect()
+    :param path: Path to the pyc; must be readable by the server
+    :param pyc: Contents of the pyc, used instead of path
+    :param name: File name for the submitted pyc contents
+    :param out_dir: Path the server should write the decompilation results to
+    :param options: Optional version, top_k and trust_lnotab overrides
+    :return: DecompilerResult as a dict
+    """
+    if pyc is not None:
+        request = {"pyc": base64.b64encode(pyc).decode(), "name": name}
+    elif path is not None:
+        request = {"path": os.path.abspath(path)}
+    else:
+        raise ValueError("Either a pyc path or pyc bytes must be submitted")
+    if out_dir is not None:
+        request["out_dir"] = os.path.abspath(out_dir)
+    request.update({k: str(v) if isinstance(v, PythonVersion) else v for k, v in options.items() if v is not None})
+
+    connection = connect(address)
+    try:
+        connection.request("POST", "/decompile", body=json.dumps(request), headers={"Content-Type": "application/json"})
+        response = connection.getresponse()
+        body = json.loads(response.read())
+    finally:
+        connection.close()
+    if response.status != 200:
+        raise RuntimeError(body.get("error", f"Server responded with status {response.status}"))
+    return body
@@ -0,0 +1,80 @@
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any
+
+
+class DiskCache:
+    """
+    Size-bounded key-value store of JSON documents in a directory.
+    When the entries grow past max_bytes, the least recently used ones are evicted.
+    Writes are atomic, so several processes can share the same directory.
+
+    :param root: Directory to keep the entries in
+    :param max_bytes: Approximate cap on the total size of the entries, None for no cap
+    """
+
+    def __init__(self, root: Path, max_bytes: int | None = None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+        # estimated size of the entries, only recounted when it exceeds the cap
+        self.size: int | None = None
+        self.lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Any | None:
+        path = self._path(key)
+        try:
+            value = json.loads(path.read_text())
+            # bump the modification time, which orders eviction
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return value
+
+    def put(self, key: str, value: Any):
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        data = json.dumps(value)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(data)
+        os.replace(tmp_path, path)
+        with self.lock:
+            if self.size is not None:
+                self.size += len(data)
+            self._evict()
+
+    def delete(self, key: str):
+        path = self._path(key)
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except OSError:
+            return
+        with self.lock:
+            if self.size is not None:
+                self.size -= size
+
+    def _evict(self):
+        if self.max_bytes is None or (self.size is not None and self.size <= self.max_bytes):
+            return
+        entries = []
+        for path in self.root.glob("*/*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        self.size = sum(size for _, size, _ in entries)
+        if self.size <= self.max_bytes:
+            return
+        # evict down to 90% of the cap so that the directory is not rescanned on every put
+        for _, size, path in sorted(entries):
+            if self.size <= self.max_bytes * 0.9:
+                break
+            path.unlink(missing_ok=True)
+            self.size -= size
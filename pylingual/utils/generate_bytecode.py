@@ -1,34 +1,76 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
+import atexit
+import base64
+import collections
+import importlib.util
+import json
+import marshal
 import subprocess
 import sys
 import py_compile
 import platform
 import os
 import shutil
+import threading
+import types
+from pathlib import Path
 
 from pylingual.utils.version import PythonVersion
 
 
 class CompileError(Exception):
+    """
+    :param lineno: Line of the syntax error, if the error has one
+    :param offset: Column of the syntax error, if the error has one
+    """
+
     success = False
 
+    def __init__(self, message: str, lineno: int | None = None, offset: int | None = None):
+        super().__init__(message)
+        self.lineno = lineno
+        self.offset = offset
+
+    def __reduce__(self):
+        return type(self), (str(self), self.lineno, self.offset)
+
 
 class PyenvError(Exception):
     pass
 
-def compile_version(py_file, out_file, version):
-    py_file = str(py_file)
-    out_file = str(out_file)
-    version = PythonVersion(version)
-    if version == sys.version_info:
-        try:
-            py_compile.compile(py_file, cfile=out_file, doraise=True, optimize=0)
-        except py_compile.PyCompileError as e:
-            raise CompileError(str(e))
-        return
-    
 
+# lines of a compile worker's stderr kept for error messages
+STDERR_LINES = 50
+
+
+# compiles source sent by CompilerPool, one JSON request per line; runs on every supported version, so it avoids newer syntax
+_WORKER_SOURCE = r"""
+import base64, importlib.util, json, marshal, py_compile, sys, warnings
+warnings.simplefilter("ignore")
+sys.stdout.write(json.dumps({"version": list(sys.version_info[:2]), "magic": base64.b64encode(importlib.util.MAGIC_NUMBER).decode()}) + "\n")
+sys.stdout.flush()
+while True:
+    line = sys.stdin.readline()
+    if not line:
+        break
+    request = json.loads(line)
+    try:
+        code = compile(base64.b64decode(request["source"]), request["filename"], "exec", dont_inherit=True)
+        response = {"code": base64.b64encode(marshal.dumps(code)).decode()}
+    except Exception as err:
+        response = {"error": py_compile.PyCompileError(type(err), err, request["filename"]).msg, "lineno": getattr(err, "lineno", None), "offset": getattr(err, "offset", None)}
+    sys.stdout.write(json.dumps(response) + "\n")
+    sys.stdout.flush()
+"""
+
+
+def pyenv_python(version: PythonVersion) -> tuple[list[str], dict[str, str]]:
+    """
+    :return: The command that runs the pyenv python of version, and the environment to run it in
+    """
     which_pyenv = shutil.which("pyenv")
     version_win = None
     if platform.system() == "Windows": # workaround for pyenv-win being bugged when passing versions like 3.x not 3.x.y
@@ -57,11 +99,221 @@ def compile_version(py_file, out_file, version):
                 raise PyenvError(f"Could not find pyenv version for {version.as_str()}")
             version_win = f"{version.as_str()}.{max(pyenv_real_versions)}"
 
-    compile_cmd = f"import py_compile, sys; assert sys.version_info[:2] == {version.as_tuple()!r}; py_compile.compile({py_file!r}, cfile={out_file!r})"
+    return [which_pyenv, *"exec python".split()], {**os.environ, "PYENV_VERSION": version_win if version_win else version.as_str(), "PYTHONWARNINGS": "ignore"}
+
+
+class CompileWorker:
+    """
+    Long-lived interpreter of one Python version that compiles source text sent over a pipe
+
+    :param version: Python version of the worker, run through pyenv
+    """
+
+    def __init__(self, version: PythonVersion):
+        self.version = version
+        cmd, env = pyenv_python(version)
+        self.process = subprocess.Popen([*cmd, "-c", _WORKER_SOURCE], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, env=env)
+        # stderr is drained continuously, since the worker would block once the pipe is full; the last lines are kept for error messages
+        self.stderr_lines: collections.deque[str] = collections.deque(maxlen=STDERR_LINES)
+        self.stderr_thread = threading.Thread(target=self._drain_stderr, daemon=True)
+        self.stderr_thread.start()
+        handshake = self.process.stdout.readline()
+        if not handshake:
+            self.process.wait()
+            raise PyenvError(f"Could not start Python {version} through pyenv: {self.stderr()}")
+        handshake = json.loads(handshake)
+        if tuple(handshake["version"]) != version.as_tuple():
+            self.close()
+            raise PyenvError(f"pyenv started Python {'.'.join(map(str, handshake['version']))} instead of {version}")
+        self.magic = base64.b64decode(handshake["magic"])
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def _drain_stderr(self):
+        for line in self.process.stderr:
+            self.stderr_lines.append(line)
+
+    def stderr(self) -> str:
+        """
+        :return: The last lines the worker wrote to stderr, complete if the worker has exited
+        """
+        if not self.alive:
+            self.stderr_thread.join(timeout=1)
+        return "".join(self.stderr_lines).strip()
+
+    def compile(self, source: bytes, filename: str) -> bytes:
+        """
+        :param source: Contents of a source file
+        :param filename: Name of the file in the code object and in error messages
+        :return: The marshalled module code object
+        :raise CompileError: The source does not compile; lineno and offset locate syntax errors
+        """
+        try:
+            self.process.stdin.write(json.dumps({"source": base64.b64encode(source).decode(), "filename": filename}) + "\n")
+            self.process.stdin.flush()
+            response = self.process.stdout.readline()
+        except OSError as err:
+            raise CompileError(f"Compile worker for Python {self.version} failed: {err}") from err
+        if not response:
+            self.process.wait()
+            raise CompileError(f"Compile worker for Python {self.version} exited: {self.stderr()}")
+        response = json.loads(response)
+        if "error" in response:
+            raise CompileError(response["error"], response["lineno"], response["offset"])
+        return base64.b64decode(response["code"])
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        self.process.wait()
+
+
+class CompilerPool:
+    """
+    Compile workers for each Python version that are started once and reused, so compiling does not start an interpreter through the pyenv shims every time.
+    Workers are started on demand; compiles beyond workers_per_version concurrent ones of a version wait for a free worker.
+    A forked process starts its own workers, since the inherited pipes belong to the parent.
+
+    :param workers_per_version: Maximum number of workers of each version
+    """
+
+    def __init__(self, workers_per_version: int | None = None):
+        self.workers_per_version = workers_per_version or os.cpu_count() or 1
+        self._reset()
 
-    cmd = [which_pyenv, *"exec python -c".split(), compile_cmd]
-    
-    output = subprocess.run(cmd, shell=False, capture_output=True, text=True, env={**os.environ, "PYENV_VERSION": version_win if version_win else version.as_str(), "PYTHONWARNINGS": "ignore"})
+    def _reset(self):
+        self.pid = os.getpid()
+        self.idle: dict[tuple[int, int], list[CompileWorker]] = {}
+        self.started: dict[tuple[int, int], int] = {}
+        self.condition = threading.Condition()
+
+    def _check_fork(self):
+        if self.pid != os.getpid():
+            self._reset()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.shutdown()
+
+    def _acquire(self, version: PythonVersion) -> CompileWorker:
+        key = version.as_tuple()
+        with self.condition:
+            while not self.idle.get(key) and self.started.get(key, 0) >= self.workers_per_version:
+                self.condition.wait()
+            if self.idle.get(key):
+                return self.idle[key].pop()
+            self.started[key] = self.started.get(key, 0) + 1
+        try:
+            return CompileWorker(version)
+        except BaseException:
+            self._discard(version)
+            raise
+
+    def _release(self, worker: CompileWorker):
+        with self.condition:
+            if worker.alive:
+                self.idle.setdefault(worker.version.as_tuple(), []).append(worker)
+            else:
+                self.started[worker.version.as_tuple()] -= 1
+            self.condition.notify()
+
+    def _discard(self, version: PythonVersion):
+        with self.condition:
+            self.started[version.as_tuple()] -= 1
+            self.condition.notify()
+
+    def compile(self, source: bytes, filename: str, version: PythonVersion) -> tuple[bytes, bytes]:
+        """
+        :param source: Contents of a source file
+        :param filename: Name of the file in the code object and in error messages
+        :return: The pyc magic number of version and the marshalled module code object
+        :raise CompileError: The source does not compile
+        """
+        self._check_fork()
+        worker = self._acquire(PythonVersion(version))
+        try:
+            return worker.magic, worker.compile(source, filename)
+        finally:
+            self._release(worker)
+
+    def compile_file(self, py_file: Path, out_file: Path, version: PythonVersion):
+        """
+        Compile py_file to a pyc at out_file like py_compile.compile on the given version
+        """
+        source = py_file.read_bytes()
+        magic, code = self.compile(source, str(py_file), version)
+        stat = py_file.stat()
+        # pycs of 3.7+ have a flags field, 0 for timestamp based pycs
+        flags = b"\0\0\0\0" if PythonVersion(version) >= (3, 7) else b""
+        out_file.write_bytes(magic + flags + (int(stat.st_mtime) & 0xFFFFFFFF).to_bytes(4, "little") + (len(source) & 0xFFFFFFFF).to_bytes(4, "little") + code)
+
+    def shutdown(self):
+        with self.condition:
+            if self.pid == os.getpid():
+                for workers in self.idle.values():
+                    for worker in workers:
+                        worker.close()
+            self.idle.clear()
+            self.started.clear()
+
+
+_default_pool: CompilerPool | None = None
+_default_pool_lock = threading.Lock()
+
+
+def default_compiler_pool() -> CompilerPool:
+    """
+    :return: The CompilerPool of this process, which is shut down at exit
+    """
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = CompilerPool()
+            atexit.register(_default_pool.shutdown)
+    return _default_pool
+
+
+def compile_source(source: bytes, filename: str) -> types.CodeType:
+    """
+    Compile source with the running interpreter like py_compile, without writing a pyc
+
+    :param filename: Name of the file in the code object and in error messages
+    :raise CompileError: The source does not compile
+    """
+    try:
+        return compile(source, filename, "exec", dont_inherit=True, optimize=0)
+    except Exception as err:
+        raise CompileError(py_compile.PyCompileError(type(err), err, filename).msg, getattr(err, "lineno", None), getattr(err, "offset", None))
+
+
+def code_to_pyc(code: types.CodeType) -> bytes:
+    """
+    :return: Contents of a pyc of a code object compiled by the running interpreter, with zero flags, timestamp and source size
+    """
+    return importlib.util.MAGIC_NUMBER + bytes(12) + marshal.dumps(code)
+
+
+def compile_version(py_file, out_file, version, pool: CompilerPool | None = None):
+    """
+    Compile py_file to a pyc at out_file with the given Python version
+
+    :param pool: CompilerPool to compile other versions than the running one on. if None, the pool of this process is used.
+    :raise CompileError: The source does not compile
+    """
+    py_file = Path(py_file)
+    out_file = Path(out_file)
+    version = PythonVersion(version)
+    if version == sys.version_info:
+        try:
+            py_compile.compile(str(py_file), cfile=str(out_file), doraise=True, optimize=0)
+        except py_compile.PyCompileError as e:
+            raise CompileError(str(e), getattr(e.exc_value, "lineno", None), getattr(e.exc_value, "offset", None))
+        return
 
-    if output.stderr:
-        raise CompileError(output.stderr)
+    (pool if pool is not None else default_compiler_pool()).compile_file(py_file, out_file, version)
@@ -0,0 +1,86 @@
+import queue
+import threading
+from typing import Any, Callable, Iterable, Iterator
+
+# each stage maps one input item to any number of output items
+Stage = Callable[[Any], Iterable[Any]]
+
+_DONE = object()
+_POLL_INTERVAL = 0.1
+
+
+class _StageError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def run_stages(items: Iterable, stages: list[Stage]) -> Iterator:
+    """
+    Runs every item through all stages one after another in the calling thread
+    """
+    if not stages:
+        yield from items
+        return
+    for item in items:
+        yield from run_stages(stages[0](item), stages[1:])
+
+
+def run_pipelined(items: Iterable, stages: list[Stage], maxsize: int = 1) -> Iterator:
+    """
+    Runs each stage in its own thread, connected by bounded queues, so that a stage can start on the next item while the following stages still work on earlier ones.
+    Outputs of the last stage are yielded in the same order as run_stages would yield them.
+    An exception raised by a stage stops the pipeline and is re-raised by the consumer.
+
+    :param items: Inputs of the first stage
+    :param stages: Functions mapping an input item to an iterable of output items
+    :param maxsize: Maximum number of items waiting between two stages
+    """
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=maxsize) for _ in stages]
+
+    def put(q: queue.Queue, item) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(q: queue.Queue):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def drain(q: queue.Queue) -> Iterator:
+        while (item := get(q)) is not _DONE:
+            if isinstance(item, _StageError):
+                raise item.error
+            yield item
+
+    def work(stage: Stage, inputs: Iterable, output: queue.Queue):
+        try:
+            for item in inputs:
+                for result in stage(item):
+                    if not put(output, result):
+                        return
+        except BaseException as e:
+            put(output, _StageError(e))
+            return
+        put(output, _DONE)
+
+    threads = []
+    inputs = items
+    for stage, output in zip(stages, queues):
+        threads.append(threading.Thread(target=work, args=(stage, inputs, output), daemon=True))
+        inputs = drain(output)
+    for thread in threads:
+        thread.start()
+
+    try:
+        yield from drain(queues[-1]) if queues else items
+    finally:
+        stop.set()
@@ -0,0 +1,74 @@
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+# sqlite's default limit on host parameters in a single statement is 999 in older versions
+_QUERY_CHUNK_SIZE = 500
+
+
+class TranslationStore(ABC):
+    """
+    Persistent backend for the translations of CacheTranslator, shared across runs and processes.
+    Translations are keyed by normalized statement within a namespace, which identifies the model that produced them.
+    """
+
+    @abstractmethod
+    def get_many(self, namespace: str, statements: list[str]) -> dict[str, str]:
+        """
+        :return: dict of statement to translation for the statements that are stored
+        """
+
+    @abstractmethod
+    def put_many(self, namespace: str, translations: dict[str, str]):
+        pass
+
+
+class SqliteTranslationStore(TranslationStore):
+    """
+    TranslationStore in a sqlite database in WAL mode, which several processes can read and write concurrently.
+    A forked process opens its own connection on first use, since sqlite connections cannot cross a fork.
+
+    :param path: Path to the database file, created if it does not exist
+    :param timeout: Seconds to wait for another process's write lock before failing
+    """
+
+    def __init__(self, path: Path, timeout: float = 60.0):
+        self.path = path
+        self.timeout = timeout
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._connect()
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS translations (namespace TEXT NOT NULL, statement TEXT NOT NULL, translation TEXT NOT NULL, PRIMARY KEY (namespace, statement)) WITHOUT ROWID")
+
+    def _connect(self):
+        self.pid = os.getpid()
+        self.connection = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.lock = threading.Lock()
+
+    def _check_fork(self):
+        # the inherited connection and lock belong to the parent, so they are replaced rather than closed
+        if self.pid != os.getpid():
+            self._connect()
+
+    def get_many(self, namespace: str, statements: list[str]) -> dict[str, str]:
+        self._check_fork()
+        found = {}
+        with self.lock:
+            for start in range(0, len(statements), _QUERY_CHUNK_SIZE):
+                chunk = statements[start : start + _QUERY_CHUNK_SIZE]
+                query = f"SELECT statement, translation FROM translations WHERE namespace = ? AND statement IN ({', '.join('?' * len(chunk))})"
+                found.update(self.connection.execute(query, (namespace, *chunk)))
+        return found
+
+    def put_many(self, namespace: str, translations: dict[str, str]):
+        self._check_fork()
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO translations VALUES (?, ?, ?)", ((namespace, statement, translation) for statement, translation in translations.items()))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
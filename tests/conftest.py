@@ -0,0 +1,28 @@
+import pytest
+
+# importing any pylingual module imports pylingual.decompiler, which needs the full set of dependencies
+try:
+    import pylingual  # noqa: F401
+except ImportError:
+    collect_ignore_glob = ["test_*.py"]
+
+SEGMENTATION_OPCODES = ["LOAD_CONST", "LOAD_FAST", "STORE_NAME", "CALL_FUNCTION", "BINARY_ADD", "RETURN_VALUE", "POP_JUMP_IF_FALSE", "LOAD_ATTR"]
+
+
+@pytest.fixture(scope="session")
+def segmentation_tokenizer():
+    tokenizers = pytest.importorskip("tokenizers")
+    transformers = pytest.importorskip("transformers")
+    # same setup as model_training/segmentation/train_tokenizer.py, with a small vocabulary so instructions split into several tokens
+    tokenizer = tokenizers.Tokenizer(tokenizers.models.WordPiece(unk_token="[UNK]"))
+    tokenizer.normalizer = tokenizers.normalizers.Sequence([tokenizers.normalizers.NFD(), tokenizers.normalizers.StripAccents()])
+    tokenizer.pre_tokenizer = tokenizers.pre_tokenizers.Split("<SEP>", "removed")
+    corpus = [" <SEP> ".join(f"{opcode} <mask_{i % 7}>" for i, opcode in enumerate(SEGMENTATION_OPCODES * 3))]
+    tokenizer.train_from_iterator(corpus, trainer=tokenizers.trainers.WordPieceTrainer(vocab_size=80, special_tokens=["[UNK]", "[PAD]", "[CLS]", "[SEP]", "[MASK]"]))
+    tokenizer.decoder = tokenizers.decoders.WordPiece(prefix="##")
+    tokenizer.post_processor = tokenizers.processors.TemplateProcessing(
+        single="[CLS]:0 $A:0 [SEP]:0",
+        pair="[CLS]:0 $A:0 [SEP]:0 $B:1 [SEP]:1",
+        special_tokens=[("[CLS]", tokenizer.token_to_id("[CLS]")), ("[SEP]", tokenizer.token_to_id("[SEP]"))],
+    )
+    return transformers.PreTrainedTokenizerFast(tokenizer_object=tokenizer, unk_token="[UNK]", pad_token="[PAD]", cls_token="[CLS]", sep_token="[SEP]", mask_token="[MASK]")
@@ -0,0 +1,52 @@
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+import pylingual.broker as broker
+from pylingual.broker import BrokerClient, InferenceBroker
+
+
+@pytest.fixture
+def inference_broker(monkeypatch):
+    monkeypatch.setattr(broker, "BROKER_POLL_INTERVAL", 0.1)
+    inference_broker = InferenceBroker(1)
+    yield inference_broker
+    inference_broker.shutdown(timeout=1)
+
+
+def test_call_fails_when_the_broker_dies(inference_broker):
+    client = BrokerClient(inference_broker.address)
+    # a stopped broker never answers, so the call is still waiting when the broker is killed
+    os.kill(inference_broker.process.pid, signal.SIGSTOP)
+    errors = []
+
+    def call():
+        try:
+            client.call("describe", ("decompiler_config.yaml", (3, 9)))
+        except RuntimeError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=call)
+    thread.start()
+    time.sleep(0.3)
+    assert thread.is_alive()
+    inference_broker.process.kill()
+    thread.join(10)
+    assert not thread.is_alive()
+    assert len(errors) == 1 and "stopped" in str(errors[0])
+
+
+def test_shutdown_kills_a_hung_broker(inference_broker):
+    os.kill(inference_broker.process.pid, signal.SIGSTOP)
+    start = time.monotonic()
+    inference_broker.shutdown(timeout=0.5)
+    assert not inference_broker.process.is_alive()
+    assert time.monotonic() - start < 10
+
+
+def test_shutdown_stops_an_idle_broker(inference_broker):
+    inference_broker.shutdown()
+    assert inference_broker.process.exitcode == 0
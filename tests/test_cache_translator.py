@@ -0,0 +1,12 @@
+from pylingual.models import MAX_NEW_TOKENS, CacheTranslator
+
+
+def test_unmeasured_model_keeps_the_fixed_cap():
+    translator = CacheTranslator(None)
+    assert translator._max_new_tokens(1) == translator._max_new_tokens(400) == MAX_NEW_TOKENS
+
+
+def test_measured_limit_grows_with_input_length():
+    translator = CacheTranslator(None, generation_ratio=1.25, generation_offset=8, max_new_tokens=64)
+    assert translator._max_new_tokens(10) == 21
+    assert translator._max_new_tokens(100) == 64
@@ -0,0 +1,33 @@
+from pylingual.codeobj_cache import CodeObjectCache, canonical_masks, remap_masks
+from pylingual.utils.disk_cache import DiskCache
+
+ENTRY = {"entities": ["B", "E"], "lines": ["x = <mask_0>"], "indented_source": ["x = <mask_0>"], "order": [0, 1]}
+
+
+def test_canonical_masks_follow_first_appearance():
+    mapping = canonical_masks(["LOAD_CONST <mask_7>", "STORE_NAME <mask_3>", "LOAD_NAME <mask_7>"])
+    assert mapping == {"<mask_7>": "<mask_0>", "<mask_3>": "<mask_1>"}
+    assert remap_masks(["<mask_3> = <mask_7>"], mapping) == ["<mask_1> = <mask_0>"]
+    assert remap_masks(["<mask_9> = 1"], mapping) is None
+
+
+def test_entries_persist_across_caches(tmp_path):
+    CodeObjectCache(DiskCache(tmp_path)).put("abcdef", ENTRY)
+    assert CodeObjectCache(DiskCache(tmp_path)).get("abcdef") == ENTRY
+    assert CodeObjectCache().get("abcdef") is None
+
+
+def test_memory_is_bounded():
+    cache = CodeObjectCache(maxsize=2)
+    for fingerprint in ("aa0", "bb1", "cc2"):
+        cache.put(fingerprint, ENTRY)
+    assert cache.get("aa0") is None
+    assert cache.get("cc2") == ENTRY
+
+
+def test_evict_removes_the_persisted_entry(tmp_path):
+    cache = CodeObjectCache(DiskCache(tmp_path))
+    cache.put("abcdef", ENTRY)
+    cache.evict("abcdef")
+    assert cache.get("abcdef") is None
+    assert CodeObjectCache(DiskCache(tmp_path)).get("abcdef") is None
@@ -0,0 +1,55 @@
+import json
+import os
+import threading
+
+from pylingual.utils.disk_cache import DiskCache
+
+
+def test_get_returns_put_value(tmp_path):
+    cache = DiskCache(tmp_path)
+    cache.put("abcdef", {"source": "x = 1"})
+    assert cache.get("abcdef") == {"source": "x = 1"}
+    assert cache.get("missing") is None
+
+
+def test_delete(tmp_path):
+    cache = DiskCache(tmp_path)
+    cache.put("abcdef", [1, 2, 3])
+    cache.delete("abcdef")
+    cache.delete("abcdef")
+    assert cache.get("abcdef") is None
+
+
+def test_evicts_least_recently_used(tmp_path):
+    value = "x" * 1000
+    cache = DiskCache(tmp_path, max_bytes=3500)
+    for i, key in enumerate(["aa0", "bb1", "cc2"]):
+        cache.put(key, value)
+        os.utime(cache._path(key), (i, i))
+    # reading an entry makes it the most recently used one
+    assert cache.get("aa0") == value
+    cache.put("dd3", value)
+    assert cache.get("bb1") is None
+    assert cache.get("aa0") == value
+    assert cache.get("cc2") == value
+    assert cache.get("dd3") == value
+
+
+def test_no_cap_keeps_everything(tmp_path):
+    cache = DiskCache(tmp_path)
+    for i in range(50):
+        cache.put(f"{i:04d}", "x" * 1000)
+    assert all(cache.get(f"{i:04d}") is not None for i in range(50))
+
+
+def test_concurrent_puts_are_atomic(tmp_path):
+    cache = DiskCache(tmp_path)
+    values = [{"writer": i, "data": "x" * 100000} for i in range(8)]
+    threads = [threading.Thread(target=cache.put, args=("abcdef", value)) for value in values]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # the entry is one complete value, never a mix or a partial write
+    assert json.loads(cache._path("abcdef").read_text()) in values
+    assert not list(tmp_path.glob("*/*.tmp"))
@@ -0,0 +1,91 @@
+import pytest
+
+from pylingual.equivalence_check import ReferencePyc, compare_pyc
+from pylingual.utils.generate_bytecode import code_to_pyc, compile_source
+
+ORIGINAL = """
+import os
+
+
+def first(x):
+    return [y * 2 for y in x if y]
+
+
+class Shape:
+    sides = 0
+
+    def area(self):
+        if self.sides > 2:
+            return self.sides * 1.5
+        return 0
+
+    def describe(self):
+        def inner(prefix):
+            return f"{prefix} {self.sides}"
+
+        return inner("shape")
+
+
+def last(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+"""
+
+# a correction of one code object moves the lines of everything after it
+CANDIDATES = {
+    "identical": ORIGINAL,
+    "moved lines": ORIGINAL.replace("import os\n", "import os\n\n\n\n"),
+    "changed function": ORIGINAL.replace("return [y * 2 for y in x if y]", "result = [y * 2 for y in x]\n    return result"),
+    "changed nested function": ORIGINAL.replace('return f"{prefix} {self.sides}"', "return prefix"),
+    "changed method and moved lines": ORIGINAL.replace("return self.sides * 1.5", "x = self.sides\n            return x * 1.5"),
+    "changed constant": ORIGINAL.replace("return self.sides * 1.5", "return self.sides * 2.5"),
+    "missing function": ORIGINAL.replace("def first(x):\n    return [y * 2 for y in x if y]\n", ""),
+    "extra function": ORIGINAL + "\n\ndef extra():\n    pass\n",
+}
+
+
+@pytest.fixture
+def original_pyc(tmp_path):
+    path = tmp_path / "original.pyc"
+    path.write_bytes(code_to_pyc(compile_source(ORIGINAL.encode(), "module.py")))
+    return path
+
+
+@pytest.mark.parametrize("name", CANDIDATES)
+@pytest.mark.parametrize("as_bytes", [False, True])
+def test_reference_matches_compare_pyc(original_pyc, name, as_bytes):
+    code = compile_source(CANDIDATES[name].encode(), "module.py")
+    candidate = code_to_pyc(code) if as_bytes else code
+    assert ReferencePyc(original_pyc).compare(candidate) == compare_pyc(original_pyc, candidate)
+
+
+@pytest.mark.parametrize("name", CANDIDATES)
+def test_recheck_matches_full_compare(original_pyc, name):
+    reference = ReferencePyc(original_pyc)
+    reference.compare(compile_source(CANDIDATES["changed method and moved lines"].encode(), "module.py"))
+    code = compile_source(CANDIDATES[name].encode(), "module.py")
+    # code objects that changed since the last candidate are compared again even when they are not dirty
+    assert reference.compare(code, dirty=set()) == compare_pyc(original_pyc, code)
+
+
+def test_clean_results_are_reused(original_pyc, monkeypatch):
+    reference = ReferencePyc(original_pyc)
+    candidate = CANDIDATES["changed constant"]
+    first = reference.compare(compile_source(candidate.encode(), "module.py"))
+    assert [result.message for result in first if not result.success] == ["Different bytecode"]
+
+    built = []
+    candidate_bytecode = reference.candidate_bytecode
+    monkeypatch.setattr(reference, "candidate_bytecode", lambda name, code: built.append(name) or candidate_bytecode(name, code))
+    moved = compile_source(candidate.replace("import os\n", "import os\n\n").encode(), "module.py")
+    second = reference.compare(moved, dirty={"<module>.first"})
+
+    # only the dirty code object and the failed one, whose line moved, are built again
+    assert sorted(built) == ["<module>.Shape.area", "<module>.first"]
+    assert second == compare_pyc(original_pyc, moved)
+    [failed_first] = [result for result in first if not result.success]
+    [failed_second] = [result for result in second if not result.success]
+    assert failed_second.failed_line_number == failed_first.failed_line_number + 1
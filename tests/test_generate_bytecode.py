@@ -0,0 +1,81 @@
+import marshal
+import shutil
+import sys
+
+import pytest
+
+from pylingual.editable_bytecode import PYCFile
+from pylingual.utils.generate_bytecode import CompileError, CompilerPool, code_to_pyc, compile_source, compile_version
+from pylingual.utils.version import PythonVersion
+
+SOURCE = b"""
+import os
+
+
+class Greeter:
+    def __init__(self, name):
+        self.name = name
+
+    def greet(self, times=2):
+        for _ in range(times):
+            try:
+                print(f"hello {self.name}")
+            except OSError:
+                pass
+        return [c for c in self.name if c.isalpha()]
+
+
+def main():
+    return Greeter(os.getcwd()).greet()
+"""
+
+RUNNING_VERSION = PythonVersion(sys.version_info[:2])
+
+
+def test_compile_source_matches_compile_version(tmp_path):
+    py_file = tmp_path / "module.py"
+    py_file.write_bytes(SOURCE)
+    compile_version(py_file, tmp_path / "module.pyc", RUNNING_VERSION)
+    pyc = (tmp_path / "module.pyc").read_bytes()
+
+    code = compile_source(SOURCE, str(py_file))
+    assert code == marshal.loads(pyc[16:])
+    assert code_to_pyc(code)[:4] == pyc[:4]
+    assert code_to_pyc(code)[16:] == pyc[16:]
+
+
+def test_code_object_loads_like_its_pyc(tmp_path):
+    py_file = tmp_path / "module.py"
+    py_file.write_bytes(SOURCE)
+    compile_version(py_file, tmp_path / "module.pyc", RUNNING_VERSION)
+
+    from_file = list(PYCFile(tmp_path / "module.pyc").iter_bytecodes())
+    from_code = list(PYCFile(compile_source(SOURCE, str(py_file))).iter_bytecodes())
+    assert [bytecode.name for bytecode in from_code] == [bytecode.name for bytecode in from_file]
+    for bytecode_a, bytecode_b in zip(from_file, from_code):
+        assert [(inst.opname, inst.offset, inst.starts_line) for inst in bytecode_a] == [(inst.opname, inst.offset, inst.starts_line) for inst in bytecode_b]
+
+
+@pytest.mark.parametrize("source", [b"def f(:\n    pass\n", b"x = 1\n  y = 2\n", b"return 1\n"])
+def test_compile_errors_match_compile_version(tmp_path, source):
+    py_file = tmp_path / "broken.py"
+    py_file.write_bytes(source)
+    with pytest.raises(CompileError) as from_file:
+        compile_version(py_file, tmp_path / "broken.pyc", RUNNING_VERSION)
+    with pytest.raises(CompileError) as from_source:
+        compile_source(source, str(py_file))
+    assert str(from_source.value) == str(from_file.value)
+    assert (from_source.value.lineno, from_source.value.offset) == (from_file.value.lineno, from_file.value.offset)
+
+
+@pytest.mark.skipif(shutil.which("pyenv") is None, reason="compile workers run through pyenv")
+def test_compiler_pool_matches_py_compile(tmp_path):
+    py_file = tmp_path / "module.py"
+    py_file.write_bytes(SOURCE)
+    compile_version(py_file, tmp_path / "expected.pyc", RUNNING_VERSION)
+    with CompilerPool(1) as pool:
+        pool.compile_file(py_file, tmp_path / "module.pyc", RUNNING_VERSION)
+        with pytest.raises(CompileError) as error:
+            pool.compile(b"def f(:\n", str(py_file), RUNNING_VERSION)
+    assert (tmp_path / "module.pyc").read_bytes() == (tmp_path / "expected.pyc").read_bytes()
+    assert error.value.lineno == 1
@@ -0,0 +1,78 @@
+import types
+from pathlib import Path
+
+import pytest
+
+import pylingual.models as models
+
+from pylingual.backends import LazySegmentationBackend, LazyTranslationBackend
+from pylingual.decompiler import decompile_many, resolve_config_file
+from pylingual.models import CacheTranslator, ModelCache, model_settings
+from pylingual.utils.version import PythonVersion
+
+
+class FakeBackend:
+    def __init__(self, size: int):
+        self.size = size
+
+    def memory_bytes(self) -> int:
+        return self.size
+
+
+def fake_load_models(config_file, version, **kwargs):
+    return LazySegmentationBackend(lambda: FakeBackend(60)), CacheTranslator(LazyTranslationBackend(lambda: FakeBackend(40)))
+
+
+def test_cap_is_checked_when_models_load(monkeypatch, tmp_path):
+    monkeypatch.setattr(models, "load_models", fake_load_models)
+    monkeypatch.setattr(ModelCache, "_release", staticmethod(lambda: None))
+    cache = ModelCache(max_memory=150)
+    config_file = tmp_path / "decompiler_config.yaml"
+    # neither pair holds weights when it is requested, so both fit
+    segmenter_38, translator_38 = cache.get(config_file, PythonVersion(3.8))
+    segmenter_39, _ = cache.get(config_file, PythonVersion(3.9))
+    segmenter_38.backend
+    translator_38.translator.backend
+    assert list(cache.sizes().values()) == [100, 0]
+    # loading a model of 3.9 goes over the cap, so the older pair is unloaded without waiting for the next get
+    segmenter_39.backend
+    assert cache.sizes() == {(config_file.resolve(), (3, 9)): 60}
+
+
+def test_pair_whose_model_loads_is_kept(monkeypatch, tmp_path):
+    monkeypatch.setattr(models, "load_models", fake_load_models)
+    monkeypatch.setattr(ModelCache, "_release", staticmethod(lambda: None))
+    cache = ModelCache(max_memory=150)
+    config_file = tmp_path / "decompiler_config.yaml"
+    segmenter_38, translator_38 = cache.get(config_file, PythonVersion(3.8))
+    segmenter_39, translator_39 = cache.get(config_file, PythonVersion(3.9))
+    cache.get(config_file, PythonVersion(3.10))
+    segmenter_39.backend
+    translator_39.translator.backend
+    # 3.8 is the least recently requested pair, but it is the one whose weights were just loaded
+    segmenter_38.backend
+    translator_38.translator.backend
+    assert list(cache.sizes()) == [(config_file.resolve(), (3, 8)), (config_file.resolve(), (3, 10))]
+
+
+class FailingModelCache:
+    quantize = None
+    backend = "torch"
+
+    def get(self, config_file, version):
+        raise RuntimeError("no models")
+
+
+def test_decompile_many_deduplicates_paths(tmp_path):
+    pyc = tmp_path / "module.pyc"
+    other = tmp_path / "other.pyc"
+    results = list(decompile_many([pyc, other, Path(tmp_path, ".", "module.pyc"), pyc], out_dir=tmp_path, version="3.9", model_cache=FailingModelCache()))
+    assert [file for file, _ in results] == [pyc, other]
+    assert all(isinstance(result, RuntimeError) for _, result in results)
+
+
+@pytest.mark.parametrize(("cuda", "backend", "expected"), [(False, "torch", "int8"), (True, "torch", None), (False, "onnx", None)])
+def test_quantization_resolves_against_the_device(monkeypatch, cuda, backend, expected):
+    monkeypatch.setattr(models, "torch", types.SimpleNamespace(cuda=types.SimpleNamespace(is_available=lambda: cuda)))
+    assert model_settings(resolve_config_file(None), PythonVersion(3.9), "int8", backend)["quantize"] == expected
+    assert model_settings(resolve_config_file(None), PythonVersion(3.9), "none", backend)["quantize"] is None
@@ -0,0 +1,110 @@
+import json
+
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+pytest.importorskip("onnxruntime")
+optimum_onnx = pytest.importorskip("optimum.exporters.onnx")
+
+from pylingual.backends import OnnxSegmentationBackend, OnnxTranslationBackend  # noqa: E402
+from pylingual.models import load_torch_segmenter, load_torch_translator  # noqa: E402
+from pylingual.segmentation.sliding_window import token_id_windows  # noqa: E402
+
+WINDOWS = ["LOAD_CONST <mask_0> <SEP> STORE_NAME <mask_1>", "LOAD_FAST <mask_2> <SEP> LOAD_ATTR <mask_3> <SEP> CALL_FUNCTION <mask_4> <SEP> RETURN_VALUE <mask_5>", "BINARY_ADD <mask_6>"]
+STATEMENTS = ["LOAD_CONST <mask_0> STORE_NAME <mask_1>", "LOAD_NAME <mask_2> LOAD_ATTR <mask_3> CALL_FUNCTION 0 POP_TOP", "RETURN_VALUE"]
+
+
+@pytest.fixture(scope="module")
+def statement_tokenizer(tmp_path_factory):
+    from transformers.models.gpt2.tokenization_gpt2 import bytes_to_unicode
+
+    # byte level BPE without merges, so every byte is a token
+    tokenizer_dir = tmp_path_factory.mktemp("statement_tokenizer")
+    vocab = {token: i for i, token in enumerate(["<s>", "<pad>", "</s>", "<unk>", "<mask>", *bytes_to_unicode().values()])}
+    (tokenizer_dir / "vocab.json").write_text(json.dumps(vocab))
+    (tokenizer_dir / "merges.txt").write_text("#version: 0.2\n")
+    return transformers.RobertaTokenizer(str(tokenizer_dir / "vocab.json"), str(tokenizer_dir / "merges.txt"))
+
+
+@pytest.fixture(scope="module")
+def segmentation_dirs(tmp_path_factory, segmentation_tokenizer):
+    torch.manual_seed(0)
+    config = transformers.BertConfig(
+        vocab_size=len(segmentation_tokenizer),
+        hidden_size=32,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        intermediate_size=64,
+        id2label={0: "E", 1: "B", 2: "I"},
+        label2id={"E": 0, "B": 1, "I": 2},
+    )
+    torch_dir, onnx_dir = tmp_path_factory.mktemp("segmentation_torch"), tmp_path_factory.mktemp("segmentation_onnx")
+    transformers.BertForTokenClassification(config).save_pretrained(torch_dir)
+    segmentation_tokenizer.save_pretrained(torch_dir)
+    # same export as export_onnx
+    optimum_onnx.main_export(str(torch_dir), output=onnx_dir, task="token-classification")
+    segmentation_tokenizer.save_pretrained(onnx_dir)
+    return torch_dir, onnx_dir
+
+
+@pytest.fixture(scope="module")
+def statement_dirs(tmp_path_factory, statement_tokenizer):
+    torch.manual_seed(0)
+    config = transformers.T5Config(
+        vocab_size=len(statement_tokenizer),
+        d_model=32,
+        d_ff=64,
+        d_kv=8,
+        num_layers=2,
+        num_heads=4,
+        pad_token_id=statement_tokenizer.pad_token_id,
+        eos_token_id=statement_tokenizer.eos_token_id,
+        decoder_start_token_id=statement_tokenizer.pad_token_id,
+        # a small default initialization greedily repeats one token, a large one makes each step depend on the previous tokens
+        initializer_factor=20.0,
+    )
+    model = transformers.T5ForConditionalGeneration(config)
+    # make the end of sequence likely enough that some statements finish before the generation limit and others do not
+    with torch.no_grad():
+        model.lm_head.weight[statement_tokenizer.eos_token_id] *= 2
+    torch_dir, onnx_dir = tmp_path_factory.mktemp("statement_torch"), tmp_path_factory.mktemp("statement_onnx")
+    model.save_pretrained(torch_dir)
+    statement_tokenizer.save_pretrained(torch_dir)
+    # same export as export_onnx
+    optimum_onnx.main_export(str(torch_dir), output=onnx_dir, task="text2text-generation-with-past", no_post_process=True)
+    statement_tokenizer.save_pretrained(onnx_dir)
+    return torch_dir, onnx_dir
+
+
+def test_segmentation_backends_agree(segmentation_dirs):
+    torch_dir, onnx_dir = segmentation_dirs
+    torch_backend = load_torch_segmenter({}, torch.device("cpu"), snapshot_dir=torch_dir)
+    onnx_backend = OnnxSegmentationBackend(onnx_dir)
+
+    windows = [input_ids for _, input_ids, _, _ in token_id_windows(onnx_backend.tokenizer, WINDOWS, 512, 128)]
+    for torch_probabilities, onnx_probabilities in zip(torch_backend.token_probabilities(windows, batch_size=2), onnx_backend.token_probabilities(windows, batch_size=2), strict=True):
+        np.testing.assert_allclose(onnx_probabilities, torch_probabilities, atol=1e-5)
+
+    for torch_results, onnx_results in zip(torch_backend(WINDOWS, batch_size=2), onnx_backend(WINDOWS, batch_size=2), strict=True):
+        assert [(r["entity"], r["index"], r["word"]) for r in onnx_results] == [(r["entity"], r["index"], r["word"]) for r in torch_results]
+        np.testing.assert_allclose([r["score"] for r in onnx_results], [r["score"] for r in torch_results], atol=1e-5)
+
+
+@pytest.mark.parametrize("max_new_tokens", [1, 2, 12])
+def test_greedy_translation_matches_torch(statement_dirs, max_new_tokens):
+    torch_dir, onnx_dir = statement_dirs
+    torch_backend = load_torch_translator({}, torch.device("cpu"), snapshot_dir=torch_dir)
+    onnx_backend = OnnxTranslationBackend(onnx_dir)
+
+    expected = torch_backend.generate(STATEMENTS, max_new_tokens)
+    generated = onnx_backend.generate(STATEMENTS, max_new_tokens)
+    assert generated == expected
+    assert all(len(ids) <= max_new_tokens + 1 for ids in generated)
+    if max_new_tokens > 2:
+        # steps after the first run on the decoder with past key values, finished statements are padded while the others continue
+        eos_token_id = onnx_backend.eos_token_id
+        assert any(eos_token_id in ids[3:] for ids in generated)
+        assert any(eos_token_id not in ids for ids in generated)
+        assert all(len(set(ids)) > 3 for ids in generated)
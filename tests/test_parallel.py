@@ -0,0 +1,44 @@
+from pylingual.control_flow_reconstruction.cflow import bytecode_to_indented_source
+from pylingual.editable_bytecode import PYCFile
+from pylingual.masking.model_disasm import create_global_masker
+from pylingual.parallel import CodeObjectPool
+from pylingual.utils.generate_bytecode import code_to_pyc, compile_source
+
+SOURCE = """
+def first(x):
+    if x:
+        return 1
+    return 2
+
+class Shape:
+    def area(self):
+        for i in range(3):
+            print(i)
+
+def last(path):
+    while path:
+        path = path[1:]
+"""
+
+
+def load_bytecodes(pyc_path):
+    pyc = PYCFile(pyc_path)
+    create_global_masker(pyc)
+    return list(pyc.iter_bytecodes())
+
+
+def test_indented_sources_skips_known_code_objects(tmp_path):
+    pyc_path = tmp_path / "module.pyc"
+    pyc_path.write_bytes(code_to_pyc(compile_source(SOURCE.encode(), "module.py")))
+    source_lines = SOURCE.split("\n")
+    expected = {bytecode.name: bytecode_to_indented_source(bytecode, source_lines) for bytecode in load_bytecodes(pyc_path)}
+
+    bytecodes = load_bytecodes(pyc_path)
+    skip = {i for i, bytecode in enumerate(bytecodes) if bytecode.name in ("<module>.first", "<module>.Shape")}
+    with CodeObjectPool(2, min_code_objects=1) as pool:
+        sources = pool.indented_sources(pyc_path, bytecodes, source_lines, skip=skip)
+    assert [bytecodes[i].codeobj for i in range(len(bytecodes)) if i not in skip] == list(sources)
+    for bytecode in bytecodes:
+        if bytecode.codeobj in sources:
+            assert sources[bytecode.codeobj] == expected[bytecode.name]
+            assert bytecode.ordered_instructions
@@ -0,0 +1,51 @@
+import random
+import threading
+import time
+
+import pytest
+
+from pylingual.utils.pipelined import run_pipelined, run_stages
+
+
+def split(item):
+    time.sleep(random.random() / 1000)
+    return [(item, i) for i in range(item % 3)]
+
+
+def double(item):
+    time.sleep(random.random() / 1000)
+    return [item, item]
+
+
+def test_same_order_as_run_stages():
+    stages = [split, double, lambda item: [str(item)]]
+    assert list(run_pipelined(range(50), stages)) == list(run_stages(range(50), stages))
+
+
+def test_no_stages():
+    assert list(run_pipelined(range(5), [])) == list(run_stages(range(5), [])) == list(range(5))
+
+
+def test_stage_error_reaches_consumer():
+    def fail_on_three(item):
+        if item == 3:
+            raise ValueError("bad item")
+        return [item]
+
+    results = []
+    with pytest.raises(ValueError, match="bad item"):
+        for result in run_pipelined(range(10), [double, fail_on_three, double]):
+            results.append(result)
+    assert results == [0, 0, 0, 0, 1, 1, 1, 1, 2, 2, 2, 2]
+
+
+def test_closing_the_consumer_stops_the_stages():
+    before = set(threading.enumerate())
+    results = run_pipelined(iter(range(1000)), [double, double])
+    assert next(results) == 0
+    stage_threads = set(threading.enumerate()) - before
+    assert stage_threads
+    results.close()
+    for thread in stage_threads:
+        thread.join(timeout=5)
+        assert not thread.is_alive()
@@ -0,0 +1,46 @@
+from pathlib import Path
+
+from pylingual.decompiler import decompile_many, resolve_config_file, result_cache_key, result_dirs
+from pylingual.utils.disk_cache import DiskCache
+from pylingual.utils.generate_bytecode import code_to_pyc, compile_source
+from pylingual.utils.version import PythonVersion
+
+
+def test_unique_names_keep_their_directory():
+    assert result_dirs([Path("a/x.pyc"), Path("b/y.pyc")], Path("out")) == {Path("a/x.pyc"): Path("out/decompiled_x"), Path("b/y.pyc"): Path("out/decompiled_y")}
+
+
+def test_shared_names_are_numbered():
+    files = [Path("a/__init__.pyc"), Path("__init___1.pyc"), Path("b/__init__.pyc"), Path("a/__init__.pyc")]
+    assert result_dirs(files, Path("out")) == {
+        Path("a/__init__.pyc"): Path("out/decompiled___init___2"),
+        Path("__init___1.pyc"): Path("out/decompiled___init___1"),
+        Path("b/__init__.pyc"): Path("out/decompiled___init___3"),
+    }
+
+
+class CachedOnlyModelCache:
+    quantize = None
+    backend = "torch"
+
+    def get(self, config_file, version):
+        raise AssertionError("every result should come from the result cache")
+
+
+def test_same_name_pycs_get_their_own_results(tmp_path):
+    result_cache = DiskCache(tmp_path / "cache")
+    config_file = resolve_config_file(None)
+    pycs = []
+    for package in ("first", "second"):
+        source = f"NAME = {package!r}\n"
+        pyc = tmp_path / package / "__init__.pyc"
+        pyc.parent.mkdir()
+        pyc.write_bytes(code_to_pyc(compile_source(source.encode(), "__init__.py")))
+        key = result_cache_key(pyc.read_bytes(), config_file, PythonVersion(3.11), 10, False)
+        result_cache.put(key, {"result": {"equivalence_results": [], "version": "3.11"}, "source": source})
+        pycs.append(pyc)
+
+    results = dict(decompile_many(pycs, out_dir=tmp_path / "out", version="3.11", model_cache=CachedOnlyModelCache(), result_cache=result_cache))
+    sources = [results[pyc].decompiled_source for pyc in pycs]
+    assert len(set(sources)) == 2
+    assert [source.read_text() for source in sources] == ["NAME = 'first'\n", "NAME = 'second'\n"]
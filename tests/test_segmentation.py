@@ -0,0 +1,87 @@
+import functools
+import itertools
+
+import pytest
+
+from pylingual.backends import SEGMENTATION_LABELS
+from pylingual.segmentation.segmentation_search_strategies import get_top_k_predictions, m_deep_top_k, naive_confidence_priority
+from pylingual.segmentation.sliding_window import merge, merge_probabilities, token_id_windows
+
+np = pytest.importorskip("numpy")
+
+
+def make_windows(rng, codeobj_lengths: list[int], window_size: int, step: int):
+    window_coords, window_probabilities, inst_index = [], [], []
+    for codeobj_index, length in enumerate(codeobj_lengths):
+        for window_index, start in enumerate(range(0, max(length - window_size, 0) + step, step)):
+            indices = list(range(start, min(start + window_size, length)))
+            probabilities = rng.dirichlet(np.ones(len(SEGMENTATION_LABELS)), size=len(indices))
+            window_coords.append((codeobj_index, window_index))
+            window_probabilities.append(probabilities)
+            inst_index.append(indices)
+    return window_coords, window_probabilities, inst_index
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_merge_probabilities_matches_merge(seed):
+    rng = np.random.default_rng(seed)
+    window_coords, window_probabilities, inst_index = make_windows(rng, [1, 7, 30, 64], window_size=12, step=5)
+    window_results = [[{"entity": SEGMENTATION_LABELS[label], "score": float(row[label])} for row, label in zip(probabilities, probabilities.argmax(axis=1))] for probabilities in window_probabilities]
+
+    expected = merge(window_coords, window_results, inst_index, 12, 5)
+    merged = merge_probabilities(window_coords, window_probabilities, inst_index)
+
+    assert len(merged) == len(expected)
+    for (labels, first_probabilities), codeobj_results in zip(merged, expected):
+        assert [SEGMENTATION_LABELS[label] for label in labels] == [result["entity"] for result in codeobj_results]
+        # merge keeps the result of the first window of each instruction, whose score is the top probability
+        np.testing.assert_allclose(first_probabilities.max(axis=1), [result["score"] for result in codeobj_results])
+
+
+def test_merge_probabilities_breaks_ties_towards_earlier_labels():
+    # two windows vote for different labels with the same weight
+    window_probabilities = [np.array([[0.6, 0.4, 0.0]]), np.array([[0.0, 0.6, 0.4]])]
+    [(labels, first_probabilities)] = merge_probabilities([(0, 0), (0, 1)], window_probabilities, [[0], [0]])
+    assert labels.tolist() == [0]
+    np.testing.assert_array_equal(first_probabilities, window_probabilities[0])
+
+
+def test_top_k_predictions_start_with_the_original():
+    entities = ["B", "I", "E", "B", "B", "I", "I", "E"]
+    scores = np.array([0.99, 0.6, 0.9, 0.55, 0.98, 0.97, 0.7, 0.95])
+    strategy = functools.partial(m_deep_top_k, priority_function=naive_confidence_priority, m=2, k=4)
+    predictions = get_top_k_predictions(strategy, entities, scores)
+    assert predictions[0] == entities
+    assert len(predictions) == 4
+    assert len({tuple(prediction) for prediction in predictions}) == 4
+    # the least confident boundary is changed first
+    assert predictions[1][3] != entities[3]
+
+
+OPCODES = ["LOAD_CONST", "LOAD_FAST", "STORE_NAME", "CALL_FUNCTION", "BINARY_ADD", "RETURN_VALUE", "POP_JUMP_IF_FALSE", "LOAD_ATTR"]
+
+
+@pytest.mark.parametrize(("max_window_size", "step_size"), [(512, 128), (40, 12), (25, 1)])
+def test_token_id_windows_match_tokenizing_each_window(segmentation_tokenizer, max_window_size, step_size):
+    rng = np.random.default_rng(0)
+    # masks above 6 are not in the vocabulary, so some instructions are a single [UNK]
+    requests = [" <SEP> ".join(f"{OPCODES[rng.integers(len(OPCODES))]} <mask_{rng.integers(12)}>" for _ in range(length)) for length in (1, 5, 60)]
+    codeobj_instructions = [request.split(" <SEP> ") for request in requests]
+
+    windows = token_id_windows(segmentation_tokenizer, requests, max_window_size, step_size)
+
+    window_indices = {}
+    for (codeobj_index, window_index), input_ids, indices, starts in windows:
+        window_indices.setdefault(codeobj_index, []).append(indices)
+        assert window_index == len(window_indices[codeobj_index]) - 1
+        # the ids of a window are those of tokenizing its instructions joined by the separator, including [CLS] and [SEP]
+        encoding = segmentation_tokenizer(" <SEP> ".join(codeobj_instructions[codeobj_index][j] for j in indices))
+        assert input_ids == encoding["input_ids"]
+        word_ids = encoding.word_ids()
+        assert starts == [word_ids.index(word_id) for word_id in range(len(indices))]
+        assert len(input_ids) <= max_window_size
+    # every instruction is in a window, in order
+    for codeobj_index, instructions in enumerate(codeobj_instructions):
+        assert sorted(set(itertools.chain.from_iterable(window_indices[codeobj_index]))) == list(range(len(instructions)))
+    if max_window_size < 512:
+        assert len(window_indices[2]) > 1
@@ -0,0 +1,48 @@
+import multiprocessing
+import os
+
+from pylingual.utils.translation_store import _QUERY_CHUNK_SIZE, SqliteTranslationStore
+
+
+def test_get_many_returns_stored_translations(tmp_path):
+    store = SqliteTranslationStore(tmp_path / "translations.db")
+    store.put_many("v3.11", {"a": "x = 1", "b": "y = 2"})
+    store.put_many("v3.12", {"a": "z = 3"})
+    assert store.get_many("v3.11", ["a", "b", "c"]) == {"a": "x = 1", "b": "y = 2"}
+    assert store.get_many("v3.12", ["a", "b"]) == {"a": "z = 3"}
+    assert store.get_many("v3.11", []) == {}
+    store.close()
+
+
+def test_get_many_more_statements_than_a_query_holds(tmp_path):
+    store = SqliteTranslationStore(tmp_path / "translations.db")
+    translations = {f"statement {i}": f"line {i}" for i in range(_QUERY_CHUNK_SIZE * 2 + 7)}
+    store.put_many("v3.11", translations)
+    assert store.get_many("v3.11", [*translations, "missing"]) == translations
+    store.close()
+
+
+def test_persists_across_connections(tmp_path):
+    store = SqliteTranslationStore(tmp_path / "translations.db")
+    store.put_many("v3.11", {"a": "x = 1"})
+    store.close()
+    assert SqliteTranslationStore(tmp_path / "translations.db").get_many("v3.11", ["a"]) == {"a": "x = 1"}
+
+
+def _use_in_child(store: SqliteTranslationStore):
+    inherited = store.connection
+    assert store.get_many("v3.11", ["parent"]) == {"parent": "x = 1"}
+    assert store.connection is not inherited and store.pid == os.getpid()
+    store.put_many("v3.11", {"child": "y = 2"})
+
+
+def test_forked_process_reconnects(tmp_path):
+    store = SqliteTranslationStore(tmp_path / "translations.db")
+    store.put_many("v3.11", {"parent": "x = 1"})
+    process = multiprocessing.get_context("fork").Process(target=_use_in_child, args=(store,))
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+    # the parent's connection is still usable and sees the child's write
+    assert store.get_many("v3.11", ["parent", "child"]) == {"parent": "x = 1", "child": "y = 2"}
+    store.close()